@@ -0,0 +1,98 @@
+import math
+import time
+from collections import deque
+
+
+class GradientLimit:
+    """
+    Limit konkurensi adaptif bergaya Gradient2 (Netflix concurrency-limits).
+
+    Setiap sampel latensi (sudah dinormalisasi per satuan kerja, misalnya per
+    detik audio) memperbarui rata-rata jangka pendek. Gradien = acuan / latensi
+    jangka pendek, dibatasi ke [0.5, 1.0]: latensi di bawah acuan membiarkan
+    limit tumbuh sebesar sqrt(limit) (antrean yang diizinkan), latensi di atas
+    acuan menurunkannya secara multiplikatif tanpa tambahan antrean (untuk
+    limit kecil, sqrt(limit) akan menutupi seluruh penurunan). Acuannya target latensi jika
+    diberikan, selain itu latensi tanpa beban (sampel terkecil, perlahan
+    dilupakan) dikali toleransi.
+    """
+
+    def __init__(self, initial: float, min_limit: int, max_limit: int, target: float = 0.0,
+                 smoothing: float = 0.2, tolerance: float = 1.5, floor_decay: float = 0.002,
+                 history: int = 100):
+        self.limit = float(min(max_limit, max(min_limit, initial)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target = target
+        self.smoothing = smoothing
+        self.tolerance = tolerance
+        self.short = None
+        self.floor = None
+        self.gradient = 1.0
+        self.samples = 0
+        self.floor_decay = floor_decay
+        self._short_alpha = 0.3
+        self.decisions = deque(maxlen=history)
+
+    @property
+    def value(self) -> int:
+        """Limit efektif (jumlah slot yang boleh berjalan bersamaan)."""
+        return max(self.min_limit, int(self.limit))
+
+    def update(self, latency: float, in_flight: int) -> int:
+        """
+        Masukkan satu sampel latensi.
+        Args:
+            latency (float): Latensi ternormalisasi request yang baru selesai
+            in_flight (int): Jumlah request yang berjalan saat request itu selesai
+        Returns:
+            int: Limit efektif yang baru
+        """
+        self.samples += 1
+        if self.short is None:
+            self.short = self.floor = latency
+        else:
+            self.short += self._short_alpha * (latency - self.short)
+            # Latensi tanpa beban naik perlahan di setiap sampel agar perubahan
+            # permanen (model lebih besar, mesin lebih lambat) akhirnya diterima
+            self.floor = min(latency, self.floor * (1 + self.floor_decay))
+
+        baseline = self.target or self.floor * self.tolerance
+        self.gradient = max(0.5, min(1.0, baseline / self.short)) if self.short > 0 else 1.0
+
+        # Beban lebih kecil dari limit: tidak ada bukti limit perlu dinaikkan
+        if self.gradient >= 1.0 and in_flight < self.limit / 2:
+            return self.value
+
+        headroom = math.sqrt(self.limit) if self.gradient >= 1.0 else 0.0
+        proposed = self.limit * self.gradient + headroom
+        new_limit = (1 - self.smoothing) * self.limit + self.smoothing * proposed
+        new_limit = min(self.max_limit, max(self.min_limit, new_limit))
+
+        before = self.value
+        self.limit = new_limit
+        if self.value != before:
+            self.decisions.append({
+                "at": round(time.time(), 3),
+                "from": before,
+                "to": self.value,
+                "latency": round(latency, 4),
+                "short_latency": round(self.short, 4),
+                "baseline": round(baseline, 4),
+                "gradient": round(self.gradient, 3),
+                "in_flight": in_flight,
+            })
+        return self.value
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": self.value,
+            "min": self.min_limit,
+            "max": self.max_limit,
+            "target": self.target or None,
+            "short_latency": round(self.short, 4) if self.short is not None else None,
+            "floor_latency": round(self.floor, 4) if self.floor is not None else None,
+            "gradient": round(self.gradient, 3),
+            "samples": self.samples,
+            "decisions": list(self.decisions),
+        }
@@ -0,0 +1,408 @@
+import io
+import os
+import math
+import wave
+import struct
+import numpy as np
+from scipy.signal import resample_poly
+from fastapi import UploadFile
+from fastapi.responses import JSONResponse
+
+try:
+    import soundfile
+except ImportError:  # tanpa libsndfile, FLAC/Ogg diteruskan apa adanya ke whisper
+    soundfile = None
+
+from app import metrics
+from app.profiling import run_in_threadpool
+from app.transcript_cache import pcm_fingerprint, audio_fingerprint
+
+# Batas upload audio: ukuran body dan durasi audio
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "300"))
+
+# Ukuran potongan saat membaca upload
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+# Header WAV (termasuk chunk LIST/metadata) tidak boleh lebih besar dari ini
+MAX_WAV_HEADER_BYTES = 256 * 1024
+
+# Rentang format WAV yang diterima; buffer PCM dialokasikan dari header
+# sebelum audio dibaca, jadi nilai di luar rentang ini ditolak lebih dulu
+WAV_MIN_SAMPLE_RATE = 8000
+WAV_MAX_SAMPLE_RATE = 192000
+WAV_MAX_CHANNELS = 2
+
+# Path yang menerima upload audio dan dibatasi ukuran body-nya
+UPLOAD_PATHS = ("/voice-chat", "/stt", "/jobs")
+
+# Format yang dipakai whisper; upload lain di-downmix dan di-resample ke sini
+# sekali saat diterima. Upload yang sudah 16 kHz mono (frontend Gradio) langsung dipakai.
+WHISPER_SAMPLE_RATE = 16000
+NORMALIZE_UPLOADS = os.getenv("NORMALIZE_UPLOADS", "1") == "1"
+
+# Format terkompresi lossless yang di-decode ke PCM lewat soundfile
+COMPRESSED_SIGNATURES = {b"fLaC": ".flac", b"OggS": ".ogg"}
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class UploadRejected(Exception):
+    """Upload audio ditolak sebelum diproses (ukuran, durasi, atau format)."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+class AudioUpload:
+    """
+    Audio hasil upload. WAV/FLAC/Ogg disimpan sebagai PCM int16 (interleaved)
+    yang sudah di-decode; format lain disimpan sebagai byte mentah untuk whisper.
+    """
+
+    def __init__(self, filename: str, file_ext: str, pcm=None, sample_rate: int = None,
+                 channels: int = None, raw: bytes = None):
+        self.filename = filename
+        self.file_ext = file_ext
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.raw = raw
+
+    @property
+    def size(self) -> int:
+        return self.pcm.nbytes if self.pcm is not None else len(self.raw)
+
+    @property
+    def duration(self):
+        if self.pcm is None:
+            return None
+        return len(self.pcm) / float(self.channels * self.sample_rate)
+
+    def fingerprint(self) -> str:
+        if self.pcm is not None:
+            return pcm_fingerprint(memoryview(self.pcm).cast("B"), self.channels, 2, self.sample_rate)
+        return audio_fingerprint(self.raw, self.file_ext)
+
+    def slice(self, start: int, end: int) -> "AudioUpload":
+        """Potongan audio [start, end) dalam frame, tanpa menyalin PCM."""
+        pcm = self.pcm[start * self.channels:end * self.channels]
+        return AudioUpload(self.filename, self.file_ext, pcm=pcm, sample_rate=self.sample_rate,
+                           channels=self.channels)
+
+    @classmethod
+    def from_file(cls, path: str) -> "AudioUpload":
+        """Muat kembali audio yang ditulis write_to (misalnya input job yang tersimpan)."""
+        filename = os.path.basename(path)
+        file_ext = os.path.splitext(filename)[1].lower()
+        if file_ext == ".wav":
+            with wave.open(path, "rb") as wav:
+                pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+                return cls(filename, file_ext, pcm=pcm, sample_rate=wav.getframerate(),
+                           channels=wav.getnchannels())
+        with open(path, "rb") as f:
+            return cls(filename, file_ext, raw=f.read())
+
+    def write_to(self, directory: str, name: str = "received_audio") -> str:
+        """Tulis audio sekali ke disk untuk engine STT; PCM ditulis langsung dari buffer."""
+        if self.pcm is not None:
+            path = os.path.join(directory, f"{name}.wav")
+            with wave.open(path, "wb") as wav:
+                wav.setnchannels(self.channels)
+                wav.setsampwidth(2)
+                wav.setframerate(self.sample_rate)
+                wav.writeframes(memoryview(self.pcm).cast("B"))
+            return path
+        path = os.path.join(directory, f"{name}{self.file_ext}")
+        with open(path, "wb") as f:
+            f.write(self.raw)
+        return path
+
+
+def parse_wav_header(buf: bytes):
+    """
+    Parse header RIFF/WAVE sampai awal chunk "data".
+    Returns:
+        tuple | None: (format dict, offset data, ukuran data), atau None jika
+        header belum lengkap di buf
+    Raises:
+        UploadRejected: Jika bukan WAV yang valid
+    """
+    if len(buf) < 12:
+        return None
+    if buf[:4] != b"RIFF" or buf[8:12] != b"WAVE":
+        raise UploadRejected(415, "File bukan WAV yang valid")
+
+    fmt = None
+    offset = 12
+    while True:
+        if len(buf) < offset + 8:
+            return None
+        chunk_id = buf[offset:offset + 4]
+        chunk_size = struct.unpack("<I", buf[offset + 4:offset + 8])[0]
+        if chunk_id == b"data":
+            if fmt is None:
+                raise UploadRejected(415, "Chunk fmt WAV tidak ditemukan")
+            return fmt, offset + 8, chunk_size
+        if len(buf) < offset + 8 + chunk_size:
+            return None
+        if chunk_id == b"fmt ":
+            if chunk_size < 16:
+                raise UploadRejected(415, "Chunk fmt WAV tidak valid")
+            audio_format, channels, sample_rate, _, block_align, bits = struct.unpack(
+                "<HHIIHH", buf[offset + 8:offset + 24]
+            )
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 26:
+                audio_format = struct.unpack("<H", buf[offset + 32:offset + 34])[0]
+            fmt = {
+                "format": audio_format,
+                "channels": channels,
+                "rate": sample_rate,
+                "block_align": block_align,
+                "bits": bits,
+            }
+        offset += 8 + chunk_size + (chunk_size & 1)
+
+
+async def read_upload(upload: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES,
+                      max_seconds: float = MAX_AUDIO_SECONDS) -> AudioUpload:
+    """
+    Baca upload audio per potongan dengan batas ukuran dan durasi.
+    Header WAV divalidasi dari potongan pertama, sehingga file yang salah
+    format atau terlalu panjang ditolak sebelum seluruh isinya dibaca.
+    PCM di-decode bertahap ke buffer int16 yang dialokasikan sekali, lalu
+    dinormalisasi ke 16 kHz mono (FLAC/Ogg dari frontend di-decode dulu).
+    Raises:
+        UploadRejected: Jika upload melanggar batas atau formatnya tidak didukung
+    """
+    filename = os.path.basename(upload.filename or "audio.wav")
+    file_ext = os.path.splitext(filename)[1].lower() or ".wav"
+
+    head = await upload.read(UPLOAD_CHUNK_SIZE)
+    if not head:
+        raise UploadRejected(400, "File audio kosong")
+
+    if head[:4] == b"RIFF":
+        audio = await _read_wav(upload, filename, bytearray(head), max_bytes, max_seconds)
+        return normalize_upload(audio)
+    if file_ext == ".wav":
+        raise UploadRejected(415, "File bukan WAV yang valid")
+
+    raw = await _read_raw(upload, head, max_bytes)
+    compressed_ext = COMPRESSED_SIGNATURES.get(head[:4])
+    if compressed_ext and soundfile is not None:
+        audio = await run_in_threadpool(_decode_compressed, filename, compressed_ext, raw, max_seconds)
+        metrics.inc("upload_bytes", len(raw), format=compressed_ext.lstrip("."))
+        return normalize_upload(audio)
+
+    # Format lain (mp3, ...) diteruskan apa adanya ke whisper; hanya ukurannya dibatasi
+    metrics.inc("upload_bytes", len(raw), format=file_ext.lstrip("."))
+    return AudioUpload(filename, file_ext, raw=raw)
+
+
+async def _read_raw(upload: UploadFile, head: bytes, max_bytes: int) -> bytes:
+    chunks = [head]
+    total = len(head)
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadRejected(413, f"Upload melebihi batas {max_bytes} byte")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def _decode_compressed(filename: str, file_ext: str, raw: bytes, max_seconds: float) -> AudioUpload:
+    """Decode FLAC/Ogg ke PCM int16; durasi dicek dari header sebelum decode."""
+    try:
+        info = soundfile.info(io.BytesIO(raw))
+        if info.frames > max_seconds * info.samplerate:
+            raise UploadRejected(
+                413, f"Durasi audio {info.duration:.1f} detik melebihi batas {max_seconds:.0f} detik"
+            )
+        frames, rate = soundfile.read(io.BytesIO(raw), dtype="int16", always_2d=True)
+    except RuntimeError:
+        raise UploadRejected(415, f"File {file_ext.lstrip('.').upper()} tidak valid")
+    if not len(frames):
+        raise UploadRejected(400, "File audio tidak berisi audio")
+    return AudioUpload(filename, file_ext, pcm=frames.reshape(-1), sample_rate=rate,
+                       channels=frames.shape[1])
+
+
+def normalize_upload(audio: AudioUpload) -> AudioUpload:
+    """
+    Downmix ke mono dan resample ke 16 kHz (format whisper). Audio yang sudah
+    16 kHz mono melewati jalur cepat tanpa salinan atau resampling.
+    """
+    if not NORMALIZE_UPLOADS:
+        return audio
+    if audio.channels == 1 and audio.sample_rate == WHISPER_SAMPLE_RATE:
+        metrics.inc("upload_normalize", path="fast")
+        return audio
+
+    samples = audio.pcm.reshape(-1, audio.channels).astype(np.float32)
+    mono = samples.mean(axis=1) if audio.channels > 1 else samples[:, 0]
+    if audio.sample_rate != WHISPER_SAMPLE_RATE:
+        g = math.gcd(audio.sample_rate, WHISPER_SAMPLE_RATE)
+        mono = resample_poly(mono, WHISPER_SAMPLE_RATE // g, audio.sample_rate // g)
+    pcm = np.clip(mono, -32768, 32767).astype(np.int16)
+    metrics.inc("upload_normalize", path="converted")
+    return AudioUpload(audio.filename, ".wav", pcm=pcm, sample_rate=WHISPER_SAMPLE_RATE, channels=1)
+
+
+async def _read_wav(upload: UploadFile, filename: str, buf: bytearray,
+                    max_bytes: int, max_seconds: float) -> AudioUpload:
+    total = len(buf)
+
+    # Kumpulkan byte sampai header lengkap (chunk fmt dan awal chunk data)
+    header = parse_wav_header(bytes(buf))
+    while header is None:
+        if len(buf) > MAX_WAV_HEADER_BYTES:
+            raise UploadRejected(415, "Header WAV terlalu besar")
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            raise UploadRejected(415, "Header WAV tidak lengkap")
+        buf.extend(chunk)
+        total += len(chunk)
+        header = parse_wav_header(bytes(buf))
+
+    fmt, data_offset, data_size = header
+    channels, rate, bits = fmt["channels"], fmt["rate"], fmt["bits"]
+    if (fmt["format"], bits) == (WAVE_FORMAT_PCM, 16):
+        source_dtype = np.dtype("<i2")
+    elif (fmt["format"], bits) == (WAVE_FORMAT_IEEE_FLOAT, 32):
+        source_dtype = np.dtype("<f4")
+    else:
+        raise UploadRejected(415, "Hanya WAV PCM 16-bit atau float 32-bit yang didukung")
+    if not 1 <= channels <= WAV_MAX_CHANNELS:
+        raise UploadRejected(415, f"WAV harus mono atau stereo (header: {channels} channel)")
+    if not WAV_MIN_SAMPLE_RATE <= rate <= WAV_MAX_SAMPLE_RATE:
+        raise UploadRejected(
+            415, f"Sample rate WAV {rate} Hz di luar rentang {WAV_MIN_SAMPLE_RATE}-{WAV_MAX_SAMPLE_RATE} Hz"
+        )
+
+    # Durasi dari header dicek sebelum data audionya dibaca. Ukuran data 0 atau
+    # 0xFFFFFFFF (WAV hasil streaming) berarti tidak diketahui; batasnya dari max_seconds.
+    max_frames = int(max_seconds * rate)
+    block_align = channels * source_dtype.itemsize
+    declared_frames = None
+    if 0 < data_size < 0xFFFFFFFF:
+        declared_frames = data_size // block_align
+        if declared_frames > max_frames:
+            raise UploadRejected(
+                413, f"Durasi audio {declared_frames / rate:.1f} detik melebihi batas {max_seconds:.0f} detik"
+            )
+    # Buffer tidak pernah lebih besar dari yang bisa diisi oleh max_bytes
+    frames = declared_frames if declared_frames is not None else max_frames
+    capacity = min(frames, max_bytes // block_align) * channels
+    pcm = np.empty(capacity, dtype=np.int16)
+    filled = 0
+
+    pending = bytearray(buf[data_offset:])
+    while True:
+        samples = len(pending) // source_dtype.itemsize
+        if samples:
+            if filled + samples > capacity:
+                if declared_frames is None:
+                    raise UploadRejected(413, f"Durasi audio melebihi batas {max_seconds:.0f} detik")
+                # Sisa byte setelah chunk data (misalnya chunk LIST di akhir file) diabaikan
+                samples = capacity - filled
+            decoded = np.frombuffer(pending, dtype=source_dtype, count=samples)
+            if source_dtype.kind == "f":
+                pcm[filled:filled + samples] = np.clip(decoded, -1.0, 1.0) * 32767
+            else:
+                pcm[filled:filled + samples] = decoded
+            # View numpy harus dilepas sebelum bytearray bisa dipotong
+            del decoded
+            filled += samples
+            del pending[:samples * source_dtype.itemsize]
+
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadRejected(413, f"Upload melebihi batas {max_bytes} byte")
+        if filled < capacity:
+            pending.extend(chunk)
+
+    filled -= filled % channels
+    if filled == 0:
+        raise UploadRejected(400, "File WAV tidak berisi audio")
+    metrics.inc("upload_bytes", total, format="wav")
+    return AudioUpload(filename, ".wav", pcm=pcm[:filled], sample_rate=rate, channels=channels)
+
+
+class BodySizeLimitMiddleware:
+    """
+    Middleware ASGI yang menolak body upload lebih besar dari MAX_UPLOAD_BYTES
+    (plus sedikit ruang untuk overhead multipart) sebelum di-buffer: lewat
+    header Content-Length jika ada, atau dengan menghitung byte yang masuk.
+    path_limits memberi batas sendiri untuk path tertentu (misalnya /jobs).
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES + 64 * 1024, paths=UPLOAD_PATHS,
+                 path_limits: dict = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        max_bytes = self.path_limits.get(scope["path"], self.max_bytes)
+
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                try:
+                    too_large = int(value) > max_bytes
+                except ValueError:
+                    too_large = False
+                if too_large:
+                    metrics.inc("uploads_rejected", reason="too_large")
+                    response = JSONResponse(
+                        status_code=413,
+                        content={"error": f"Upload melebihi batas {max_bytes} byte"},
+                    )
+                    await response(scope, receive, send)
+                    return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # Kirim 413 sekarang, lalu buat aplikasi melihat koneksi terputus
+                    rejected = True
+                    metrics.inc("uploads_rejected", reason="too_large")
+                    response = JSONResponse(
+                        status_code=413,
+                        content={"error": f"Upload melebihi batas {max_bytes} byte"},
+                    )
+                    await response(scope, receive, send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
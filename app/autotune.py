@@ -0,0 +1,325 @@
+import io
+import os
+import sys
+import json
+import glob
+import time
+import wave
+import tempfile
+import platform
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import psutil
+except ImportError:  # tanpa psutil, pinning memakai os.sched_setaffinity (Linux)
+    psutil = None
+
+from app.process_lock import ProcessLock
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Hasil tuning (thread per instance, jumlah instance, core set per slot) per engine
+ENGINE_TUNING_FILE = os.getenv("ENGINE_TUNING_FILE", os.path.join(BASE_DIR, "engine_tuning.json"))
+
+# Jalankan benchmark di background saat startup jika belum ada hasil yang cocok dengan host
+AUTOTUNE_ON_STARTUP = os.getenv("AUTOTUNE_ON_STARTUP", "0") == "1"
+
+# Lock file agar hanya satu worker uvicorn yang menjalankan benchmark startup;
+# worker lain menunggu lalu memuat ulang hasilnya
+AUTOTUNE_LOCK_PATH = os.getenv("AUTOTUNE_LOCK_PATH", f"{ENGINE_TUNING_FILE}.lock")
+
+# Bagian core fisik untuk STT; sisanya untuk TTS, agar kedua engine tidak berebut core
+AUTOTUNE_STT_SHARE = float(os.getenv("AUTOTUNE_STT_SHARE", "0.5"))
+
+# Jumlah ulangan per kombinasi, dan audio contoh untuk benchmark STT
+# (default: 5 detik nada sintetis)
+AUTOTUNE_RUNS = int(os.getenv("AUTOTUNE_RUNS", "2"))
+AUTOTUNE_STT_SAMPLE = os.getenv("AUTOTUNE_STT_SAMPLE", "")
+AUTOTUNE_TTS_TEXT = os.getenv(
+    "AUTOTUNE_TTS_TEXT",
+    "Hari ini cuacanya cerah di sebagian besar wilayah. Suhu udara sekitar tiga puluh derajat.",
+)
+
+STAGES = ("stt", "tts")
+
+
+def cpu_topology() -> list:
+    """
+    Core fisik yang boleh dipakai proses ini.
+    Returns:
+        list: Satu list CPU logis (sibling SMT) per core fisik
+    """
+    if hasattr(os, "sched_getaffinity"):
+        allowed = sorted(os.sched_getaffinity(0))
+    elif psutil is not None:
+        allowed = sorted(psutil.Process().cpu_affinity())
+    else:
+        allowed = list(range(os.cpu_count() or 1))
+
+    if not glob.glob("/sys/devices/system/cpu/cpu*/topology"):
+        # Tanpa sysfs (Windows/macOS): anggap sibling SMT berurutan
+        physical = (psutil.cpu_count(logical=False) if psutil is not None else None) or len(allowed)
+        per_core = max(1, len(allowed) // physical)
+        return [allowed[i:i + per_core] for i in range(0, len(allowed), per_core)]
+
+    cores = {}
+    for cpu in allowed:
+        base = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            with open(f"{base}/physical_package_id") as f:
+                package = int(f.read())
+            with open(f"{base}/core_id") as f:
+                core = int(f.read())
+        except (OSError, ValueError):
+            package, core = 0, cpu
+        cores.setdefault((package, core), []).append(cpu)
+    return [cpus for _, cpus in sorted(cores.items())]
+
+
+def host_signature(cores: list) -> dict:
+    """Identitas host; hasil tuning dari host lain (atau cgroup lain) diabaikan."""
+    return {
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "physical_cores": len(cores),
+        "logical_cpus": sum(len(c) for c in cores),
+    }
+
+
+def partition_cores(cores: list) -> dict:
+    """Bagi core fisik antara STT dan TTS; mesin satu core dipakai bersama."""
+    if len(cores) < 2:
+        return {"stt": cores, "tts": cores}
+    split = min(len(cores) - 1, max(1, round(len(cores) * AUTOTUNE_STT_SHARE)))
+    return {"stt": cores[:split], "tts": cores[split:]}
+
+
+def candidate_layouts(core_count: int) -> list:
+    """Kombinasi (instance, thread per instance) yang tidak melebihi jumlah core."""
+    threads = sorted({t for t in (1, 2, 4, 8, 16, core_count) if t <= core_count})
+    return [
+        (instances, t)
+        for t in threads
+        for instances in range(1, core_count // t + 1)
+        if instances in (1, 2, 3, 4, 6, 8) or instances == core_count // t
+    ]
+
+
+def cpusets(cores: list, instances: int, threads: int) -> list:
+    """Core set (CPU logis) untuk setiap instance: `threads` core fisik per instance."""
+    return [
+        sorted(cpu for core in cores[i * threads:(i + 1) * threads] for cpu in core)
+        for i in range(instances)
+    ]
+
+
+def pin_process(process, cpus):
+    """Pin subprocess engine ke core set-nya (diam-diam dilewati jika tidak didukung)."""
+    if not cpus:
+        return
+    try:
+        if psutil is not None:
+            psutil.Process(process.pid).cpu_affinity(list(cpus))
+        elif hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(process.pid, cpus)
+    except Exception as e:
+        # Termasuk psutil.NoSuchProcess jika proses sudah selesai
+        print(f"[WARNING] Gagal pin proses engine ke CPU {cpus}: {e}")
+
+
+_tuning = None
+_tuning_lock = threading.Lock()
+
+
+def load_tuning() -> dict:
+    """Muat hasil tuning jika ada dan dibuat di host yang sama."""
+    global _tuning
+    try:
+        with open(ENGINE_TUNING_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = None
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Gagal membaca {ENGINE_TUNING_FILE}: {e}")
+        data = None
+    if data is not None and data.get("host") != host_signature(cpu_topology()):
+        print("[WARNING] Hasil tuning engine dibuat di host lain, diabaikan")
+        data = None
+    with _tuning_lock:
+        _tuning = data
+    return data
+
+
+def save_tuning(data: dict):
+    global _tuning
+    tmp_path = f"{ENGINE_TUNING_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, ENGINE_TUNING_FILE)
+    with _tuning_lock:
+        _tuning = data
+
+
+def tuned_instances(stage: str, default: int) -> int:
+    """Jumlah instance engine hasil tuning, untuk ukuran pool slot tahap itu."""
+    config = (_tuning or {}).get(stage)
+    return config["instances"] if config else default
+
+
+def tuned_cpusets(stage: str) -> int:
+    """Jumlah core set hasil tuning untuk tahap ini (0 = tidak ada pinning)."""
+    config = (_tuning or {}).get(stage)
+    return len(config.get("cpusets") or []) if config else 0
+
+
+def engine_settings(stage: str, slot_id=None):
+    """
+    Returns:
+        tuple: (jumlah thread, core set) untuk proses engine di slot ini;
+        (None, None) jika belum ada hasil tuning
+    """
+    config = (_tuning or {}).get(stage)
+    if not config:
+        return None, None
+    sets = config.get("cpusets") or []
+    cpus = sets[slot_id % len(sets)] if sets and slot_id is not None else None
+    return config["threads"], cpus
+
+
+def _sample_wav(seconds: float = 5.0, sample_rate: int = 16000) -> bytes:
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    tone = 0.3 * np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 3 * t)) / 2
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((tone * 32767).astype(np.int16).tobytes())
+    return buf.getvalue()
+
+
+def benchmark(stage: str, run_once, cores: list, runs: int = AUTOTUNE_RUNS) -> dict:
+    """
+    Ukur throughput setiap layout: `instances` proses berjalan bersamaan,
+    masing-masing `threads` thread dan di-pin ke core set sendiri.
+    Args:
+        run_once (callable): run_once(threads, cpus) -> bool (berhasil)
+    Returns:
+        dict: Layout terbaik beserta semua hasil pengukuran
+    """
+    results = []
+    for instances, threads in candidate_layouts(len(cores)):
+        sets = cpusets(cores, instances, threads)
+        elapsed = []
+        ok = True
+        for _ in range(runs):
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=instances) as pool:
+                ok = all(pool.map(lambda cpus: run_once(threads, cpus), sets)) and ok
+            elapsed.append(time.perf_counter() - started)
+        wall = min(elapsed)
+        result = {
+            "instances": instances,
+            "threads": threads,
+            "latency_seconds": round(wall, 3),
+            "throughput_per_second": round(instances / wall, 4),
+            "ok": ok,
+        }
+        print(f"[autotune] {stage}: {result}")
+        results.append(result)
+
+    valid = [r for r in results if r["ok"]]
+    if not valid:
+        raise RuntimeError(f"Semua percobaan benchmark {stage} gagal")
+    # Throughput tertinggi; jika hampir sama (5%), pilih latensi terendah
+    top = max(r["throughput_per_second"] for r in valid)
+    best = min(
+        (r for r in valid if r["throughput_per_second"] >= top * 0.95),
+        key=lambda r: r["latency_seconds"],
+    )
+    return {
+        "instances": best["instances"],
+        "threads": best["threads"],
+        "cpusets": cpusets(cores, best["instances"], best["threads"]),
+        "results": results,
+    }
+
+
+def run_autotune(stages=STAGES) -> dict:
+    """Benchmark engine STT/TTS di host ini dan simpan konfigurasi terbaik."""
+    # Diimpor di sini karena modul engine membaca hasil tuning dari modul ini
+    from app.stt import _run_whisper
+    from app.tts import _tts_with_coqui
+
+    cores = cpu_topology()
+    partitions = partition_cores(cores)
+    data = dict(_tuning or {})
+    data["host"] = host_signature(cores)
+
+    with tempfile.TemporaryDirectory(prefix="autotune_") as work_dir:
+        sample_path = AUTOTUNE_STT_SAMPLE
+        if not sample_path:
+            sample_path = os.path.join(work_dir, "sample.wav")
+            with open(sample_path, "wb") as f:
+                f.write(_sample_wav())
+
+        def run_stt(threads, cpus):
+            result = _run_whisper(sample_path, work_dir, threads=threads, cpus=cpus)
+            return not result.startswith("[ERROR]")
+
+        def run_tts(threads, cpus):
+            with tempfile.TemporaryDirectory(dir=work_dir) as out_dir:
+                result = _tts_with_coqui(AUTOTUNE_TTS_TEXT, out_dir, threads=threads, cpus=cpus)
+            return not result.startswith("[ERROR]")
+
+        runners = {"stt": run_stt, "tts": run_tts}
+        for stage in stages:
+            data[stage] = benchmark(stage, runners[stage], partitions[stage])
+
+    data["tuned_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    save_tuning(data)
+    return data
+
+
+def start_background_autotune():
+    """
+    Saat startup: jalankan tuning di background jika belum ada hasil untuk host ini.
+    Hanya proses yang memegang AUTOTUNE_LOCK_PATH yang melakukan benchmark;
+    proses lain menunggu lock itu lalu memuat ulang ENGINE_TUNING_FILE.
+    Returns:
+        threading.Thread | None: Thread tuning, atau None jika tidak perlu
+    """
+    if not AUTOTUNE_ON_STARTUP or _tuning is not None:
+        return None
+
+    def _run():
+        lock = ProcessLock(AUTOTUNE_LOCK_PATH)
+        if not lock.acquire(blocking=False):
+            print("[autotune] Tuning sedang dijalankan proses lain, menunggu hasilnya")
+            lock.acquire()
+        try:
+            # Proses lain mungkin sudah selesai tuning sebelum lock didapat
+            if load_tuning() is not None:
+                print("[autotune] Memakai hasil tuning dari proses lain")
+                return
+            run_autotune()
+            print("[autotune] Selesai; thread dan pinning langsung dipakai, "
+                  "jumlah instance berlaku setelah restart")
+        except Exception as e:
+            print(f"[WARNING] Auto-tuning engine gagal: {e}")
+        finally:
+            lock.release()
+
+    thread = threading.Thread(target=_run, name="engine-autotune", daemon=True)
+    thread.start()
+    return thread
+
+
+load_tuning()
+
+
+if __name__ == "__main__":
+    stages = tuple(sys.argv[1:]) or STAGES
+    print(json.dumps(run_autotune(stages), indent=2))
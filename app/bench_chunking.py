@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from app.chunking import plan_windows
+
+# Engine tiruan: waktu transkripsi = muat model + durasi audio x real-time factor
+BENCH_CHUNKING_RTF = float(os.getenv("BENCH_CHUNKING_RTF", "0.005"))
+BENCH_CHUNKING_LOAD_SECONDS = float(os.getenv("BENCH_CHUNKING_LOAD_SECONDS", "0.1"))
+
+# Durasi rekaman (detik) dan jumlah slot STT yang diukur
+BENCH_SECONDS = [float(s) for s in os.getenv("BENCH_CHUNKING_SECONDS", "60,300,600").split(",")]
+BENCH_SLOTS = [int(s) for s in os.getenv("BENCH_CHUNKING_SLOTS", "1,2,4").split(",")]
+
+SAMPLE_RATE = 16000
+
+
+def _fake_transcribe(frames: int):
+    time.sleep(BENCH_CHUNKING_LOAD_SECONDS + frames / SAMPLE_RATE * BENCH_CHUNKING_RTF)
+
+
+def _speech_like(seconds: float) -> np.ndarray:
+    """Derau dengan jeda hening 300 ms setiap ~4 detik, seperti ujaran."""
+    rng = np.random.default_rng(0)
+    pcm = rng.integers(-8000, 8000, int(seconds * SAMPLE_RATE), dtype=np.int16)
+    starts = np.arange(4.0, seconds - 1.0, 4.0)
+    for start in starts + rng.uniform(-1.0, 1.0, len(starts)):
+        pcm[int(start * SAMPLE_RATE):int((start + 0.3) * SAMPLE_RATE)] = 0
+    return pcm
+
+
+def run(seconds_list=BENCH_SECONDS, slots_list=BENCH_SLOTS) -> list:
+    """
+    Ukur latensi transkripsi satu rekaman panjang: utuh vs dipecah per slot
+    (plan_windows, termasuk overlap) dengan engine tiruan.
+    Returns:
+        list: Satu baris hasil per (durasi audio, jumlah slot)
+    """
+    results = []
+    for seconds in seconds_list:
+        pcm = _speech_like(seconds)
+        for slots in slots_list:
+            started = time.perf_counter()
+            windows = plan_windows(pcm, SAMPLE_RATE, 1, slots)
+            planned = time.perf_counter() - started
+            with ThreadPoolExecutor(max_workers=slots) as pool:
+                list(pool.map(lambda window: _fake_transcribe(window[1] - window[0]), windows))
+            row = {
+                "audio_seconds": seconds,
+                "slots": slots,
+                "chunks": len(windows),
+                "plan_ms": round(planned * 1000, 2),
+                "total_s": round(time.perf_counter() - started, 3),
+            }
+            print(f"[bench] {row}")
+            results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    seconds = [float(s) for s in sys.argv[1:]] or BENCH_SECONDS
+    print(json.dumps(run(seconds), indent=2))
@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import statistics
+import multiprocessing
+import numpy as np
+
+from app import shm_audio
+
+# Durasi audio (detik, 16 kHz mono int16) yang diukur, dan ulangan per ukuran
+BENCH_SECONDS = [float(s) for s in os.getenv("BENCH_TRANSPORT_SECONDS", "1,10,60,300").split(",")]
+BENCH_RUNS = int(os.getenv("BENCH_TRANSPORT_RUNS", "20"))
+
+SAMPLE_RATE = 16000
+
+
+def _echo_worker(mode: str, requests, responses):
+    """
+    Worker tiruan: membaca audio, menyentuh seluruh isinya, lalu mengirim
+    audio dengan ukuran yang sama kembali (seperti STT masuk dan TTS keluar).
+    """
+    ring = shm_audio.SharedRing() if mode == "shm" else None
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        if mode == "pickle":
+            audio = np.frombuffer(message, dtype=np.int16)
+            checksum = int(audio.sum(dtype=np.int64))
+            responses.put((checksum, audio.tobytes()))
+        elif mode == "file":
+            audio = np.fromfile(message, dtype=np.int16)
+            checksum = int(audio.sum(dtype=np.int64))
+            out_path = f"{message}.out"
+            audio.tofile(out_path)
+            responses.put((checksum, out_path))
+        elif mode == "shm":
+            if message[0] == "release":
+                ring.release(message[1])
+                continue
+            audio = shm_audio.view(message)
+            checksum = int(audio.sum(dtype=np.int64))
+            ref = ring.put(audio, message.sample_rate, message.channels)
+            del audio
+            responses.put((checksum, ref))
+    shm_audio.detach_all()
+    if ring is not None:
+        ring.close()
+
+
+def _round_trip(mode: str, audio: np.ndarray, ring, requests, responses, work_dir: str):
+    if mode == "pickle":
+        requests.put(audio.tobytes())
+        checksum, data = responses.get()
+        result = np.frombuffer(data, dtype=np.int16)
+        return checksum, int(result.sum(dtype=np.int64))
+    if mode == "file":
+        path = os.path.join(work_dir, "audio.pcm")
+        audio.tofile(path)
+        requests.put(path)
+        checksum, out_path = responses.get()
+        result = np.fromfile(out_path, dtype=np.int16)
+        os.remove(path)
+        os.remove(out_path)
+        return checksum, int(result.sum(dtype=np.int64))
+    ref = ring.put(audio, SAMPLE_RATE, 1)
+    try:
+        requests.put(ref)
+        checksum, out_ref = responses.get()
+    finally:
+        ring.release(ref)
+    result = shm_audio.view(out_ref)
+    total = int(result.sum(dtype=np.int64))
+    del result
+    requests.put(("release", out_ref))
+    return checksum, total
+
+
+def run(seconds_list=BENCH_SECONDS, runs: int = BENCH_RUNS) -> list:
+    """
+    Ukur latensi bolak-balik API -> worker -> API untuk setiap transport:
+    bytes di-pickle lewat queue, file sementara, dan ring shared memory.
+    Returns:
+        list: Satu baris hasil per (transport, durasi audio)
+    """
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_transport_") as work_dir:
+        for mode in ("pickle", "file", "shm"):
+            requests, responses = ctx.Queue(), ctx.Queue()
+            worker = ctx.Process(target=_echo_worker, args=(mode, requests, responses), daemon=True)
+            worker.start()
+            ring = shm_audio.SharedRing() if mode == "shm" else None
+            try:
+                for seconds in seconds_list:
+                    rng = np.random.default_rng(0)
+                    audio = rng.integers(-2000, 2000, int(seconds * SAMPLE_RATE), dtype=np.int16)
+                    expected = int(audio.sum(dtype=np.int64))
+                    # Putaran pertama untuk pemanasan (import, attach segmen)
+                    _round_trip(mode, audio, ring, requests, responses, work_dir)
+                    elapsed = []
+                    for _ in range(runs):
+                        started = time.perf_counter()
+                        sent, received = _round_trip(mode, audio, ring, requests, responses, work_dir)
+                        elapsed.append(time.perf_counter() - started)
+                        if sent != expected or received != expected:
+                            raise RuntimeError(f"Checksum {mode} tidak cocok")
+                    row = {
+                        "transport": mode,
+                        "audio_seconds": seconds,
+                        "mbytes": round(audio.nbytes / 1e6, 2),
+                        "p50_ms": round(statistics.median(elapsed) * 1000, 3),
+                        "max_ms": round(max(elapsed) * 1000, 3),
+                    }
+                    print(f"[bench] {row}")
+                    results.append(row)
+            finally:
+                requests.put(None)
+                worker.join(timeout=10)
+                shm_audio.detach_all()
+                if ring is not None:
+                    ring.close()
+    return results
+
+
+if __name__ == "__main__":
+    seconds = [float(s) for s in sys.argv[1:]] or BENCH_SECONDS
+    print(json.dumps(run(seconds), indent=2))
@@ -0,0 +1,45 @@
+import threading
+
+
+class CancelToken:
+    """
+    Tanda pembatalan yang dibagikan ke semua tahap pipeline satu request.
+    Aman dipakai lintas thread: engine yang berjalan di threadpool memeriksa
+    atau menunggu token ini, lalu menghentikan proses engine-nya.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason = None
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._event.wait(timeout)
+
+
+def kill_on_cancel(process, token: CancelToken, poll_interval: float = 0.1):
+    """
+    Matikan subprocess engine begitu token dibatalkan.
+    Thread pengawas berhenti sendiri ketika proses selesai.
+    """
+    if token is None:
+        return
+
+    def _watch():
+        while process.poll() is None:
+            if token.wait(poll_interval):
+                try:
+                    process.kill()
+                except OSError:
+                    pass
+                return
+
+    threading.Thread(target=_watch, name="engine-cancel-watch", daemon=True).start()
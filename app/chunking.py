@@ -0,0 +1,119 @@
+import os
+import re
+import math
+import numpy as np
+
+# Rekaman panjang dipecah di titik hening dan potongannya ditranskrip paralel
+# di pool slot STT; hanya audio yang lebih panjang dari STT_CHUNK_MIN_AUDIO_SECONDS
+STT_CHUNKING = os.getenv("STT_CHUNKING", "1") == "1"
+STT_CHUNK_MIN_AUDIO_SECONDS = float(os.getenv("STT_CHUNK_MIN_AUDIO_SECONDS", "60"))
+
+# Audio dibagi rata ke jumlah slot STT (satu gelombang potongan), tetapi
+# potongan tidak lebih pendek dari ini agar konteks whisper tetap cukup
+STT_CHUNK_MIN_SECONDS = float(os.getenv("STT_CHUNK_MIN_SECONDS", "20"))
+
+# Titik potong dicari di frame paling hening dalam +/- STT_CHUNK_SEARCH_SECONDS
+# dari target; setiap potongan melebar STT_CHUNK_OVERLAP_SECONDS ke tetangganya
+# agar kata di batas tidak terpotong (duplikatnya dibuang saat penggabungan)
+STT_CHUNK_SEARCH_SECONDS = float(os.getenv("STT_CHUNK_SEARCH_SECONDS", "5"))
+STT_CHUNK_OVERLAP_SECONDS = float(os.getenv("STT_CHUNK_OVERLAP_SECONDS", "1.0"))
+
+# Jumlah kata di ujung/awal potongan yang dibandingkan saat membuang duplikat
+MERGE_WINDOW_WORDS = 12
+
+FRAME_SECONDS = 0.02
+
+
+def _frame_energy(pcm: np.ndarray, channels: int, sample_rate: int) -> np.ndarray:
+    """Energi (RMS) per frame 20 ms dari audio int16 interleaved."""
+    mono = pcm.reshape(-1, channels).astype(np.float32).mean(axis=1) if channels > 1 else pcm.astype(np.float32)
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    count = len(mono) // frame
+    frames = mono[:count * frame].reshape(count, frame)
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+
+def plan_windows(pcm: np.ndarray, sample_rate: int, channels: int, workers: int) -> list:
+    """
+    Rencanakan potongan transkripsi untuk satu rekaman.
+    Args:
+        pcm (np.ndarray): PCM int16 interleaved
+        workers (int): Jumlah slot STT yang bisa dipakai bersamaan
+    Returns:
+        list: (frame_awal, frame_akhir) per potongan, sudah termasuk overlap;
+        satu potongan (seluruh audio) jika tidak perlu dipecah
+    """
+    total = len(pcm) // channels
+    duration = total / float(sample_rate)
+    if not STT_CHUNKING or workers < 2 or duration < STT_CHUNK_MIN_AUDIO_SECONDS:
+        return [(0, total)]
+
+    count = max(1, min(workers, math.floor(duration / STT_CHUNK_MIN_SECONDS)))
+    if count == 1:
+        return [(0, total)]
+
+    energy = _frame_energy(pcm, channels, sample_rate)
+    frame = max(1, int(sample_rate * FRAME_SECONDS))
+    search = int(STT_CHUNK_SEARCH_SECONDS / FRAME_SECONDS)
+    cuts = [0]
+    for i in range(1, count):
+        center = int(i * duration / count / FRAME_SECONDS)
+        lo = max(cuts[-1] // frame + 1, center - search)
+        hi = min(len(energy), center + search + 1)
+        if lo >= hi:
+            continue
+        quietest = lo + int(np.argmin(energy[lo:hi]))
+        cuts.append(quietest * frame + frame // 2)
+    cuts.append(total)
+
+    overlap = int(STT_CHUNK_OVERLAP_SECONDS * sample_rate)
+    return [
+        (max(0, start - overlap), min(total, end + overlap))
+        for start, end in zip(cuts[:-1], cuts[1:])
+    ]
+
+
+def _normalize_word(word: str) -> str:
+    return re.sub(r"[^\w]", "", word.lower())
+
+
+def merge_transcripts(texts: list, window: int = MERGE_WINDOW_WORDS) -> str:
+    """
+    Gabungkan transkrip potongan yang saling tumpang tindih. Di setiap batas,
+    deret kata bersama terpanjang antara ekor potongan kiri dan awal potongan
+    kanan dianggap audio overlap: kata setelahnya di kiri dan sebelumnya di
+    kanan (yang sering terpotong di tepi potongan) dibuang, dan deret itu
+    hanya ditulis sekali.
+    """
+    words = []
+    for text in texts:
+        incoming = text.split()
+        if not words:
+            words = incoming
+            continue
+        tail = words[-window:]
+        head = incoming[:window]
+        a = [_normalize_word(w) for w in tail]
+        b = [_normalize_word(w) for w in head]
+
+        # Deret kata bersama terpanjang (longest common substring per kata).
+        # Jika sama panjang, pilih yang paling dekat ke batas (paling akhir di
+        # kiri, paling awal di kanan): pada kata berulang ("ya ya ya ya" /
+        # "ya ya tidak") kecocokan pertama akan membuang kata yang benar diucapkan
+        best, best_i, best_j = 0, 0, 0
+        lengths = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+        for i in range(1, len(a) + 1):
+            for j in range(1, len(b) + 1):
+                if a[i - 1] and a[i - 1] == b[j - 1]:
+                    lengths[i][j] = lengths[i - 1][j - 1] + 1
+                    if (lengths[i][j], i, -j) > (best, best_i, -best_j):
+                        best, best_i, best_j = lengths[i][j], i, j
+
+        # Satu kata yang sama hanya dipercaya jika tepat di ujung dan awal
+        at_edges = best_i == len(a) and best_j == best
+        if best >= 2 or (best == 1 and at_edges):
+            cut = len(words) - len(tail) + best_i
+            words = words[:cut] + incoming[best_j:]
+        else:
+            words = words + incoming
+    return " ".join(words)
@@ -0,0 +1,381 @@
+import os
+import time
+import queue
+import tempfile
+import threading
+import itertools
+import multiprocessing
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+import numpy as np
+import scipy.io.wavfile
+
+from app import metrics
+from app import shm_audio
+from app import stage_pool
+from app.cancellation import CancelToken
+from app.process_lock import ProcessLock
+from app.autotune import engine_settings, pin_process
+from app.stt import resolve_stt_options, _cached_transcription, _run_whisper
+from app.tts import COQUI_MODEL_PATH, COQUI_CONFIG_PATH, COQUI_SPEAKER, _tts_with_coqui
+
+# Jalankan STT/TTS di proses engine worker persisten (satu per slot), dengan
+# audio dikirim lewat shared memory; default mati (subprocess CLI per request)
+ENGINE_WORKERS = os.getenv("ENGINE_WORKERS", "0") == "1"
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Dengan API_WORKERS > 1 hanya satu proses API (pemegang lock file ini) yang
+# menjalankan engine worker, agar model Coqui tidak dimuat sekali per worker API;
+# worker API lain memakai subprocess CLI
+ENGINE_WORKERS_LOCK_PATH = os.getenv("ENGINE_WORKERS_LOCK_PATH", os.path.join(BASE_DIR, "engine_workers.lock"))
+
+# Interval pengecekan worker yang mati saat menunggu hasil job
+ENGINE_WORKER_POLL_SECONDS = float(os.getenv("ENGINE_WORKER_POLL_SECONDS", "1.0"))
+
+STAGES = ("stt", "tts")
+
+
+# === Sisi worker (proses terpisah) ===
+
+def _load_synthesizer(threads: int):
+    """Model Coqui yang tetap dimuat di worker; None jika Coqui tidak bisa diimpor."""
+    try:
+        import torch
+        from TTS.utils.synthesizer import Synthesizer
+    except ImportError:
+        print("[WARNING] Coqui TTS tidak bisa diimpor di engine worker, memakai CLI tts")
+        return None
+    if threads:
+        torch.set_num_threads(threads)
+    try:
+        return Synthesizer(
+            tts_checkpoint=COQUI_MODEL_PATH,
+            tts_config_path=COQUI_CONFIG_PATH,
+            use_cuda=False,
+        )
+    except Exception as e:
+        print(f"[WARNING] Gagal memuat model Coqui di engine worker, memakai CLI tts: {e}")
+        return None
+
+
+def _stt_job(job_id, payload, token, responses, api_ring, threads, cpus):
+    ref, language, profile, stream_segments = payload
+
+    def on_segment(start, end, text):
+        responses.put(("segment", job_id, start, end, text))
+
+    # Audio dibaca langsung dari shared memory milik proses API dan di-pipe
+    # ke stdin whisper-cli, tanpa salinan di queue dan tanpa file di disk
+    pcm = shm_audio.view(ref)
+    try:
+        return _run_whisper(
+            f"shm:{ref.segment}@{ref.offset}",
+            on_segment=on_segment if stream_segments else None,
+            cancel_token=token,
+            language=language,
+            profile=profile,
+            threads=threads,
+            cpus=cpus,
+            pcm=pcm,
+            sample_rate=ref.sample_rate,
+            channels=ref.channels,
+        )
+    finally:
+        del pcm
+        if ref.segment != api_ring:
+            # Segmen overflow hanya dipakai sekali; ring API tetap ter-attach
+            shm_audio.detach(ref.segment)
+
+
+def _tts_job(payload, token, ring, synthesizer, threads, cpus):
+    (text,) = payload
+    if token.cancelled:
+        return "[ERROR] TTS dibatalkan"
+
+    if synthesizer is not None:
+        wav = np.asarray(synthesizer.tts(text, speaker_name=COQUI_SPEAKER), dtype=np.float32)
+        if token.cancelled:
+            return "[ERROR] TTS dibatalkan"
+        audio = (np.clip(wav, -1.0, 1.0) * 32767).astype(np.int16)
+        return ring.put(audio, synthesizer.output_sample_rate, 1)
+
+    # Tanpa model di proses ini: CLI tts, hasilnya tetap dikirim lewat shared memory
+    with tempfile.TemporaryDirectory(prefix="engine_tts_") as tmpdir:
+        path = _tts_with_coqui(text, tmpdir, token, threads=threads, cpus=cpus)
+        if path.startswith("[ERROR]"):
+            return path
+        rate, audio = scipy.io.wavfile.read(path)
+    if audio.dtype != np.int16:
+        audio = (np.clip(audio.astype(np.float32), -1.0, 1.0) * 32767).astype(np.int16)
+    channels = 1 if audio.ndim == 1 else audio.shape[1]
+    return ring.put(audio, rate, channels)
+
+
+def _worker_main(stage: str, index: int, requests, responses, api_ring: str, threads, cpus):
+    """
+    Loop engine worker. Job dikerjakan satu per satu; pesan "cancel" dan
+    "release" ditangani thread listener agar tidak menunggu job berjalan.
+    """
+    if threads:
+        # Harus sebelum PyTorch/OpenMP diimpor
+        os.environ["OMP_NUM_THREADS"] = os.environ["MKL_NUM_THREADS"] = str(threads)
+    pin_process(multiprocessing.current_process(), cpus)
+
+    ring = shm_audio.SharedRing() if stage == "tts" else None
+    synthesizer = _load_synthesizer(threads) if stage == "tts" else None
+    tokens = {}
+    jobs = queue.Queue()
+
+    def listen():
+        while True:
+            message = requests.get()
+            kind = message[0]
+            if kind == "cancel":
+                token = tokens.get(message[1])
+                if token is not None:
+                    token.cancel("client_disconnect")
+            elif kind == "release":
+                ring.release(message[1])
+            elif kind == "stop":
+                jobs.put(None)
+                return
+            else:
+                tokens[message[1]] = CancelToken()
+                jobs.put(message)
+
+    threading.Thread(target=listen, name="engine-worker-listen", daemon=True).start()
+    responses.put(("ready", stage, index, ring.name if ring is not None else None))
+
+    try:
+        while True:
+            message = jobs.get()
+            if message is None:
+                break
+            kind, job_id, payload = message
+            token = tokens[job_id]
+            try:
+                if kind == "stt":
+                    result = _stt_job(job_id, payload, token, responses, api_ring, threads, cpus)
+                else:
+                    result = _tts_job(payload, token, ring, synthesizer, threads, cpus)
+            except Exception as e:
+                result = f"[ERROR] Engine worker {stage} gagal: {e}"
+            finally:
+                tokens.pop(job_id, None)
+            responses.put(("done", job_id, result))
+    finally:
+        shm_audio.detach_all()
+        if ring is not None:
+            ring.close()
+
+
+# === Sisi proses API ===
+
+class WorkerAudio:
+    """
+    Audio hasil TTS yang masih berada di shared memory milik worker.
+    Wajib di-release setelah dipakai agar bloknya bisa dipakai ulang.
+    """
+
+    def __init__(self, ref: shm_audio.AudioRef, requests, ring_name: str):
+        self.ref = ref
+        self.sample_rate = ref.sample_rate
+        self._requests = requests
+        self._ring_name = ring_name
+        self._released = False
+
+    @property
+    def data(self) -> np.ndarray:
+        """View tanpa salinan; jangan disimpan setelah release()."""
+        return shm_audio.view(self.ref)
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        if self.ref.segment != self._ring_name:
+            shm_audio.detach(self.ref.segment)
+        self._requests.put(("release", self.ref))
+
+
+class _Job:
+    def __init__(self, on_segment=None):
+        self.future = Future()
+        self.on_segment = on_segment
+
+
+class EngineWorkers:
+    """
+    Pool engine worker STT/TTS: satu proses per slot stage_pool (sampai
+    plafon limit adaptif), sehingga slot N selalu memakai worker N (dan core
+    set-nya). Hanya pesan kontrol kecil yang lewat queue; audio lewat ring
+    buffer shared memory. Worker yang belum siap (model masih dimuat) dilewati
+    dan pemanggil memakai jalur subprocess biasa. Pool hanya dijalankan oleh
+    satu proses API per host (ENGINE_WORKERS_LOCK_PATH).
+    """
+
+    def __init__(self):
+        self.ring = None
+        self._workers = {}  # (stage, index) -> (process, queue request)
+        self._rings = {}    # (stage, index) -> nama ring milik worker (None untuk STT)
+        self._jobs = {}
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._responses = None
+        self._owner_lock = ProcessLock(ENGINE_WORKERS_LOCK_PATH)
+
+    @property
+    def running(self) -> bool:
+        return self.ring is not None
+
+    def start(self):
+        if not ENGINE_WORKERS or self.ring is not None:
+            return
+        if not self._owner_lock.acquire(blocking=False):
+            print("[WARNING] Engine worker sudah dijalankan proses API lain; "
+                  "proses ini memakai subprocess CLI untuk STT/TTS")
+            return
+        ctx = multiprocessing.get_context("spawn")
+        self.ring = shm_audio.SharedRing()
+        self._responses = ctx.Queue()
+        for stage in STAGES:
+            for index in range(stage_pool.pools[stage].max_size):
+                threads, cpus = engine_settings(stage, index)
+                requests = ctx.Queue()
+                process = ctx.Process(
+                    target=_worker_main,
+                    args=(stage, index, requests, self._responses, self.ring.name, threads, cpus),
+                    name=f"engine-{stage}-{index}",
+                    daemon=True,
+                )
+                process.start()
+                self._workers[(stage, index)] = (process, requests)
+        threading.Thread(target=self._read_responses, name="engine-worker-responses", daemon=True).start()
+
+    def stop(self):
+        if self.ring is None:
+            return
+        for process, requests in self._workers.values():
+            requests.put(("stop",))
+        for process, _ in self._workers.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._responses.put(("stop",))
+        self._workers.clear()
+        self._rings.clear()
+        shm_audio.detach_all()
+        self.ring.close()
+        self.ring = None
+        self._owner_lock.release()
+
+    def _read_responses(self):
+        while True:
+            message = self._responses.get()
+            kind = message[0]
+            if kind == "stop":
+                return
+            if kind == "ready":
+                _, stage, index, ring_name = message
+                self._rings[(stage, index)] = ring_name
+                print(f"[INFO] Engine worker {stage}-{index} siap")
+                continue
+            with self._lock:
+                job = self._jobs.get(message[1])
+            if job is None:
+                continue
+            if kind == "segment":
+                try:
+                    job.on_segment(*message[2:])
+                except Exception as e:
+                    print(f"[WARNING] Callback segmen gagal: {e}")
+            elif kind == "done":
+                job.future.set_result(message[2])
+
+    def _worker_for(self, stage: str):
+        if self.ring is None:
+            return None
+        slot = stage_pool.current_slot.get() or 0
+        key = (stage, slot % stage_pool.pools[stage].max_size)
+        if key not in self._rings or key not in self._workers:
+            return None
+        process, requests = self._workers[key]
+        if not process.is_alive():
+            return None
+        return key, process, requests
+
+    def available(self, stage: str) -> bool:
+        """True jika worker untuk slot yang sedang dipegang sudah siap."""
+        return self._worker_for(stage) is not None
+
+    def _call(self, worker, payload, on_segment=None, cancel_token=None):
+        if worker is None:
+            return "[ERROR] Engine worker tidak tersedia"
+        key, process, requests = worker
+        stage = key[0]
+        job_id = next(self._job_ids)
+        job = _Job(on_segment)
+        with self._lock:
+            self._jobs[job_id] = job
+        cancel_sent = False
+        try:
+            requests.put((stage, job_id, payload))
+            while True:
+                try:
+                    return job.future.result(timeout=ENGINE_WORKER_POLL_SECONDS)
+                except FutureTimeout:
+                    pass
+                if cancel_token is not None and cancel_token.cancelled and not cancel_sent:
+                    requests.put(("cancel", job_id))
+                    cancel_sent = True
+                if not process.is_alive():
+                    metrics.inc("engine_worker_died", stage=stage)
+                    return f"[ERROR] Engine worker {stage}-{key[1]} berhenti"
+        finally:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+
+    def transcribe(self, pcm: np.ndarray, sample_rate: int, channels: int, fingerprint: str = None,
+                   on_segment=None, cancel_token=None, language: str = None,
+                   profile: str = None) -> str:
+        """
+        Transkrip PCM int16 di engine worker STT slot ini (lewat transcript cache).
+        Returns:
+            str: Teks hasil transkripsi, atau pesan "[ERROR] ..."
+        """
+        language, profile = resolve_stt_options(language, profile)
+
+        def run():
+            ref = self.ring.put(pcm, sample_rate, channels)
+            started = time.perf_counter()
+            try:
+                result = self._call(self._worker_for("stt"),
+                                    (ref, language, profile, on_segment is not None),
+                                    on_segment, cancel_token)
+            finally:
+                # Worker sudah selesai membaca (atau mati): blok langsung bebas
+                self.ring.release(ref)
+            # Metrik worker tidak terlihat dari proses API; RTF dicatat di sini
+            seconds = len(pcm) / float(channels * sample_rate)
+            if seconds and not result.startswith("[ERROR]"):
+                metrics.observe("stt_real_time_factor", (time.perf_counter() - started) / seconds,
+                                profile=profile)
+            return result
+
+        return _cached_transcription(fingerprint, language, profile, run)
+
+    def synthesize(self, text: str, cancel_token=None):
+        """
+        Sintesis teks di engine worker TTS slot ini.
+        Returns:
+            WorkerAudio | str: Audio di shared memory, atau pesan "[ERROR] ..."
+        """
+        worker = self._worker_for("tts")
+        result = self._call(worker, (text,), cancel_token=cancel_token)
+        if isinstance(result, str):
+            return result
+        key, _, requests = worker
+        return WorkerAudio(result, requests, self._rings[key])
+
+
+engine_workers = EngineWorkers()
@@ -0,0 +1,268 @@
+import io
+import os
+import json
+import time
+import wave
+import asyncio
+import threading
+import requests
+from starlette.concurrency import run_in_threadpool
+
+from app import stage_pool
+from app.process_lock import ProcessLock
+from app.stt import WHISPER_BINARY, WHISPER_MODEL_PATH, _transcribe_with_whisper
+from app.tts import COQUI_MODEL_PATH, COQUI_CONFIG_PATH, transcribe_text_to_speech
+from app.llm import MODEL, GOOGLE_API_KEY, GEMINI_BASE_URL
+
+# Interval refresh probe di background (detik). Probe STT/TTS memuat model,
+# jadi sengaja tidak dijalankan terlalu sering dan tidak pernah di jalur request.
+HEALTH_PROBE_TTL = float(os.getenv("HEALTH_PROBE_TTL", "300"))
+
+# Endpoint yang dicek untuk memastikan LLM bisa dijangkau
+LLM_HEALTH_URL = os.getenv(
+    "LLM_HEALTH_URL",
+    f"{(GEMINI_BASE_URL or 'https://generativelanguage.googleapis.com').rstrip('/')}/v1beta/models/{MODEL}",
+)
+LLM_HEALTH_TIMEOUT = float(os.getenv("LLM_HEALTH_TIMEOUT", "5"))
+
+# Probe transkripsi/sintesis sintetis bisa dimatikan (misal di mesin kecil),
+# sisanya tetap berjalan
+HEALTH_SYNTHETIC_PROBES = os.getenv("HEALTH_SYNTHETIC_PROBES", "1") == "1"
+
+# Probe yang dianggap wajib; jika gagal status menjadi "unhealthy"
+CRITICAL_PROBES = ("stt_binary", "tts_model")
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Dengan API_WORKERS > 1 hanya satu worker (pemegang lock) yang menjalankan
+# probe; hasilnya ditulis ke file dan dibaca worker lain setiap
+# HEALTH_FOLLOW_INTERVAL detik
+HEALTH_LOCK_PATH = os.getenv("HEALTH_LOCK_PATH", os.path.join(BASE_DIR, "health_probe.lock"))
+HEALTH_RESULTS_PATH = os.getenv("HEALTH_RESULTS_PATH", os.path.join(BASE_DIR, "health_probe.json"))
+HEALTH_FOLLOW_INTERVAL = float(os.getenv("HEALTH_FOLLOW_INTERVAL", "10"))
+
+# Input probe sintetis
+PROBE_SILENCE_SECONDS = 1.0
+PROBE_TEXT = "tes"
+
+# Probe yang memuat model berjalan di slot tahapnya (dengan cost seperti
+# request biasa), sehingga ikut antre admission control dan tidak menambah
+# beban di atas limit saat trafik sedang ramai
+SLOT_PROBES = {
+    "stt_transcribe": ("stt", PROBE_SILENCE_SECONDS),
+    "tts_synthesize": ("tts", len(PROBE_TEXT) / 100.0),
+}
+
+
+def _silence_wav(seconds: float = 1.0, sample_rate: int = 16000) -> bytes:
+    """Buat file WAV hening (16-bit mono) untuk probe transkripsi sintetis."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"\x00\x00" * int(seconds * sample_rate))
+    return buf.getvalue()
+
+
+def probe_stt_binary():
+    if not os.path.isfile(WHISPER_BINARY):
+        return False, f"binary tidak ditemukan: {WHISPER_BINARY}"
+    if not os.access(WHISPER_BINARY, os.X_OK):
+        return False, f"binary tidak bisa dieksekusi: {WHISPER_BINARY}"
+    if not os.path.isfile(WHISPER_MODEL_PATH):
+        return False, f"model tidak ditemukan: {WHISPER_MODEL_PATH}"
+    return True, "ok"
+
+
+def probe_tts_model():
+    for path in (COQUI_MODEL_PATH, COQUI_CONFIG_PATH):
+        if not os.path.isfile(path):
+            return False, f"file tidak ditemukan: {path}"
+    return True, "ok"
+
+
+def probe_stt_transcribe():
+    # Langsung ke whisper (tanpa transcript cache) agar engine benar-benar dijalankan
+    result = _transcribe_with_whisper(_silence_wav(PROBE_SILENCE_SECONDS), ".wav")
+    if result.startswith("[ERROR]"):
+        return False, result
+    return True, "ok"
+
+
+def probe_tts_synthesize():
+    path = transcribe_text_to_speech(PROBE_TEXT)
+    if path.startswith("[ERROR]"):
+        return False, path
+    try:
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return False, "file audio hasil sintesis kosong"
+        return True, "ok"
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def probe_llm():
+    if not GOOGLE_API_KEY or GOOGLE_API_KEY == "dummy_key":
+        return False, "GEMINI_API_KEY tidak diset"
+    try:
+        response = requests.get(
+            LLM_HEALTH_URL,
+            headers={"x-goog-api-key": GOOGLE_API_KEY},
+            timeout=LLM_HEALTH_TIMEOUT,
+        )
+    except requests.RequestException as e:
+        return False, f"tidak bisa dijangkau: {e}"
+    if response.status_code in (401, 403):
+        return False, f"API key ditolak (HTTP {response.status_code})"
+    if response.status_code >= 500:
+        return False, f"HTTP {response.status_code}"
+    return True, "ok"
+
+
+PROBES = {
+    "stt_binary": probe_stt_binary,
+    "tts_model": probe_tts_model,
+    "llm": probe_llm,
+}
+if HEALTH_SYNTHETIC_PROBES:
+    PROBES["stt_transcribe"] = probe_stt_transcribe
+    PROBES["tts_synthesize"] = probe_tts_synthesize
+
+
+async def _probe_in_slot(stage: str, cost: float, probe):
+    async with stage_pool.acquire(stage, cost=cost):
+        return await run_in_threadpool(probe)
+
+
+class HealthMonitor:
+    """
+    Menjalankan semua probe di thread background setiap HEALTH_PROBE_TTL detik
+    dan menyimpan hasil terakhir, sehingga /health cukup membaca cache.
+    Hanya satu proses (pemegang HEALTH_LOCK_PATH) yang menjalankan probe;
+    proses lain memakai hasil yang dipublikasikannya.
+    """
+
+    def __init__(self, probes=PROBES, ttl: float = HEALTH_PROBE_TTL,
+                 lock_path: str = HEALTH_LOCK_PATH, results_path: str = HEALTH_RESULTS_PATH):
+        self.probes = probes
+        self.ttl = ttl
+        self.results_path = results_path
+        self._owner_lock = ProcessLock(lock_path)
+        self._results = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._event_loop = None
+
+    def start(self, loop: asyncio.AbstractEventLoop = None):
+        """
+        Args:
+            loop: Event loop aplikasi; probe di SLOT_PROBES mengambil slot
+                stage_pool lewat loop ini (tanpa loop, probe langsung jalan)
+        """
+        if self._thread is not None:
+            return
+        self._event_loop = loop
+        self._thread = threading.Thread(target=self._loop, name="health-probe", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._owner_lock.release()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.tick())
+
+    def tick(self) -> float:
+        """
+        Satu putaran: probe dan publikasikan hasil jika proses ini pemegang lock,
+        selain itu baca hasil pemegang lock.
+        Returns:
+            float: Detik sampai putaran berikutnya
+        """
+        if self._owner_lock.acquire(blocking=False):
+            self.run_once()
+            self._publish()
+            return self.ttl
+        self._load_published()
+        return min(self.ttl, HEALTH_FOLLOW_INTERVAL)
+
+    def _publish(self):
+        with self._lock:
+            data = json.dumps(self._results)
+        tmp_path = f"{self.results_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, self.results_path)
+        except OSError as e:
+            print(f"[WARNING] Gagal menulis hasil probe {self.results_path}: {e}")
+
+    def _load_published(self):
+        try:
+            with open(self.results_path, "r", encoding="utf-8") as f:
+                results = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Gagal membaca hasil probe {self.results_path}: {e}")
+            return
+        with self._lock:
+            self._results = results
+
+    def _run_probe(self, name: str, probe):
+        if name not in SLOT_PROBES or self._event_loop is None:
+            return probe()
+        stage, cost = SLOT_PROBES[name]
+        future = asyncio.run_coroutine_threadsafe(_probe_in_slot(stage, cost, probe), self._event_loop)
+        return future.result()
+
+    def run_once(self):
+        for name, probe in self.probes.items():
+            started = time.perf_counter()
+            try:
+                ok, detail = self._run_probe(name, probe)
+            except Exception as e:
+                ok, detail = False, f"probe error: {e}"
+            result = {
+                "status": "ok" if ok else "fail",
+                "detail": detail,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                "checked_at": time.time(),
+            }
+            with self._lock:
+                self._results[name] = result
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            results = dict(self._results)
+
+        now = time.time()
+        components = {}
+        for name in self.probes:
+            result = results.get(name)
+            if result is None:
+                components[name] = {"status": "pending"}
+                continue
+            result = dict(result)
+            result["age_s"] = round(now - result["checked_at"], 1)
+            if result["age_s"] > 2 * self.ttl:
+                result["stale"] = True
+            components[name] = result
+
+        if any(c["status"] == "pending" for c in components.values()):
+            status = "starting"
+        elif any(components[n]["status"] == "fail" for n in CRITICAL_PROBES if n in components):
+            status = "unhealthy"
+        elif any(c["status"] == "fail" or c.get("stale") for c in components.values()):
+            status = "degraded"
+        else:
+            status = "healthy"
+
+        return {"status": status, "components": components}
+
+
+monitor = HealthMonitor()
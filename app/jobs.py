@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import asyncio
+import threading
+from starlette.concurrency import run_in_threadpool
+
+from app import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Antrean job (SQLite) dan direktori audio input/hasil job; keduanya tetap ada
+# setelah restart dan dipakai bersama oleh semua worker uvicorn
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(BASE_DIR, "jobs.db"))
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(BASE_DIR, "jobs"))
+
+# Jumlah job yang dikerjakan bersamaan per worker API (0 = worker ini tidak
+# mengambil job, misalnya hanya menerima submit)
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "1"))
+
+# Batas upload /jobs; lebih longgar dari endpoint sinkron (MAX_AUDIO_SECONDS,
+# MAX_UPLOAD_BYTES) karena mode ini memang untuk rekaman panjang
+JOB_MAX_AUDIO_SECONDS = float(os.getenv("JOB_MAX_AUDIO_SECONDS", "3600"))
+JOB_MAX_UPLOAD_BYTES = int(os.getenv("JOB_MAX_UPLOAD_BYTES", str(256 * 1024 * 1024)))
+
+# Interval polling antrean (dan event SSE) saat tidak ada perubahan
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "0.5"))
+
+# Job yang sedang berjalan memegang lease; lease diperpanjang selama worker
+# hidup, dan job dengan lease kedaluwarsa (worker mati/restart) diambil ulang
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Job yang sudah selesai/gagal (beserta audionya) dihapus setelah sekian detik
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+
+FINAL_STATUSES = ("done", "failed")
+
+_local = threading.local()
+
+_COLUMNS = (
+    "job_id", "status", "stage", "session_id", "language", "stt_profile", "input_path",
+    "transcription", "reply", "audio_path", "error", "attempts", "timings",
+    "created_at", "updated_at",
+)
+
+
+def _connect() -> sqlite3.Connection:
+    """Satu koneksi per thread; SQLite dalam mode WAL aman dipakai lintas proses."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " stage TEXT,"
+            " session_id TEXT NOT NULL,"
+            " language TEXT,"
+            " stt_profile TEXT,"
+            " input_path TEXT NOT NULL,"
+            " transcription TEXT,"
+            " reply TEXT,"
+            " audio_path TEXT,"
+            " error TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " timings TEXT,"
+            " lease_owner TEXT,"
+            " lease_expires REAL,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        _local.conn = conn
+    return conn
+
+
+def _update(job_id: str, owner: str = None, **fields):
+    """Update kolom job; dengan owner, hanya jika lease masih dipegang worker ini."""
+    fields["updated_at"] = time.time()
+    sql = f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE job_id = ?"
+    params = list(fields.values()) + [job_id]
+    if owner is not None:
+        sql += " AND lease_owner = ?"
+        params.append(owner)
+    return _connect().execute(sql, params).rowcount == 1
+
+
+def job_dir(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, job_id)
+
+
+def submit_job(upload, session_id: str, language: str, stt_profile: str) -> str:
+    """
+    Simpan audio upload dan masukkan job ke antrean.
+    Returns:
+        str: ID job
+    """
+    job_id = uuid.uuid4().hex
+    directory = job_dir(job_id)
+    os.makedirs(directory, exist_ok=True)
+    input_path = upload.write_to(directory, name="input")
+    now = time.time()
+    _connect().execute(
+        "INSERT INTO jobs (job_id, status, session_id, language, stt_profile, input_path,"
+        " created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+        (job_id, session_id, language, stt_profile, input_path, now, now),
+    )
+    metrics.inc("jobs_submitted")
+    return job_id
+
+
+def get_job(job_id: str):
+    """
+    Returns:
+        dict | None: Data job (termasuk path internal, lihat public_view), atau None
+    """
+    row = _connect().execute(
+        f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    job = dict(zip(_COLUMNS, row))
+    job["timings"] = json.loads(job["timings"]) if job["timings"] else {}
+    if job["status"] == "queued":
+        job["queue_position"] = _connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?",
+            (job["created_at"],),
+        ).fetchone()[0]
+    return job
+
+
+def public_view(job: dict) -> dict:
+    """Status job untuk klien, tanpa path internal."""
+    view = {k: v for k, v in job.items() if k not in ("input_path", "audio_path")}
+    view["audio_ready"] = job["status"] == "done" and bool(job["audio_path"])
+    return view
+
+
+def claim_job(owner: str):
+    """
+    Ambil job antrean tertua (atau job yang lease-nya kedaluwarsa) secara atomik.
+    Returns:
+        dict | None: Job yang sekarang dipegang owner
+    """
+    conn = _connect()
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT job_id, attempts FROM jobs"
+            " WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?)"
+            " ORDER BY created_at LIMIT 1",
+            (now,),
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        job_id, attempts = row
+        if attempts >= JOB_MAX_ATTEMPTS:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', stage = NULL, lease_owner = NULL,"
+                " error = ?, updated_at = ? WHERE job_id = ?",
+                (f"[ERROR] Job gagal setelah {attempts} percobaan", now, job_id),
+            )
+            conn.execute("COMMIT")
+            metrics.inc("jobs_finished", status="failed")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', stage = NULL, attempts = attempts + 1,"
+            " lease_owner = ?, lease_expires = ?, updated_at = ? WHERE job_id = ?",
+            (owner, now + JOB_LEASE_SECONDS, now, job_id),
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if attempts:
+        metrics.inc("jobs_reclaimed")
+    return get_job(job_id)
+
+
+def remove_expired_jobs(retention: float = JOB_RETENTION_SECONDS) -> int:
+    """Hapus job final yang lebih tua dari retention beserta audionya."""
+    cutoff = time.time() - retention
+    rows = _connect().execute(
+        "SELECT job_id FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+        (cutoff,),
+    ).fetchall()
+    for (job_id,) in rows:
+        shutil.rmtree(job_dir(job_id), ignore_errors=True)
+        _connect().execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+    return len(rows)
+
+
+class JobRunner:
+    """
+    Mengambil job dari antrean SQLite dan menjalankan pipeline voice turn.
+    Setiap worker API menjalankan runner sendiri dan mengambil job sesuai
+    kapasitasnya (JOB_CONCURRENCY); stage_pool tetap membatasi engine.
+    """
+
+    def __init__(self, concurrency: int = JOB_CONCURRENCY):
+        self.concurrency = concurrency
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks = []
+
+    def start(self):
+        if self._tasks or self.concurrency <= 0:
+            return
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        self._tasks = [asyncio.ensure_future(self._loop()) for _ in range(self.concurrency)]
+        self._tasks.append(asyncio.ensure_future(self._sweep_loop()))
+
+    async def stop(self):
+        # Job yang terputus di sini diambil ulang setelah lease-nya kedaluwarsa
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _loop(self):
+        while True:
+            try:
+                job = await run_in_threadpool(claim_job, self.owner)
+            except sqlite3.Error as e:
+                print(f"[WARNING] Gagal mengambil job: {e}")
+                job = None
+            if job is None:
+                await asyncio.sleep(JOB_POLL_SECONDS)
+                continue
+            await self.run(job)
+
+    async def _sweep_loop(self):
+        while True:
+            try:
+                removed = await run_in_threadpool(remove_expired_jobs)
+                if removed:
+                    metrics.inc("jobs_expired", removed)
+            except sqlite3.Error as e:
+                print(f"[WARNING] Gagal membersihkan job lama: {e}")
+            await asyncio.sleep(max(60.0, JOB_RETENTION_SECONDS / 24))
+
+    async def _heartbeat(self, job_id: str):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            await run_in_threadpool(
+                _update, job_id, self.owner, lease_expires=time.time() + JOB_LEASE_SECONDS
+            )
+
+    async def run(self, job: dict):
+        # Diimpor di sini karena pipeline memuat engine dan LLM
+        from app.audio_io import AudioUpload
+        from app.pipeline import run_voice_turn, StageError
+        from app.scratch import create_request_dir, remove_request_dir
+
+        job_id = job["job_id"]
+        heartbeat = asyncio.ensure_future(self._heartbeat(job_id))
+        request_dir = create_request_dir(prefix="job_")
+        timings = {}
+
+        def on_stage(stage: str):
+            # Progres tahap untuk polling/SSE; tidak perlu ditunggu
+            asyncio.ensure_future(run_in_threadpool(_update, job_id, self.owner, stage=stage))
+
+        started = time.perf_counter()
+        try:
+            upload = await run_in_threadpool(AudioUpload.from_file, job["input_path"])
+            result = await run_voice_turn(
+                upload,
+                job["session_id"],
+                request_dir,
+                timings=timings,
+                language=job["language"],
+                stt_profile=job["stt_profile"],
+                on_stage=on_stage,
+            )
+            audio_path = os.path.join(job_dir(job_id), "reply.wav")
+            shutil.move(result["audio_path"], audio_path)
+            await run_in_threadpool(
+                _update, job_id, self.owner,
+                status="done", stage=None, transcription=result["transcription"].strip(),
+                reply=result["reply"], audio_path=audio_path, error=None,
+                timings=json.dumps(timings), lease_owner=None,
+            )
+            metrics.inc("jobs_finished", status="done")
+            metrics.observe("job_run_seconds", time.perf_counter() - started)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            message = e.message if isinstance(e, StageError) else f"[ERROR] {e}"
+            print(f"[ERROR] Job {job_id} gagal: {message}")
+            await run_in_threadpool(
+                _update, job_id, self.owner,
+                status="failed", error=message, timings=json.dumps(timings), lease_owner=None,
+            )
+            metrics.inc("jobs_finished", status="failed")
+        finally:
+            heartbeat.cancel()
+            remove_request_dir(request_dir)
+
+
+job_runner = JobRunner()
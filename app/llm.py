@@ -2,9 +2,18 @@ import os
 import tempfile
 from google import genai
 from google.genai import types
+from google.genai import errors as genai_errors
 from pydantic import TypeAdapter
 from dotenv import load_dotenv
 
+from app.session_store import (
+    DEFAULT_SESSION_ID,
+    load_history,
+    save_history,
+)
+from app.llm_cache import ContextCache
+from app import metrics
+
 load_dotenv()
 
 MODEL = "gemini-2.0-flash"
@@ -18,7 +27,12 @@ if not GOOGLE_API_KEY:
     # Fallback untuk kebutuhan testing
     GOOGLE_API_KEY = "dummy_key"
 
+# Base URL API Gemini; bisa diarahkan ke stub lokal untuk pengujian
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "")
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# File riwayat lama (sebelum ada session store); hanya dipakai untuk migrasi
 CHAT_HISTORY_FILE = os.path.join(BASE_DIR, "chat_history.json")
 
 # Log file untuk komunikasi dengan Gradio
@@ -45,77 +59,122 @@ If you're unsure about an answer, be honest and say that you don't know.
 """
 
 # Inisialisasi klien Gemini dan konfigurasi prompt
-client = genai.Client(api_key=GOOGLE_API_KEY)
+client = genai.Client(
+    api_key=GOOGLE_API_KEY,
+    http_options=types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None,
+)
 chat_config = types.GenerateContentConfig(system_instruction=system_instruction)
 history_adapter = TypeAdapter(list[types.Content])
 
+# Prompt sistem dan riwayat lama dikirim sebagai cached content
+context_cache = ContextCache(client, MODEL, system_instruction)
+
+class PrefixedChat:
+    """Chat yang awal riwayatnya ada di cached content, bukan di objek chat."""
+
+    def __init__(self, chat, prefix: list):
+        self.chat = chat
+        self.prefix = prefix
+
+    def get_history(self) -> list:
+        return self.prefix + self.chat.get_history()
+
+def _record_usage(response):
+    usage = response.usage_metadata
+    if usage is not None and usage.cached_content_token_count:
+        metrics.inc("llm_cached_tokens", usage.cached_content_token_count)
+
+def _is_stale_cache(error: Exception) -> bool:
+    # Handle yang sudah kedaluwarsa/dihapus di server ditolak dengan 4xx
+    return isinstance(error, genai_errors.ClientError) and error.code in (400, 403, 404)
+
 # Fungsi untuk menyimpan/memuat riwayat chat
 def export_chat_history(chat) -> str:
     return history_adapter.dump_json(chat.get_history()).decode("utf-8")
 
-def save_chat_history(chat):
+def save_chat_history(chat, session_id: str = DEFAULT_SESSION_ID):
     try:
-        json_history = export_chat_history(chat)
-        with open(CHAT_HISTORY_FILE, "w", encoding="utf-8") as f:
-            f.write(json_history)
+        save_history(session_id, export_chat_history(chat))
     except Exception as e:
         print(f"[ERROR] Gagal menyimpan history chat: {e}")
 
-def load_chat_history():
-    if not os.path.exists(CHAT_HISTORY_FILE):
-        return client.chats.create(model=MODEL, config=chat_config)
-    
-    if os.path.getsize(CHAT_HISTORY_FILE) == 0:
-        return client.chats.create(model=MODEL, config=chat_config)
-
-    with open(CHAT_HISTORY_FILE, "r", encoding="utf-8") as f:
-        json_str = f.read().strip()
+def _load_history_contents(session_id: str) -> list:
+    try:
+        json_str = load_history(session_id)
+    except Exception as e:
+        print(f"[ERROR] Gagal membaca session store: {e}")
+        return []
 
     if not json_str:
-        return client.chats.create(model=MODEL, config=chat_config)
+        return []
 
     try:
-        history = history_adapter.validate_json(json_str)
-        return client.chats.create(model=MODEL, config=chat_config, history=history)
+        return history_adapter.validate_json(json_str)
     except Exception as e:
         print(f"[ERROR] Gagal load history chat: {e}")
-        return client.chats.create(model=MODEL, config=chat_config)
+        return []
 
-# Inisialisasi sesi chat saat aplikasi dimulai
-try:
-    chat = load_chat_history()
-except Exception as e:
-    print(f"[ERROR] Gagal inisialisasi chat: {e}")
-    # Fallback untuk kebutuhan testing
-    chat = None
-
-# Kirim prompt ke LLM dan kembalikan respons teks
-def generate_response(prompt: str) -> str:
-    if not GOOGLE_API_KEY or GOOGLE_API_KEY == "dummy_key":
-        print("[WARNING] Menggunakan respons dummy karena tidak ada GEMINI_API_KEY")
-        return "Maaf, saya tidak bisa merespons saat ini karena masalah konfigurasi."
-        
+def _migrate_legacy_history():
+    """Pindahkan chat_history.json lama ke sesi default jika sesi itu belum ada."""
+    if not os.path.exists(CHAT_HISTORY_FILE) or os.path.getsize(CHAT_HISTORY_FILE) == 0:
+        return
+    try:
+        if load_history(DEFAULT_SESSION_ID) is not None:
+            return
+        with open(CHAT_HISTORY_FILE, "r", encoding="utf-8") as f:
+            json_str = f.read().strip()
+        if json_str:
+            history_adapter.validate_json(json_str)
+            save_history(DEFAULT_SESSION_ID, json_str)
+    except Exception as e:
+        print(f"[ERROR] Gagal migrasi history chat lama: {e}")
+
+_migrate_legacy_history()
+
+DUMMY_RESPONSE = "Maaf, saya tidak bisa merespons saat ini karena masalah konfigurasi."
+
+def llm_configured() -> bool:
+    return bool(GOOGLE_API_KEY) and GOOGLE_API_KEY != "dummy_key"
+
+def _log_chat(line: str):
+    with open(CHAT_LOG_FILE, "a", encoding="utf-8") as log:
+        log.write(f"\n{line}\n")
+
+async def draft_response_async(prompt: str, session_id: str = DEFAULT_SESSION_ID):
+    """
+    Kirim prompt ke LLM tanpa menyimpan riwayat (versi async, bisa dibatalkan).
+    Pemanggil harus memegang lock sesi dan memanggil commit_turn jika
+    jawabannya dipakai; jika task dibatalkan, riwayat sesi tidak berubah.
+    Returns:
+        tuple: (teks respons, objek chat berisi giliran baru)
+    """
+    print(f"Sending to LLM: {prompt}")
+    _log_chat(f"Sending to LLM: {prompt}")
+
+    history = _load_history_contents(session_id)
+    config, recent, prefix = await context_cache.resolve_async(session_id, history)
+    chat = client.aio.chats.create(model=MODEL, config=config, history=recent)
     try:
-        if chat is None:
-            return "[ERROR] Chat belum terinisialisasi"
-            
-        print(f"Sending to LLM: {prompt}")
-        
-        # Tambahkan ke log file untuk Gradio
-        with open(CHAT_LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(f"\nSending to LLM: {prompt}\n")
-        
-        response = chat.send_message(prompt)
-        save_chat_history(chat)
-        result = response.text.strip()
-        
-        print(f"LLM Response: {result}")
-        
-        # Tambahkan respons ke log file untuk Gradio
-        with open(CHAT_LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(f"\nLLM Response: {result}\n")
-        
-        return result
+        response = await chat.send_message(prompt)
     except Exception as e:
-        print(f"[ERROR] LLM error: {e}")
-        return f"[ERROR] {str(e)}"
\ No newline at end of file
+        if not prefix or not _is_stale_cache(e):
+            raise
+        context_cache.invalidate(session_id, e)
+        prefix = []
+        chat = client.aio.chats.create(model=MODEL, config=chat_config, history=history)
+        response = await chat.send_message(prompt)
+    _record_usage(response)
+    result = response.text.strip()
+
+    print(f"LLM Response: {result}")
+    _log_chat(f"LLM Response: {result}")
+    return result, PrefixedChat(chat, prefix)
+
+def commit_turn(chat, session_id: str = DEFAULT_SESSION_ID):
+    """Simpan giliran yang sudah jadi ke session store."""
+    save_chat_history(chat, session_id)
+
+def dummy_response() -> str:
+    """Respons pengganti saat GEMINI_API_KEY belum diset (tanpa memanggil LLM)."""
+    print("[WARNING] Menggunakan respons dummy karena tidak ada GEMINI_API_KEY")
+    return DUMMY_RESPONSE
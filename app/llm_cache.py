@@ -0,0 +1,209 @@
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from google.genai import types
+from pydantic import TypeAdapter
+
+from app import metrics
+
+# Context caching Gemini untuk prefix percakapan yang stabil (prompt sistem +
+# riwayat lama), agar prefix itu tidak diproses ulang di setiap giliran
+LLM_CONTEXT_CACHE = os.getenv("LLM_CONTEXT_CACHE", "1") == "1"
+
+# TTL handle cache dan kapan handle diperpanjang sebelum kedaluwarsa (detik)
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_REFRESH_MARGIN = int(os.getenv("LLM_CACHE_REFRESH_MARGIN", "300"))
+
+# Gemini menolak cache di bawah jumlah token minimum; prefix lebih kecil dikirim biasa
+LLM_CACHE_MIN_TOKENS = int(os.getenv("LLM_CACHE_MIN_TOKENS", "4096"))
+
+# Jumlah content terbaru yang selalu dikirim apa adanya, dan kelipatan panjang
+# prefix: batas prefix hanya maju per blok sehingga satu handle dipakai
+# untuk beberapa giliran berturut-turut
+LLM_CACHE_RECENT_CONTENTS = int(os.getenv("LLM_CACHE_RECENT_CONTENTS", "8"))
+LLM_CACHE_BLOCK_CONTENTS = int(os.getenv("LLM_CACHE_BLOCK_CONTENTS", "16"))
+
+# Setelah pembuatan cache gagal (misalnya API tidak mendukung), caching
+# dimatikan sementara selama ini (detik)
+LLM_CACHE_RETRY_SECONDS = float(os.getenv("LLM_CACHE_RETRY_SECONDS", "600"))
+
+contents_adapter = TypeAdapter(list[types.Content])
+
+
+def estimate_tokens(system_instruction: str, contents: list) -> int:
+    """Perkiraan kasar jumlah token (sekitar 4 karakter per token)."""
+    chars = len(system_instruction)
+    for content in contents:
+        for part in content.parts or []:
+            chars += len(part.text or "")
+    return chars // 4
+
+
+class ContextCache:
+    """
+    Registry handle cached content Gemini per sesi.
+
+    Riwayat dibagi menjadi prefix (dicache bersama prompt sistem) dan sisa
+    giliran terbaru. Handle diperpanjang sebelum TTL habis, dan jika caching
+    tidak tersedia pemanggil mendapat konfigurasi biasa (prompt sistem +
+    seluruh riwayat). Handle dialamatkan dari isi prefix, sehingga sesi dengan
+    prefix identik memakai handle yang sama; handle baru dihapus setelah tidak
+    ada sesi lagi yang memakainya.
+    """
+
+    def __init__(self, client, model: str, system_instruction: str, enabled: bool = LLM_CONTEXT_CACHE,
+                 ttl: int = LLM_CACHE_TTL, refresh_margin: int = LLM_CACHE_REFRESH_MARGIN,
+                 min_tokens: int = LLM_CACHE_MIN_TOKENS):
+        self.client = client
+        self.model = model
+        self.system_instruction = system_instruction
+        self.enabled = enabled
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_tokens = min_tokens
+        self.base_config = types.GenerateContentConfig(system_instruction=system_instruction)
+        self._entries = {}
+        self._by_session = {}
+        self._lock = threading.Lock()
+        self._unavailable_until = 0.0
+        # Task penghapusan handle di background; referensinya disimpan agar
+        # task tidak dibuang garbage collector sebelum selesai
+        self._pending_deletes = set()
+
+    def split(self, history: list):
+        """
+        Returns:
+            tuple: (prefix yang bisa dicache, giliran terbaru)
+        """
+        cacheable = len(history) - LLM_CACHE_RECENT_CONTENTS
+        if cacheable <= 0:
+            return [], history
+        prefix_len = cacheable // LLM_CACHE_BLOCK_CONTENTS * LLM_CACHE_BLOCK_CONTENTS
+        # Prefix harus berakhir di giliran model agar sisanya dimulai dari user
+        while prefix_len and history[prefix_len - 1].role != "model":
+            prefix_len -= 1
+        return history[:prefix_len], history[prefix_len:]
+
+    def _key(self, prefix: list) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{self.model}\0{self.system_instruction}\0".encode())
+        digest.update(contents_adapter.dump_json(prefix))
+        return digest.hexdigest()
+
+    def _plan(self, prefix: list):
+        """Tentukan langkah untuk prefix ini: None (tanpa cache), "use", "refresh", atau "create"."""
+        if not self.enabled or not prefix or time.time() < self._unavailable_until:
+            return None, None, None
+        if estimate_tokens(self.system_instruction, prefix) < self.min_tokens:
+            metrics.inc("llm_context_cache", outcome="too_small")
+            return None, None, None
+
+        key = self._key(prefix)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] <= now:
+                del self._entries[key]
+                entry = None
+        if entry is None:
+            return "create", key, None
+        if entry["expires_at"] - now <= self.refresh_margin:
+            return "refresh", key, entry["name"]
+        return "use", key, entry["name"]
+
+    def _create_config(self, prefix: list):
+        return types.CreateCachedContentConfig(
+            system_instruction=self.system_instruction,
+            contents=prefix,
+            ttl=f"{self.ttl}s",
+        )
+
+    def _update_config(self):
+        return types.UpdateCachedContentConfig(ttl=f"{self.ttl}s")
+
+    def _store(self, session_id: str, key: str, cached=None) -> str:
+        """
+        Catat bahwa sesi memakai handle key (baru/diperpanjang jika cached diberikan).
+        Returns:
+            str | None: Nama handle lama sesi yang sudah tidak dipakai sesi mana pun
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if cached is not None:
+                expires_at = cached.expire_time.timestamp() if cached.expire_time else time.time() + self.ttl
+                sessions = entry["sessions"] if entry else set()
+                entry = self._entries[key] = {"name": cached.name, "expires_at": expires_at,
+                                              "sessions": sessions}
+            if entry is not None:
+                entry["sessions"].add(session_id)
+            old_key = self._by_session.get(session_id)
+            self._by_session[session_id] = key
+            if not old_key or old_key == key:
+                return None
+            old = self._entries.get(old_key)
+            if old is None:
+                return None
+            old["sessions"].discard(session_id)
+            if old["sessions"]:
+                return None
+            del self._entries[old_key]
+            return old["name"]
+
+    def _failed(self, action: str, error: Exception):
+        print(f"[WARNING] Context cache Gemini gagal ({action}), kirim tanpa cache: {error}")
+        metrics.inc("llm_context_cache", outcome="error")
+        if action == "create":
+            self._unavailable_until = time.time() + LLM_CACHE_RETRY_SECONDS
+
+    def _result(self, name: str, history: list, prefix: list):
+        if name is None:
+            return self.base_config, history, []
+        recent = history[len(prefix):]
+        return types.GenerateContentConfig(cached_content=name), recent, prefix
+
+    async def resolve_async(self, session_id: str, history: list):
+        """
+        Siapkan konfigurasi chat untuk riwayat sesi.
+        Returns:
+            tuple: (GenerateContentConfig, riwayat yang dikirim, prefix yang ada di cache)
+        """
+        prefix, _ = self.split(history)
+        action, key, name = self._plan(prefix)
+        if action is None:
+            return self._result(None, history, [])
+        try:
+            if action == "create":
+                cached = await self.client.aio.caches.create(model=self.model, config=self._create_config(prefix))
+            elif action == "refresh":
+                cached = await self.client.aio.caches.update(name=name, config=self._update_config())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._failed(action, e)
+            return self._result(None, history, [])
+        if action != "use":
+            name = cached.name
+        stale = self._store(session_id, key, None if action == "use" else cached)
+        if stale:
+            task = asyncio.ensure_future(self._delete_async(stale))
+            self._pending_deletes.add(task)
+            task.add_done_callback(self._pending_deletes.discard)
+        metrics.inc("llm_context_cache", outcome={"use": "hit", "create": "created", "refresh": "refreshed"}[action])
+        return self._result(name, history, prefix)
+
+    def invalidate(self, session_id: str, error: Exception = None):
+        """Buang handle sesi (misalnya sudah dihapus/kedaluwarsa di server)."""
+        with self._lock:
+            key = self._by_session.pop(session_id, None)
+            if key:
+                self._entries.pop(key, None)
+        print(f"[WARNING] Handle context cache sesi {session_id} tidak valid: {error}")
+        metrics.inc("llm_context_cache", outcome="invalidated")
+
+    async def _delete_async(self, name: str):
+        try:
+            await self.client.aio.caches.delete(name=name)
+        except Exception as e:
+            print(f"[WARNING] Gagal menghapus context cache {name}: {e}")
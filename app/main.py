@@ -1,15 +1,52 @@
 import os
-import tempfile
+import json
+import time
+import asyncio
 import traceback
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from urllib.parse import quote
+from fastapi import FastAPI, File, Form, Request, UploadFile, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
 # Import functions from local modules
-from app.stt import transcribe_speech_to_text
-from app.llm import generate_response 
-from app.tts import transcribe_text_to_speech
+from app.pipeline import run_voice_turn, transcribe_upload, chat_turn, synthesize_text, StageError
+from app.stt import resolve_stt_options
+from app.audio_io import read_upload, UploadRejected, BodySizeLimitMiddleware
+from app.cancellation import CancelToken
+from app.profiling import (
+    ProfilingMiddleware, router as profiling_router, require_admin,
+    controller as profile_controller, run_in_threadpool,
+)
+from app.session_store import DEFAULT_SESSION_ID
+from app.health import monitor as health_monitor
+from app.autotune import start_background_autotune
+from app.engine_workers import engine_workers
+from app.traffic import traffic_recorder
+from app.jobs import (
+    submit_job, get_job, public_view, job_runner, FINAL_STATUSES, JOB_POLL_SECONDS,
+    JOB_MAX_AUDIO_SECONDS, JOB_MAX_UPLOAD_BYTES,
+)
+from app.scratch import create_request_dir, remove_request_dir, cleanup_task, janitor
+from app import metrics, stage_pool
+
+# Jumlah proses worker uvicorn. Riwayat chat ada di session store (SQLite) yang
+# dipakai bersama, tetapi bobot model STT/TTS tidak: whisper-cli membaca file
+# ggml ke heap dan Coqui memuat ulang checkpoint di setiap subprocess, sehingga
+# memori puncak ~ jumlah STT/TTS yang berjalan bersamaan x ukuran model, di
+# semua worker. ENGINE_WORKERS=1 menyimpan model di satu pool engine per node.
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+
+# Seberapa sering koneksi klien dicek selama pipeline berjalan (detik)
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+
+# Panjang teks maksimum untuk /chat dan /tts
+MAX_TEXT_CHARS = int(os.getenv("MAX_TEXT_CHARS", "2000"))
+
+# Interval komentar keep-alive pada stream SSE progres job
+JOB_EVENTS_KEEPALIVE = float(os.getenv("JOB_EVENTS_KEEPALIVE", "15"))
 
 app = FastAPI(title="Voice Chat API")
 
@@ -20,10 +57,90 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Transcript", "X-Reply", "Server-Timing"],
 )
 
+# Profiling on-demand (dikendalikan lewat endpoint /admin, mati secara default)
+app.add_middleware(ProfilingMiddleware)
+app.include_router(profiling_router)
+
+# Tolak body upload yang terlalu besar sebelum di-buffer oleh parser multipart
+# (/jobs memakai batas sendiri untuk rekaman panjang)
+app.add_middleware(BodySizeLimitMiddleware, path_limits={"/jobs": JOB_MAX_UPLOAD_BYTES + 64 * 1024})
+
+async def watch_disconnect(request: Request, token: CancelToken, task: asyncio.Task):
+    """Batalkan pipeline begitu klien menutup koneksi (tab ditutup, timeout, dll)."""
+    while not task.done():
+        if await request.is_disconnected():
+            token.cancel("client_disconnected")
+            task.cancel()
+            return
+        await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+def record_abandoned(token: CancelToken, timings: dict):
+    """Catat kerja engine yang terbuang karena request ditinggalkan."""
+    metrics.inc("requests_abandoned", reason=token.reason)
+    for stage, seconds in timings.items():
+        metrics.inc("wasted_work_seconds", seconds, stage=stage)
+
+class ClientGone(Exception):
+    """Klien menutup koneksi sebelum pekerjaan selesai."""
+
+async def run_until_disconnect(request: Request, token: CancelToken, timings: dict, coro):
+    """
+    Jalankan coro sebagai task yang dibatalkan begitu klien terputus.
+    Raises:
+        ClientGone: Jika klien terputus (kerja yang terbuang sudah dicatat)
+    """
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(watch_disconnect(request, token, task))
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not token.cancelled:
+            # Handler sendiri yang dibatalkan (misalnya server shutdown)
+            token.cancel("server_cancelled")
+            task.cancel()
+            raise
+        record_abandoned(token, timings)
+        print(f"Request dibatalkan: {token.reason}")
+        raise ClientGone()
+    finally:
+        watcher.cancel()
+
+def client_gone_response() -> JSONResponse:
+    return JSONResponse(
+        status_code=499,
+        content={"error": "Client disconnected"}
+    )
+
+def resolve_stt_request(request: Request, language: str, stt_profile: str):
+    """Bahasa dan profil decoding STT: dari form, lalu profil tenant (X-Tenant-ID), lalu default."""
+    return resolve_stt_options(language, stt_profile, request.headers.get("X-Tenant-ID"))
+
+def server_timing(timings: dict) -> str:
+    """Header Server-Timing dari durasi per tahap (detik -> milidetik)."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+def check_text(text: str):
+    """Returns: JSONResponse error jika teks kosong atau terlalu panjang, selain itu None"""
+    if not text or not text.strip():
+        return JSONResponse(status_code=400, content={"error": "Teks kosong"})
+    if len(text) > MAX_TEXT_CHARS:
+        return JSONResponse(
+            status_code=413,
+            content={"error": f"Teks melebihi batas {MAX_TEXT_CHARS} karakter"}
+        )
+    return None
+
 @app.post("/voice-chat")
-async def voice_chat(file: UploadFile = File(...)):
+async def voice_chat(
+    request: Request,
+    file: UploadFile = File(...),
+    session_id: str = Form(DEFAULT_SESSION_ID),
+    language: str = Form(None),
+    stt_profile: str = Form(None),
+):
     """
     Endpoint untuk layanan voice chat:
     1. Menerima file audio dari pengguna
@@ -32,50 +149,65 @@ async def voice_chat(file: UploadFile = File(...)):
     4. Mengubah respons teks menjadi audio menggunakan TTS
     5. Mengembalikan file audio sebagai respons
     """
-    temp_file = None
+    arrived_at = time.time()
+    started = time.perf_counter()
     try:
-        # Baca file audio yang diunggah
-        audio_content = await file.read()
-        
-        # Log for debugging
-        print(f"Received audio file: {file.filename}, size: {len(audio_content)} bytes")
-        
-        # Save audio to temporary file (for debugging)
-        temp_dir = tempfile.gettempdir()
-        temp_file = os.path.join(temp_dir, f"received_audio_{os.path.basename(file.filename)}")
-        with open(temp_file, "wb") as f:
-            f.write(audio_content)
-        print(f"Saved audio to temporary file: {temp_file}")
-        
-        # Konversi audio ke teks dengan STT
-        transcription = transcribe_speech_to_text(audio_content, file_ext=os.path.splitext(file.filename)[1])
-        print(f"STT result: {transcription}")
-        
-        if transcription.startswith("[ERROR]"):
-            return JSONResponse(
-                status_code=500,
-                content={"error": transcription}
-            )
-        
-        # Dapatkan respons dari LLM
-        llm_response = generate_response(transcription)
-        print(f"LLM response: {llm_response}")
-        
-        if llm_response.startswith("[ERROR]"):
+        language, stt_profile = resolve_stt_request(request, language, stt_profile)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    # Semua file request ini (audio masuk, file kerja STT, output TTS) ada di
+    # satu direktori scratch yang dihapus setelah respons selesai dikirim
+    request_dir = create_request_dir()
+    cleanup_deferred = False
+    try:
+        # Baca upload per potongan: header WAV divalidasi lebih dulu, ukuran
+        # dan durasi dibatasi, dan PCM di-decode langsung ke satu buffer
+        try:
+            upload = await read_upload(file)
+        except UploadRejected as e:
+            metrics.inc("uploads_rejected", reason=str(e.status_code))
             return JSONResponse(
-                status_code=500,
-                content={"error": llm_response}
+                status_code=e.status_code,
+                content={"error": e.message}
             )
         
-        # Konversi respons teks ke audio dengan TTS
-        audio_output_path = transcribe_text_to_speech(llm_response)
-        print(f"TTS output path: {audio_output_path}")
+        # Log for debugging
+        print(f"Received audio file: {upload.filename}, size: {upload.size} bytes")
         
-        if audio_output_path.startswith("[ERROR]"):
+        # Jalankan STT -> LLM -> TTS. Tahap yang blocking dijalankan di
+        # threadpool agar event loop worker tetap bisa melayani request lain,
+        # dan LLM bisa mulai spekulatif sebelum STT selesai.
+        # Jika klien terputus, token menghentikan proses whisper/Coqui, task
+        # membatalkan panggilan LLM dan melepas slot, dan giliran tidak disimpan
+        token = CancelToken()
+        timings = {}
+        recorded = traffic_recorder.sample()
+        try:
+            result = await run_until_disconnect(request, token, timings, run_voice_turn(
+                upload,
+                session_id,
+                request_dir,
+                cancel_token=token,
+                timings=timings,
+                language=language,
+                stt_profile=stt_profile,
+            ))
+        except ClientGone:
+            return client_gone_response()
+        except StageError as e:
+            if recorded:
+                traffic_recorder.record(
+                    upload, arrived_at, time.perf_counter() - started, 500, session_id,
+                    language, stt_profile, timings=timings, error=e.message,
+                )
             return JSONResponse(
                 status_code=500,
-                content={"error": audio_output_path}
+                content={"error": e.message}
             )
+        transcription = result["transcription"]
+        llm_response = result["reply"]
+        audio_output_path = result["audio_path"]
         
         # Verify the file exists
         if not os.path.exists(audio_output_path):
@@ -93,11 +225,29 @@ async def voice_chat(file: UploadFile = File(...)):
                 content={"error": "Generated audio file is empty"}
             )
         
-        # Kembalikan file audio sebagai respons
+        if recorded:
+            traffic_recorder.record(
+                upload, arrived_at, time.perf_counter() - started, 200, session_id,
+                language, stt_profile, transcript=transcription.strip(), reply=llm_response,
+                timings=timings,
+            )
+
+        # Kembalikan file audio sebagai respons; direktori scratch dihapus
+        # oleh background task setelah file selesai di-stream ke klien.
+        # Transkrip dan teks balasan ikut dikirim lewat header (URL-encoded)
+        # agar klien tidak perlu membaca file log. Durasi per tahap dikirim
+        # lewat Server-Timing (dipakai juga oleh app/replay.py).
+        cleanup_deferred = True
         return FileResponse(
             path=audio_output_path,
             media_type="audio/wav",
-            filename="response.wav"
+            filename="response.wav",
+            headers={
+                "X-Transcript": quote(transcription.strip()),
+                "X-Reply": quote(llm_response),
+                "Server-Timing": server_timing(timings),
+            },
+            background=cleanup_task(request_dir),
         )
     
     except Exception as e:
@@ -108,40 +258,255 @@ async def voice_chat(file: UploadFile = File(...)):
             status_code=500,
             content={"error": error_msg}
         )
+    finally:
+        if not cleanup_deferred:
+            remove_request_dir(request_dir)
+
+# Endpoint per tahap, untuk klien yang hanya butuh sebagian pipeline (misalnya
+# klien teks, atau yang sudah punya transkrip). Memakai pool slot, cache, dan
+# batas upload yang sama dengan /voice-chat.
+
+@app.post("/stt")
+async def speech_to_text(
+    request: Request,
+    file: UploadFile = File(...),
+    language: str = Form(None),
+    stt_profile: str = Form(None),
+):
+    """Transkrip file audio. Returns: {"transcription", "language", "profile"}"""
+    try:
+        language, stt_profile = resolve_stt_request(request, language, stt_profile)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    try:
+        upload = await read_upload(file)
+    except UploadRejected as e:
+        metrics.inc("uploads_rejected", reason=str(e.status_code))
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+
+    token = CancelToken()
+    timings = {}
+    try:
+        transcription = await run_until_disconnect(request, token, timings, transcribe_upload(
+            upload,
+            cancel_token=token,
+            timings=timings,
+            language=language,
+            stt_profile=stt_profile,
+        ))
+    except ClientGone:
+        return client_gone_response()
+    except StageError as e:
+        return JSONResponse(status_code=500, content={"error": e.message})
+    return {"transcription": transcription.strip(), "language": language, "profile": stt_profile}
+
+@app.post("/chat")
+async def chat(
+    request: Request,
+    text: str = Form(...),
+    session_id: str = Form(DEFAULT_SESSION_ID),
+):
+    """Kirim teks ke LLM dalam sesi percakapan. Returns: {"reply"}"""
+    error = check_text(text)
+    if error is not None:
+        return error
+
+    token = CancelToken()
+    timings = {}
+    try:
+        reply = await run_until_disconnect(request, token, timings, chat_turn(text, session_id, timings))
+    except ClientGone:
+        return client_gone_response()
+    except StageError as e:
+        return JSONResponse(status_code=500, content={"error": e.message})
+    return {"reply": reply}
+
+@app.post("/tts")
+async def text_to_speech(request: Request, text: str = Form(...)):
+    """Ubah teks menjadi audio WAV (kalimat disintesis paralel)."""
+    error = check_text(text)
+    if error is not None:
+        return error
+
+    request_dir = create_request_dir()
+    cleanup_deferred = False
+    try:
+        token = CancelToken()
+        timings = {}
+        try:
+            audio_output_path = await run_until_disconnect(
+                request, token, timings, synthesize_text(text, request_dir, token, timings)
+            )
+        except ClientGone:
+            return client_gone_response()
+        except StageError as e:
+            return JSONResponse(status_code=500, content={"error": e.message})
+
+        cleanup_deferred = True
+        return FileResponse(
+            path=audio_output_path,
+            media_type="audio/wav",
+            filename="speech.wav",
+            background=cleanup_task(request_dir),
+        )
+    finally:
+        if not cleanup_deferred:
+            remove_request_dir(request_dir)
+
+# Mode job asinkron untuk rekaman panjang: audio disimpan dan dimasukkan ke
+# antrean SQLite, lalu dikerjakan worker sesuai kapasitasnya. Klien memantau
+# progres lewat polling atau SSE dan mengambil hasilnya nanti, tanpa menahan
+# koneksi (dan tanpa kehilangan hasil saat koneksinya timeout).
+
+@app.post("/jobs", status_code=202)
+async def submit_voice_job(
+    request: Request,
+    file: UploadFile = File(...),
+    session_id: str = Form(DEFAULT_SESSION_ID),
+    language: str = Form(None),
+    stt_profile: str = Form(None),
+):
+    """Antrekan satu giliran voice chat. Returns: {"job_id", "status", URL status/events/audio}"""
+    try:
+        language, stt_profile = resolve_stt_request(request, language, stt_profile)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    try:
+        upload = await read_upload(file, max_bytes=JOB_MAX_UPLOAD_BYTES, max_seconds=JOB_MAX_AUDIO_SECONDS)
+    except UploadRejected as e:
+        metrics.inc("uploads_rejected", reason=str(e.status_code))
+        return JSONResponse(status_code=e.status_code, content={"error": e.message})
+
+    job_id = await run_in_threadpool(submit_job, upload, session_id, language, stt_profile)
+    return JSONResponse(status_code=202, content={
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+        "audio_url": f"/jobs/{job_id}/audio",
+    })
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Status job (polling): status, tahap berjalan, transkrip dan balasan jika selesai."""
+    job = await run_in_threadpool(get_job, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job tidak ditemukan"})
+    return public_view(job)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(request: Request, job_id: str):
+    """Stream progres job (Server-Sent Events); berakhir saat job selesai atau gagal."""
+    job = await run_in_threadpool(get_job, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job tidak ditemukan"})
+
+    async def events():
+        last = None
+        idle = 0.0
+        while True:
+            job = await run_in_threadpool(get_job, job_id)
+            if job is None:
+                yield "event: failed\ndata: {\"error\": \"Job tidak ditemukan\"}\n\n"
+                return
+            state = (job["status"], job["stage"])
+            if state != last:
+                last = state
+                idle = 0.0
+                yield f"event: {job['status']}\ndata: {json.dumps(public_view(job))}\n\n"
+            elif idle >= JOB_EVENTS_KEEPALIVE:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            if job["status"] in FINAL_STATUSES or await request.is_disconnected():
+                return
+            await asyncio.sleep(JOB_POLL_SECONDS)
+            idle += JOB_POLL_SECONDS
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/jobs/{job_id}/audio")
+async def job_audio(job_id: str):
+    """Audio balasan job yang sudah selesai."""
+    job = await run_in_threadpool(get_job, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job tidak ditemukan"})
+    if job["status"] != "done" or not job["audio_path"] or not os.path.exists(job["audio_path"]):
+        return JSONResponse(
+            status_code=409,
+            content={"error": "Audio job belum tersedia", "status": job["status"]},
+        )
+    return FileResponse(
+        path=job["audio_path"],
+        media_type="audio/wav",
+        filename="response.wav",
+        headers={
+            "X-Transcript": quote(job["transcription"] or ""),
+            "X-Reply": quote(job["reply"] or ""),
+        },
+    )
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # Probe berjalan di background; /health hanya membaca hasil yang di-cache
+    health_monitor.start(asyncio.get_running_loop())
+    janitor.start()
+    # Ikuti state profiling bersama (/admin/profile, /admin/tracemalloc) di worker ini
+    profile_controller.start()
+    # Benchmark thread/instance engine jika diaktifkan dan belum ada hasil untuk host ini
+    start_background_autotune()
+    # Engine worker persisten (ENGINE_WORKERS=1); model dimuat di background
+    engine_workers.start()
+    # Perekam trafik untuk replay (TRAFFIC_RECORD=1)
+    traffic_recorder.start()
+    # Ambil job dari antrean persisten (termasuk job yang tertinggal saat restart)
+    job_runner.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    health_monitor.stop()
+    janitor.stop()
+    profile_controller.stop()
+    await job_runner.stop()
+    engine_workers.stop()
+    traffic_recorder.stop()
+
+@app.get("/metrics")
+async def metrics_snapshot():
+    """Metrik proses worker ini (counter, gauge, dan ringkasan latensi)."""
+    return metrics.snapshot()
+
+@app.get("/admin/limits")
+async def stage_limits(request: Request):
+    """
+    Limit konkurensi adaptif per tahap: limit saat ini, beban, latensi
+    jangka pendek dan tanpa beban, serta riwayat perubahan limit terakhir.
+    """
+    require_admin(request)
+    return stage_pool.snapshot()
 
 @app.get("/health")
 async def health_check():
-    """Simple endpoint to check if the API is running"""
-    # Check dependencies
-    health_info = {
-        "status": "healthy",
-        "components": {}
-    }
-    
-    # Check whisper.cpp directory
-    whisper_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "whisper.cpp")
-    if os.path.exists(whisper_dir):
-        health_info["components"]["whisper.cpp"] = "found"
-    else:
-        health_info["components"]["whisper.cpp"] = "missing"
-        health_info["status"] = "degraded"
-    
-    # Check coqui_utils directory
-    coqui_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "coqui_utils")
-    if os.path.exists(coqui_dir):
-        health_info["components"]["coqui_utils"] = "found"
-    else:
-        health_info["components"]["coqui_utils"] = "missing"
-        health_info["status"] = "degraded"
-    
-    # Check if GEMINI_API_KEY is set
-    if os.getenv("GEMINI_API_KEY"):
-        health_info["components"]["GEMINI_API_KEY"] = "set"
-    else:
-        health_info["components"]["GEMINI_API_KEY"] = "missing"
-        health_info["status"] = "degraded"
-    
-    return health_info
+    """
+    Status kesehatan dari hasil probe terakhir (binary/model STT & TTS,
+    transkripsi dan sintesis sintetis, serta jangkauan LLM).
+    Hasil di-cache dengan TTL sehingga polling orchestrator tetap murah.
+    """
+    health_info = health_monitor.snapshot()
+    status_code = 503 if health_info["status"] == "unhealthy" else 200
+    return JSONResponse(status_code=status_code, content=health_info)
 
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # reload hanya didukung untuk satu proses; mode multi-worker untuk serving
+    uvicorn.run(
+        "app.main:app",
+        host=API_HOST,
+        port=API_PORT,
+        workers=API_WORKERS,
+        reload=API_WORKERS == 1,
+    )
\ No newline at end of file
@@ -0,0 +1,90 @@
+import os
+import time
+import threading
+from collections import defaultdict, deque
+
+# Jumlah observasi terakhir yang disimpan per histogram untuk menghitung persentil
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1024"))
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_histograms = {}
+_started_at = time.time()
+
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f"{k}={labels[k]}" for k in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    """Tambah nilai counter."""
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Set nilai gauge (nilai terakhir yang diamati)."""
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, value: float, **labels):
+    """Catat satu observasi (misalnya latensi) ke histogram sederhana."""
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = {
+                "count": 0,
+                "sum": 0.0,
+                "max": 0.0,
+                "window": deque(maxlen=METRICS_WINDOW),
+            }
+        hist["count"] += 1
+        hist["sum"] += value
+        hist["max"] = max(hist["max"], value)
+        hist["window"].append(value)
+
+
+def get_counter(name: str, **labels) -> float:
+    with _lock:
+        return _counters.get(_key(name, labels), 0.0)
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def snapshot() -> dict:
+    """
+    Ringkasan semua metrik milik proses ini.
+    Pada mode multi-worker setiap worker punya metriknya sendiri (lihat "pid").
+    """
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {}
+        for key, hist in _histograms.items():
+            values = sorted(hist["window"])
+            histograms[key] = {
+                "count": hist["count"],
+                "mean": hist["sum"] / hist["count"] if hist["count"] else 0.0,
+                "max": hist["max"],
+                "p50": _percentile(values, 0.50),
+                "p95": _percentile(values, 0.95),
+                "p99": _percentile(values, 0.99),
+            }
+    return {
+        "pid": os.getpid(),
+        "uptime_s": round(time.time() - _started_at, 1),
+        "counters": counters,
+        "gauges": gauges,
+        "histograms": histograms,
+    }
@@ -0,0 +1,532 @@
+import os
+import re
+import time
+import uuid
+import asyncio
+import scipy.io.wavfile
+from contextlib import contextmanager
+
+from app import metrics
+from app import stage_pool
+from app.profiling import run_in_threadpool
+from app.stt import transcribe_audio_file, resolve_stt_options
+from app.llm import draft_response_async, commit_turn, dummy_response, llm_configured
+from app.tts import (
+    COQUI_MODEL_PATH,
+    COQUI_SPEAKER,
+    _tts_with_coqui,
+    split_sentences,
+    stitch_arrays,
+    log_output_path,
+)
+from app.engine_workers import engine_workers
+from app.session_store import acquire_session_lock, release_session_lock
+from app.scratch import create_request_dir, remove_request_dir
+from app.singleflight import SingleFlight
+from app.chunking import plan_windows, merge_transcripts
+
+# Mulai request LLM secara spekulatif dari segmen whisper sebelum proses STT selesai
+SPECULATIVE_LLM = os.getenv("SPECULATIVE_LLM", "1") == "1"
+
+# Transkrip dianggap stabil jika segmen terakhir sudah mencapai
+# (durasi audio - SPECULATE_TAIL_SECONDS)
+SPECULATE_TAIL_SECONDS = float(os.getenv("SPECULATE_TAIL_SECONDS", "1.0"))
+
+# Sintesis balasan beberapa kalimat secara paralel di pool slot TTS
+TTS_PARALLEL_SEGMENTS = os.getenv("TTS_PARALLEL_SEGMENTS", "1") == "1"
+
+
+class StageError(Exception):
+    """Kegagalan salah satu tahap pipeline (stt, llm, tts)."""
+
+    def __init__(self, stage: str, message: str):
+        super().__init__(message)
+        self.stage = stage
+        self.message = message
+
+
+def normalize_transcript(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class SpeculativeDispatcher:
+    """
+    Mengatur panggilan LLM untuk satu giliran percakapan.
+
+    Segmen dari whisper diterima lewat on_segment (dipanggil dari thread STT).
+    Begitu segmen sudah menutupi hampir seluruh audio, prompt dikirim ke LLM
+    secara spekulatif. Saat transkrip final tersedia, resolve() memakai hasil
+    spekulasi jika teksnya sama, atau membatalkannya dan mengirim ulang.
+    Lock sesi diambil sebelum panggilan LLM pertama dan dilepas di close().
+    """
+
+    def __init__(self, session_id: str, duration, loop):
+        self.session_id = session_id
+        self.duration = duration
+        self.loop = loop
+        self.segments = []
+        self.task = None
+        self.spec_prompt = None
+        self._lock_owner = None
+        self._lock_future = None
+        self._lock_guard = asyncio.Lock()
+
+    def on_segment(self, start: float, end: float, text: str):
+        self.loop.call_soon_threadsafe(self._handle_segment, end, text)
+
+    def _handle_segment(self, end: float, text: str):
+        self.segments.append(text)
+        if self.task is not None or self.duration is None:
+            return
+        if end >= self.duration - SPECULATE_TAIL_SECONDS:
+            self.spec_prompt = " ".join(self.segments)
+            self.task = asyncio.ensure_future(self._draft(self.spec_prompt))
+            metrics.inc("llm_speculation", outcome="started")
+
+    async def _ensure_lock(self):
+        async with self._lock_guard:
+            if self._lock_owner is not None:
+                return
+            # Thread yang menunggu lock tidak bisa dihentikan: hasilnya disimpan
+            # di future yang dipakai lagi oleh draf berikutnya, atau dilepas
+            # oleh close() begitu lock didapat, walaupun draf ini dibatalkan
+            if self._lock_future is None:
+                self._lock_future = self.loop.run_in_executor(None, acquire_session_lock, self.session_id)
+            try:
+                owner = await asyncio.shield(self._lock_future)
+            except asyncio.CancelledError:
+                raise
+            except BaseException:
+                self._lock_future = None
+                raise
+            self._lock_future = None
+            self._lock_owner = owner
+
+    def _release_when_acquired(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.loop.run_in_executor(None, release_session_lock, self.session_id, future.result())
+
+    async def _draft(self, prompt: str):
+        await self._ensure_lock()
+        async with stage_pool.acquire("llm"):
+            return await draft_response_async(prompt, self.session_id)
+
+    async def resolve(self, final_text: str):
+        """
+        Returns:
+            tuple: (teks respons, objek chat) untuk transkrip final
+        """
+        task, self.task = self.task, None
+        if task is not None:
+            if normalize_transcript(self.spec_prompt) == normalize_transcript(final_text):
+                try:
+                    result = await task
+                    metrics.inc("llm_speculation", outcome="accepted")
+                    return result
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[WARNING] LLM spekulatif gagal, kirim ulang: {e}")
+                    metrics.inc("llm_speculation", outcome="failed")
+            else:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                metrics.inc("llm_speculation", outcome="discarded")
+
+        return await self._draft(final_text)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        async with self._lock_guard:
+            future, self._lock_future = self._lock_future, None
+            if future is not None:
+                future.add_done_callback(self._release_when_acquired)
+            if self._lock_owner is not None:
+                owner, self._lock_owner = self._lock_owner, None
+                await run_in_threadpool(release_session_lock, self.session_id, owner)
+
+
+@contextmanager
+def timed_stage(timings: dict, stage: str):
+    """Catat durasi sebuah tahap, termasuk tahap yang terputus karena pembatalan."""
+    started = time.perf_counter()
+    completed = False
+    try:
+        yield
+        completed = True
+    finally:
+        elapsed = time.perf_counter() - started
+        timings[stage] = timings.get(stage, 0.0) + elapsed
+        if completed:
+            metrics.observe("stage_latency_seconds", elapsed, stage=stage)
+
+
+def _release_tts_result(result):
+    # Dipanggil setelah semua request yang berbagi hasil sintesis selesai memakainya
+    if isinstance(result, str):
+        if not result.startswith("[ERROR]"):
+            remove_request_dir(os.path.dirname(result), reason="singleflight")
+    else:
+        result.release()
+
+
+def _release_abandoned_synthesis(job):
+    if not job.cancelled() and job.exception() is None:
+        result = job.result()
+        if not isinstance(result, str):
+            result.release()
+
+
+# Sintesis/transkripsi identik yang sedang berjalan bersamaan dikerjakan sekali
+tts_flights = SingleFlight("tts", release=_release_tts_result)
+stt_flights = SingleFlight("stt")
+
+
+def _write_segments(results: list, output_path: str):
+    """Gabungkan audio per potongan (path WAV atau WorkerAudio) ke satu file WAV."""
+    if len(results) == 1 and isinstance(results[0], str):
+        # Satu potongan: cukup hard link dari direktori hasil bersama
+        try:
+            os.link(results[0], output_path)
+            return
+        except OSError:
+            pass
+    rate = None
+    waves = []
+    for result in results:
+        if isinstance(result, str):
+            sample_rate, data = scipy.io.wavfile.read(result)
+        else:
+            sample_rate, data = result.sample_rate, result.data
+        if rate is None:
+            rate = sample_rate
+        elif sample_rate != rate:
+            raise ValueError(f"Sample rate TTS berbeda: {sample_rate} != {rate}")
+        waves.append(data)
+    audio = waves[0] if len(waves) == 1 else stitch_arrays(waves, rate)
+    scipy.io.wavfile.write(output_path, rate, audio)
+
+
+async def _synthesize_segment(segment: str):
+    """
+    Sintesis satu potongan di slot TTS: lewat engine worker jika siap
+    (hasil WorkerAudio di shared memory), selain itu subprocess CLI (path WAV
+    di direktori scratch milik hasil bersama). Potongan yang sama persis yang
+    sedang disintesis request lain tidak dikerjakan ulang.
+    Returns:
+        Lease: Hasil sintesis; wajib di-release
+    """
+    async def synthesize(token):
+        # Latensi TTS dinormalisasi per 100 karakter
+        async with stage_pool.acquire("tts", cost=max(len(segment), 1) / 100.0):
+            if not engine_workers.available("tts"):
+                flight_dir = create_request_dir(prefix="tts_flight_")
+                try:
+                    path = await run_in_threadpool(_tts_with_coqui, segment, flight_dir, token)
+                except BaseException:
+                    remove_request_dir(flight_dir, reason="singleflight")
+                    raise
+                if path.startswith("[ERROR]"):
+                    remove_request_dir(flight_dir, reason="singleflight")
+                return path
+
+            job = asyncio.ensure_future(run_in_threadpool(engine_workers.synthesize, segment, token))
+            try:
+                return await asyncio.shield(job)
+            except asyncio.CancelledError:
+                # Pembatalan tidak menghentikan thread threadpool; buffer hasilnya
+                # dikembalikan ke worker begitu thread selesai, agar ring shared
+                # memory (FIFO) tidak tersumbat
+                job.add_done_callback(_release_abandoned_synthesis)
+                raise
+
+    return await tts_flights.acquire((COQUI_MODEL_PATH, COQUI_SPEAKER, segment), synthesize)
+
+
+def _segment_error(task: asyncio.Task):
+    """Pesan "[ERROR] ..." jika sintesis satu potongan gagal, selain itu None."""
+    error = task.exception()
+    if isinstance(error, asyncio.TimeoutError):
+        return "[ERROR] TTS melebihi batas waktu"
+    if isinstance(error, StageError):
+        return error.message
+    if error is not None:
+        print(f"[ERROR] Sintesis potongan TTS gagal: {error!r}")
+        return "[ERROR] Failed to synthesize speech"
+    value = task.result().value
+    if isinstance(value, str) and value.startswith("[ERROR]"):
+        return value
+    return None
+
+
+async def synthesize_reply(text: str, output_dir: str, cancel_token=None) -> str:
+    """
+    Ubah balasan menjadi audio. Balasan beberapa kalimat dipecah dan setiap
+    potongan disintesis di slot TTS-nya sendiri secara bersamaan, lalu
+    digabung, sehingga latensinya mendekati latensi kalimat terpanjang.
+    Engine dihentikan lewat pembatalan task (bukan cancel_token), karena
+    hasilnya bisa sedang ditunggu request lain.
+    Returns:
+        str: Path file WAV
+    Raises:
+        StageError: Jika salah satu potongan gagal; potongan lain langsung dibatalkan
+    """
+    if cancel_token is not None and cancel_token.cancelled:
+        raise StageError("tts", "[ERROR] TTS dibatalkan")
+    segments = split_sentences(text) if TTS_PARALLEL_SEGMENTS else [text]
+    metrics.observe("tts_segments", len(segments))
+
+    tasks = [asyncio.ensure_future(_synthesize_segment(segment)) for segment in segments]
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                error = _segment_error(task)
+                if error is not None:
+                    # Potongan yang masih berjalan dibatalkan di finally
+                    raise StageError("tts", error)
+        results = [task.result().value for task in tasks]
+        output_path = os.path.join(output_dir, f"tts_{uuid.uuid4()}.wav")
+        try:
+            await run_in_threadpool(_write_segments, results, output_path)
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] Gagal menggabungkan audio TTS: {e}")
+            raise StageError("tts", "[ERROR] Failed to synthesize speech")
+        log_output_path(output_path)
+        return output_path
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None:
+                task.result().release()
+
+
+async def _transcribe_audio(upload, fingerprint: str, language: str, stt_profile: str,
+                            on_segment=None, cancel_token=None) -> str:
+    """Transkrip satu audio di satu slot STT (engine worker atau subprocess whisper)."""
+    # Dengan engine worker, PCM dikirim lewat shared memory; selain itu audio
+    # ditulis sekali ke direktori scratch hasil bersama dan dibaca langsung oleh whisper
+    use_workers = upload.pcm is not None and engine_workers.running
+    flight_dir = create_request_dir(prefix="stt_flight_")
+    try:
+        audio_path = None if use_workers else upload.write_to(flight_dir)
+
+        # Konversi audio ke teks dengan STT (di threadpool karena blocking);
+        # latensi STT dinormalisasi per detik audio
+        async with stage_pool.acquire("stt", cost=upload.duration or 1.0):
+            if use_workers and engine_workers.available("stt"):
+                return await run_in_threadpool(
+                    engine_workers.transcribe,
+                    upload.pcm,
+                    upload.sample_rate,
+                    upload.channels,
+                    fingerprint=fingerprint,
+                    on_segment=on_segment,
+                    cancel_token=cancel_token,
+                    language=language,
+                    profile=stt_profile,
+                )
+            return await run_in_threadpool(
+                transcribe_audio_file,
+                audio_path or upload.write_to(flight_dir),
+                fingerprint=fingerprint,
+                work_dir=flight_dir,
+                on_segment=on_segment,
+                cancel_token=cancel_token,
+                language=language,
+                profile=stt_profile,
+            )
+    finally:
+        remove_request_dir(flight_dir, reason="singleflight")
+
+
+async def _transcribe_chunked(upload, windows: list, language: str, stt_profile: str,
+                              cancel_token=None) -> str:
+    """
+    Transkrip potongan rekaman panjang bersamaan (masing-masing di slot STT
+    sendiri) lalu gabungkan dengan membuang kata duplikat di overlap.
+    """
+    chunks = [upload.slice(start, end) for start, end in windows]
+    texts = await asyncio.gather(*(
+        _transcribe_audio(chunk, chunk.fingerprint(), language, stt_profile, cancel_token=cancel_token)
+        for chunk in chunks
+    ))
+    errors = [text for text in texts if text.startswith("[ERROR]")]
+    if errors:
+        return errors[0]
+    return merge_transcripts(texts)
+
+
+async def transcribe_upload(upload, cancel_token=None, timings: dict = None,
+                            language: str = None, stt_profile: str = None, on_segment=None) -> str:
+    """
+    Tahap STT: transkrip audio upload di slot STT. Rekaman panjang dipecah di
+    titik hening dan potongannya ditranskrip paralel (tanpa segmen streaming).
+    Audio yang identik (bahasa dan profil sama) yang sedang ditranskrip
+    request lain tidak dikerjakan ulang; hanya request pertama yang menerima
+    segmen (on_segment).
+    Raises:
+        StageError: Jika whisper gagal
+    """
+    timings = timings if timings is not None else {}
+    if cancel_token is not None and cancel_token.cancelled:
+        raise StageError("stt", "[ERROR] Whisper dibatalkan")
+    try:
+        language, stt_profile = resolve_stt_options(language, stt_profile)
+    except ValueError as e:
+        raise StageError("stt", f"[ERROR] {e}")
+    fingerprint = upload.fingerprint()
+
+    # Segmen hanya diteruskan selama request ini masih menunggu hasilnya
+    attached = True
+
+    def forward_segment(*segment):
+        if attached:
+            on_segment(*segment)
+
+    async def transcribe(token):
+        windows = [None]
+        if upload.pcm is not None:
+            windows = plan_windows(upload.pcm, upload.sample_rate, upload.channels,
+                                   stage_pool.pools["stt"].limit)
+        metrics.observe("stt_chunks", len(windows))
+        if len(windows) > 1:
+            return await _transcribe_chunked(upload, windows, language, stt_profile, token)
+        return await _transcribe_audio(upload, fingerprint, language, stt_profile,
+                                       forward_segment if on_segment else None, token)
+
+    try:
+        with timed_stage(timings, "stt"):
+            lease = await stt_flights.acquire((fingerprint, language, stt_profile), transcribe)
+    except asyncio.TimeoutError:
+        raise StageError("stt", "[ERROR] Transkripsi melebihi batas waktu")
+    finally:
+        attached = False
+    lease.release()
+    transcription = lease.value
+    print(f"STT result: {transcription}")
+    if transcription.startswith("[ERROR]"):
+        raise StageError("stt", transcription)
+    return transcription
+
+
+async def chat_turn(text: str, session_id: str, timings: dict = None) -> str:
+    """
+    Tahap LLM saja: kirim teks ke LLM di slot LLM dan simpan gilirannya ke sesi.
+    Raises:
+        StageError: Jika LLM gagal
+    """
+    timings = timings if timings is not None else {}
+    if not llm_configured():
+        return dummy_response()
+
+    dispatcher = SpeculativeDispatcher(session_id, None, asyncio.get_running_loop())
+    try:
+        with timed_stage(timings, "llm"):
+            try:
+                reply, chat = await dispatcher.resolve(text)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ERROR] LLM error: {e}")
+                raise StageError("llm", f"[ERROR] {str(e)}")
+        if reply.startswith("[ERROR]"):
+            raise StageError("llm", reply)
+        await run_in_threadpool(commit_turn, chat, session_id)
+    finally:
+        await dispatcher.close()
+    return reply
+
+
+async def synthesize_text(text: str, output_dir: str, cancel_token=None, timings: dict = None) -> str:
+    """
+    Tahap TTS: sintesis teks (paralel per kalimat) ke file WAV di output_dir.
+    Raises:
+        StageError: Jika sintesis gagal
+    """
+    timings = timings if timings is not None else {}
+    with timed_stage(timings, "tts"):
+        audio_output_path = await synthesize_reply(text, output_dir, cancel_token)
+    print(f"TTS output path: {audio_output_path}")
+    return audio_output_path
+
+
+async def run_voice_turn(upload, session_id: str, request_dir: str,
+                         cancel_token=None, timings: dict = None, language: str = None,
+                         stt_profile: str = None, on_stage=None) -> dict:
+    """
+    Jalankan satu giliran STT -> LLM -> TTS.
+    Args:
+        upload (AudioUpload): Audio hasil read_upload()
+        session_id (str): ID sesi percakapan
+        request_dir (str): Direktori scratch request untuk file kerja dan output
+        cancel_token (CancelToken): Opsional; menghentikan proses engine jika klien putus
+        timings (dict): Opsional; diisi durasi per tahap (detik), juga saat dibatalkan
+        language (str): Bahasa transkripsi (lihat resolve_stt_options)
+        stt_profile (str): Profil decoding whisper ("fast", "balanced", "accurate")
+        on_stage (callable): Opsional, dipanggil on_stage(tahap) saat tahap
+            "stt", "llm", dan "tts" dimulai (progres job)
+    Returns:
+        dict: transcription, reply, audio_path
+    Raises:
+        StageError: Jika salah satu tahap gagal
+        asyncio.CancelledError: Jika task dibatalkan; riwayat sesi tidak diubah
+    """
+    loop = asyncio.get_running_loop()
+    dispatcher = SpeculativeDispatcher(session_id, upload.duration, loop)
+    on_segment = dispatcher.on_segment if SPECULATIVE_LLM and llm_configured() else None
+    timings = timings if timings is not None else {}
+    on_stage = on_stage or (lambda stage: None)
+    chat = None
+
+    try:
+        on_stage("stt")
+        transcription = await transcribe_upload(
+            upload,
+            cancel_token=cancel_token,
+            timings=timings,
+            language=language,
+            stt_profile=stt_profile,
+            on_segment=on_segment,
+        )
+
+        # Dapatkan respons dari LLM (memakai hasil spekulasi jika cocok)
+        on_stage("llm")
+        with timed_stage(timings, "llm"):
+            if llm_configured():
+                try:
+                    llm_response, chat = await dispatcher.resolve(transcription)
+                except (StageError, asyncio.CancelledError):
+                    raise
+                except Exception as e:
+                    print(f"[ERROR] LLM error: {e}")
+                    raise StageError("llm", f"[ERROR] {str(e)}")
+            else:
+                llm_response = dummy_response()
+        print(f"LLM response: {llm_response}")
+        if llm_response.startswith("[ERROR]"):
+            raise StageError("llm", llm_response)
+
+        # Konversi respons teks ke audio dengan TTS (per kalimat, paralel)
+        on_stage("tts")
+        audio_output_path = await synthesize_text(llm_response, request_dir, cancel_token, timings)
+
+        # Giliran baru disimpan ke riwayat hanya setelah semua tahap selesai,
+        # sehingga request yang dibatalkan tidak meninggalkan giliran setengah jadi
+        if cancel_token is not None and cancel_token.cancelled:
+            raise asyncio.CancelledError()
+        if chat is not None:
+            await run_in_threadpool(commit_turn, chat, session_id)
+    finally:
+        await dispatcher.close()
+
+    return {
+        "transcription": transcription,
+        "reply": llm_response,
+        "audio_path": audio_output_path,
+    }
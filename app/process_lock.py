@@ -0,0 +1,78 @@
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class ProcessLock:
+    """
+    Lock eksklusif lintas proses di atas lock file OS (flock / msvcrt.locking).
+    Lock otomatis lepas jika proses pemegangnya mati, sehingga tidak perlu TTL.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True, timeout: float = None) -> bool:
+        """
+        Args:
+            blocking (bool): False = langsung kembali jika lock dipegang proses lain
+            timeout (float): Batas tunggu (detik) saat blocking; None = tanpa batas
+        Returns:
+            bool: True jika lock didapat
+        """
+        if self._fd is not None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        while True:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                self._fd = fd
+                return True
+            except OSError:
+                if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                    os.close(fd)
+                    return False
+                time.sleep(0.05)
+
+    def release(self):
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def is_locked(path: str) -> bool:
+    """Apakah lock file sedang dipegang proses mana pun (termasuk proses ini)."""
+    probe = ProcessLock(path)
+    if not os.path.exists(path) or probe.acquire(blocking=False):
+        probe.release()
+        return False
+    return True
@@ -0,0 +1,521 @@
+import os
+import sys
+import glob
+import hmac
+import json
+import time
+import uuid
+import zlib
+import random
+import asyncio
+import weakref
+import threading
+import contextvars
+import tracemalloc
+from html import escape
+from collections import Counter
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse, Response
+from starlette.concurrency import run_in_threadpool as _run_in_threadpool
+
+from app.process_lock import ProcessLock
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Token admin untuk endpoint /admin (profiling, limit); wajib diisi, tanpa token
+# semua endpoint admin ditolak
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+
+# Interval sampling stack (detik) dan batas durasi satu sesi profiling
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+
+# Direktori bersama semua worker uvicorn: file kontrol profiling, serta stack dan
+# snapshot tracemalloc per proses yang digabung oleh endpoint /admin
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+
+# Seberapa sering tiap worker membaca file kontrol dan menulis stack-nya
+PROFILE_SYNC_INTERVAL = float(os.getenv("PROFILE_SYNC_INTERVAL", "1"))
+
+DEFAULT_CONTROL = {
+    "generation": "",
+    "session_until": 0.0,
+    "request_fraction": 0.0,
+    "tracemalloc_frames": 0,
+    "snapshot": "",
+    "snapshot_limit": 30,
+}
+
+# True di dalam request yang sedang diprofil; diwarisi task anak dan pekerjaan
+# thread pool yang dijalankan lewat run_in_threadpool di bawah
+_profiled = contextvars.ContextVar("profiled_request", default=False)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class StackSampler:
+    """
+    Sampling profiler berbasis sys._current_frames().
+    Aktif jika ada sesi berdurasi (configure) atau request yang sedang diprofil
+    (enter/exit); selain itu tidak ada thread yang berjalan.
+
+    Sesi berdurasi menyampel semua thread. Di luar sesi, hanya thread yang sedang
+    mengerjakan request terprofil yang disampel: event loop selama task yang
+    berjalan milik request itu, dan thread pool selama menjalankan track().
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.request_fraction = 0.0
+        self.samples = Counter()
+        self.generation = ""
+        self._lock = threading.Lock()
+        self._deadline = 0.0
+        self._active_requests = 0
+        self._thread = None
+        # thread id -> jumlah pekerjaan request terprofil yang sedang berjalan
+        self._threads = Counter()
+        # event loop -> thread id-nya, dan task milik request terprofil
+        self._loop_threads = weakref.WeakKeyDictionary()
+        self._tasks = weakref.WeakSet()
+
+    def configure(self, generation: str, session_until: float, request_fraction: float):
+        """
+        Terapkan state dari file kontrol. Generasi baru = sesi profiling baru,
+        sampel lama dibuang.
+        Args:
+            session_until (float): Akhir sesi berdurasi (epoch); 0 = tidak ada sesi
+        """
+        with self._lock:
+            if generation != self.generation:
+                self.generation = generation
+                self.samples.clear()
+            self._deadline = time.monotonic() + max(0.0, session_until - time.time())
+            self.request_fraction = request_fraction
+            running = self._deadline > time.monotonic()
+        if running:
+            self._ensure_thread()
+
+    def enter(self):
+        """Tandai task saat ini (beserta task anaknya) sebagai request terprofil."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._active_requests += 1
+            self._tasks.add(asyncio.current_task())
+            if loop not in self._loop_threads:
+                self._loop_threads[loop] = threading.get_ident()
+                if loop.get_task_factory() is None:
+                    loop.set_task_factory(self._task_factory)
+        self._ensure_thread()
+
+    def exit(self):
+        with self._lock:
+            self._active_requests -= 1
+            self._tasks.discard(asyncio.current_task())
+
+    def _task_factory(self, loop, coro, **kwargs):
+        task = asyncio.Task(coro, loop=loop, **kwargs)
+        if _profiled.get():
+            with self._lock:
+                self._tasks.add(task)
+        return task
+
+    def track(self, func, *args, **kwargs):
+        """Jalankan func dengan thread ini ikut disampel selama func berjalan."""
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._threads[thread_id] += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._threads[thread_id] -= 1
+                if self._threads[thread_id] <= 0:
+                    del self._threads[thread_id]
+
+    def _sampled_threads(self):
+        """Thread yang sedang mengerjakan request terprofil; None = semua thread."""
+        if time.monotonic() < self._deadline:
+            return None
+        with self._lock:
+            threads = set(self._threads)
+            for loop, thread_id in list(self._loop_threads.items()):
+                if asyncio.current_task(loop) in self._tasks:
+                    threads.add(thread_id)
+        return threads
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="stack-sampler", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        own_id = threading.get_ident()
+        next_flush = time.monotonic() + PROFILE_SYNC_INTERVAL
+        while True:
+            # Thread berhenti (dan bisa dibuat ulang) di bawah lock yang sama
+            # dengan enter/configure, agar tidak ada request yang terlewat
+            with self._lock:
+                finished = self._active_requests <= 0 and time.monotonic() >= self._deadline
+                if finished:
+                    self._thread = None
+            if finished:
+                self.flush()
+                return
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + PROFILE_SYNC_INTERVAL
+            threads = self._sampled_threads()
+            frames = sys._current_frames()
+            batch = Counter()
+            for thread_id, frame in frames.items():
+                if thread_id == own_id or (threads is not None and thread_id not in threads):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                batch[";".join(reversed(stack))] += 1
+            with self._lock:
+                self.samples.update(batch)
+            time.sleep(self.interval)
+
+    def flush(self):
+        """Tulis stack proses ini ke PROFILE_DIR agar bisa digabung worker mana pun."""
+        with self._lock:
+            generation = self.generation
+            samples = Counter(self.samples)
+        if not generation or not samples:
+            return
+        path = os.path.join(PROFILE_DIR, f"samples-{generation}-{os.getpid()}.txt")
+        _write_atomic(path, collapsed(samples))
+
+
+def _write_atomic(path: str, text: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def merged_samples(generation: str) -> Counter:
+    """Gabungan stack dari semua worker untuk satu sesi profiling."""
+    samples = Counter()
+    if not generation:
+        return samples
+    for path in glob.glob(os.path.join(PROFILE_DIR, f"samples-{generation}-*.txt")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    if stack:
+                        samples[stack] += int(count)
+        except (OSError, ValueError) as e:
+            print(f"[WARNING] Gagal membaca profil {path}: {e}")
+    return samples
+
+
+def collapsed(samples: Counter) -> str:
+    """Stack dalam format "collapsed" (kompatibel dengan flamegraph.pl/speedscope)."""
+    return "\n".join(f"{stack} {count}" for stack, count in sorted(samples.items())) + "\n"
+
+
+def flamegraph_svg(samples: Counter, width: int = 1200, row_height: int = 16) -> str:
+    """Render flamegraph SVG sederhana dari stack yang terkumpul."""
+    root = {"name": "all", "count": 0, "children": {}}
+    for stack, count in samples.items():
+        root["count"] += count
+        node = root
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"name": name, "count": 0, "children": {}})
+            node["count"] += count
+
+    rects = []
+    max_depth = [0]
+
+    def layout(node, x, depth):
+        max_depth[0] = max(max_depth[0], depth)
+        rects.append((x, depth, node))
+        child_x = x
+        for child in sorted(node["children"].values(), key=lambda n: n["name"]):
+            layout(child, child_x, depth + 1)
+            child_x += child["count"]
+
+    layout(root, 0, 0)
+    total = max(root["count"], 1)
+    height = (max_depth[0] + 1) * row_height
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">'
+    ]
+    for x, depth, node in rects:
+        w = node["count"] / total * width
+        if w < 0.5:
+            continue
+        y = height - (depth + 1) * row_height
+        hue = 20 + (zlib.crc32(node["name"].encode()) % 40)
+        label = escape(f'{node["name"]} ({node["count"]} samples, {node["count"] / total:.1%})')
+        parts.append(
+            f'<g><title>{label}</title>'
+            f'<rect x="{x / total * width:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 1}" '
+            f'fill="hsl({hue},90%,55%)"/>'
+        )
+        if w > 40:
+            parts.append(
+                f'<text x="{x / total * width + 3:.1f}" y="{y + row_height - 4}">'
+                f'{escape(node["name"][: int(w / 7)])}</text>'
+            )
+        parts.append("</g>")
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+sampler = StackSampler()
+
+
+async def run_in_threadpool(func, *args, **kwargs):
+    """
+    run_in_threadpool Starlette; bila dipanggil dari request yang diprofil,
+    thread pool yang menjalankan func ikut disampel selama func berjalan.
+    """
+    if _profiled.get():
+        return await _run_in_threadpool(sampler.track, func, *args, **kwargs)
+    return await _run_in_threadpool(func, *args, **kwargs)
+
+
+def _control_path() -> str:
+    return os.path.join(PROFILE_DIR, "control.json")
+
+
+def read_control() -> dict:
+    """State profiling yang berlaku untuk semua worker."""
+    data = dict(DEFAULT_CONTROL)
+    try:
+        with open(_control_path(), "r", encoding="utf-8") as f:
+            data.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Gagal membaca {_control_path()}: {e}")
+    return data
+
+
+def update_control(**changes) -> dict:
+    """Ubah file kontrol (serial lintas proses) lalu langsung terapkan di proses ini."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with ProcessLock(os.path.join(PROFILE_DIR, "control.lock")):
+        data = read_control()
+        data.update(changes)
+        _write_atomic(_control_path(), json.dumps(data))
+    controller.apply(data)
+    return data
+
+
+def _remove_stale(pattern: str, keep: str = None):
+    """Hapus file hasil lama di PROFILE_DIR, kecuali yang namanya memuat keep."""
+    for path in glob.glob(os.path.join(PROFILE_DIR, pattern)):
+        if keep is None or keep not in os.path.basename(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class ProfileController:
+    """
+    Thread background di tiap worker yang menyamakan state profiling proses ini
+    (sampler, tracemalloc) dengan file kontrol di PROFILE_DIR, dan menulis
+    snapshot tracemalloc yang diminta. Dengan begitu endpoint /admin bekerja
+    sama saja di worker mana pun request admin itu mendarat.
+    """
+
+    def __init__(self, interval: float = PROFILE_SYNC_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._mtime = None
+        self._snapshot_id = ""
+        self._last_snapshot = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="profile-control", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+        sampler.flush()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                mtime = os.path.getmtime(_control_path())
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime != self._mtime:
+                self._mtime = mtime
+                try:
+                    self.apply(read_control())
+                except Exception as e:
+                    print(f"[ERROR] Gagal menerapkan kontrol profiling: {e}")
+            self._stop.wait(self.interval)
+
+    def apply(self, data: dict):
+        with self._lock:
+            sampler.configure(data["generation"], data["session_until"], data["request_fraction"])
+            frames = data["tracemalloc_frames"]
+            if frames and not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            elif not frames and tracemalloc.is_tracing():
+                tracemalloc.stop()
+                self._last_snapshot = None
+            if data["snapshot"] and data["snapshot"] != self._snapshot_id:
+                self._snapshot_id = data["snapshot"]
+                if tracemalloc.is_tracing():
+                    self._write_snapshot(data["snapshot"], data["snapshot_limit"])
+
+    def _write_snapshot(self, snapshot_id: str, limit: int):
+        """Alokasi terbesar per baris kode, beserta selisih dari snapshot sebelumnya."""
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"# worker pid={os.getpid()}",
+                 f"traced current={current} bytes peak={peak} bytes", "", "# top allocations"]
+        lines += [str(stat) for stat in snapshot.statistics("lineno")[:limit]]
+        if self._last_snapshot is not None:
+            lines += ["", "# diff vs previous snapshot"]
+            lines += [str(stat) for stat in snapshot.compare_to(self._last_snapshot, "lineno")[:limit]]
+        self._last_snapshot = snapshot
+        path = os.path.join(PROFILE_DIR, f"tracemalloc-{snapshot_id}-{os.getpid()}.txt")
+        _write_atomic(path, "\n".join(lines) + "\n")
+
+
+controller = ProfileController()
+
+
+class ProfilingMiddleware:
+    """
+    Middleware ASGI yang memprofil sebagian request (sampler.request_fraction).
+    Saat profiling mati, biayanya hanya satu perbandingan per request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or sampler.request_fraction <= 0.0:
+            await self.app(scope, receive, send)
+            return
+        if random.random() >= sampler.request_fraction:
+            await self.app(scope, receive, send)
+            return
+        token = _profiled.set(True)
+        sampler.enter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            sampler.exit()
+            _profiled.reset(token)
+
+
+def require_admin(request: Request):
+    if not PROFILING_ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Endpoint admin nonaktif: PROFILING_ADMIN_TOKEN belum diset")
+    token = request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), PROFILING_ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+async def _wait_for_workers():
+    """Beri waktu worker lain membaca file kontrol dan menulis hasilnya."""
+    await asyncio.sleep(2 * PROFILE_SYNC_INTERVAL + sampler.interval)
+
+
+router = APIRouter(prefix="/admin")
+
+
+@router.post("/profile/start")
+async def profile_start(request: Request, seconds: float = 30.0):
+    """Mulai sampling stack semua thread di semua worker selama N detik (sampel lama dihapus)."""
+    require_admin(request)
+    seconds = max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+    generation = uuid.uuid4().hex[:12]
+    await run_in_threadpool(update_control, generation=generation, session_until=time.time() + seconds)
+    _remove_stale("samples-*.txt", f"samples-{generation}-")
+    return {"status": "sampling", "seconds": seconds, "interval": sampler.interval}
+
+
+@router.post("/profile/requests")
+async def profile_requests(request: Request, fraction: float = 0.1):
+    """Profil sebagian request secara acak di semua worker (0 untuk mematikan)."""
+    require_admin(request)
+    fraction = max(0.0, min(fraction, 1.0))
+    generation = read_control()["generation"] or uuid.uuid4().hex[:12]
+    await run_in_threadpool(update_control, generation=generation, request_fraction=fraction)
+    return {"status": "ok", "request_fraction": fraction}
+
+
+@router.post("/profile/stop")
+async def profile_stop(request: Request):
+    require_admin(request)
+    data = await run_in_threadpool(update_control, session_until=0.0, request_fraction=0.0)
+    await _wait_for_workers()
+    return {"status": "stopped", "samples": sum(merged_samples(data["generation"]).values())}
+
+
+@router.get("/profile/collapsed")
+async def profile_collapsed(request: Request):
+    require_admin(request)
+    sampler.flush()
+    return PlainTextResponse(collapsed(merged_samples(read_control()["generation"])))
+
+
+@router.get("/profile/flamegraph")
+async def profile_flamegraph(request: Request):
+    require_admin(request)
+    sampler.flush()
+    samples = merged_samples(read_control()["generation"])
+    return Response(content=flamegraph_svg(samples), media_type="image/svg+xml")
+
+
+@router.post("/tracemalloc/start")
+async def tracemalloc_start(request: Request, frames: int = 10):
+    require_admin(request)
+    frames = max(1, frames)
+    await run_in_threadpool(update_control, tracemalloc_frames=frames)
+    return {"status": "tracing", "frames": frames}
+
+
+@router.post("/tracemalloc/stop")
+async def tracemalloc_stop(request: Request):
+    require_admin(request)
+    await run_in_threadpool(update_control, tracemalloc_frames=0)
+    _remove_stale("tracemalloc-*.txt")
+    return {"status": "stopped"}
+
+
+@router.get("/tracemalloc/snapshot")
+async def tracemalloc_snapshot(request: Request, limit: int = 30):
+    """Snapshot tracemalloc dari semua worker, satu bagian per proses."""
+    require_admin(request)
+    if not read_control()["tracemalloc_frames"]:
+        raise HTTPException(status_code=409, detail="tracemalloc belum dijalankan")
+
+    snapshot_id = uuid.uuid4().hex[:12]
+    await run_in_threadpool(update_control, snapshot=snapshot_id, snapshot_limit=limit)
+    await _wait_for_workers()
+    sections = []
+    for path in sorted(glob.glob(os.path.join(PROFILE_DIR, f"tracemalloc-{snapshot_id}-*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            sections.append(f.read())
+    _remove_stale("tracemalloc-*.txt", f"tracemalloc-{snapshot_id}-")
+    return PlainTextResponse("\n".join(sections))
@@ -0,0 +1,312 @@
+import io
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import asyncio
+import threading
+from collections import defaultdict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import httpx
+
+from app.traffic import read_traces, read_audio, soundfile
+from app.metrics import _percentile
+
+# Service yang diuji dan kecepatan replay (2 = jeda antar kedatangan dibagi dua)
+REPLAY_URL = os.getenv("REPLAY_URL", "http://127.0.0.1:8000")
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "1"))
+REPLAY_TIMEOUT = float(os.getenv("REPLAY_TIMEOUT", "300"))
+
+# File hasil replay (default replay-<run>.json di direktori kerja)
+REPLAY_OUTPUT = os.getenv("REPLAY_OUTPUT", "")
+
+# Stub Gemini offline berisi balasan LLM terekam (0 = tidak dijalankan). Service
+# dijalankan dengan GEMINI_BASE_URL=http://127.0.0.1:<port>, GEMINI_API_KEY apa pun,
+# dan LLM_CONTEXT_CACHE=0
+REPLAY_STUB_PORT = int(os.getenv("REPLAY_STUB_PORT", "8090"))
+
+# Stub menunggu selama durasi LLM terekam sebelum membalas, agar beban
+# tahap LLM ikut realistis (0 = langsung membalas)
+REPLAY_STUB_LATENCY = os.getenv("REPLAY_STUB_LATENCY", "1") == "1"
+
+STAGES = ("stt", "llm", "tts")
+
+USAGE = """Penggunaan:
+  python -m app.replay run ARSIP...          putar ulang trace ke REPLAY_URL, hasil ke replay-<run>.json
+  python -m app.replay stub ARSIP...         hanya jalankan stub LLM offline di REPLAY_STUB_PORT
+  python -m app.replay compare HASIL...      bandingkan distribusi latensi (hasil pertama = acuan;
+                                             arsip trace = latensi saat direkam)"""
+
+
+def _normalize(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", "", (text or "").lower()).split())
+
+
+class ReplyStub:
+    """
+    Balasan LLM terekam, dicari dari prompt (transkrip). Prompt yang tidak
+    persis sama (transkrip sedikit berbeda, draf spekulatif dari transkrip
+    parsial) memakai trace dengan kata bersama terbanyak.
+    """
+
+    def __init__(self, traces: list, latency: bool = REPLAY_STUB_LATENCY):
+        self.latency = latency
+        self._by_prompt = defaultdict(deque)
+        self._lock = threading.Lock()
+        for trace in traces:
+            if trace.get("reply"):
+                entry = (trace["reply"], trace["timings"].get("llm", 0.0))
+                self._by_prompt[_normalize(trace["transcript"])].append(entry)
+
+    def lookup(self, prompt: str) -> tuple:
+        """Returns: tuple (balasan, durasi LLM terekam dalam detik)"""
+        key = _normalize(prompt)
+        with self._lock:
+            if key not in self._by_prompt:
+                words = set(key.split())
+                key = max(
+                    self._by_prompt,
+                    key=lambda candidate: len(words & set(candidate.split())),
+                    default=None,
+                )
+            if key is None:
+                return "Maaf, saya tidak tahu.", 0.0
+            # Transkrip yang sama dengan balasan berbeda (riwayat berbeda) dipakai bergiliran
+            replies = self._by_prompt[key]
+            replies.rotate(-1)
+            return replies[-1]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status: int, body: dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                # Probe /health: GET models/{MODEL}
+                self._send_json(200, {"name": self.path.rsplit("/", 1)[-1]})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if ":generateContent" not in self.path:
+                    # cachedContents dan lainnya: klien jatuh ke riwayat penuh
+                    self._send_json(404, {"error": {"code": 404, "message": "not stubbed", "status": "NOT_FOUND"}})
+                    return
+                contents = json.loads(body or b"{}").get("contents") or [{}]
+                prompt = " ".join(part.get("text", "") for part in contents[-1].get("parts", []))
+                reply, seconds = stub.lookup(prompt)
+                if stub.latency and seconds:
+                    time.sleep(seconds)
+                self._send_json(200, {
+                    "candidates": [{
+                        "content": {"role": "model", "parts": [{"text": reply}]},
+                        "finishReason": "STOP",
+                    }],
+                    "usageMetadata": {"promptTokenCount": len(prompt.split()), "candidatesTokenCount": len(reply.split())},
+                })
+
+        return Handler
+
+    def serve(self, port: int = REPLAY_STUB_PORT) -> ThreadingHTTPServer:
+        """Jalankan stub di thread background; hentikan dengan server.shutdown()."""
+        server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="replay-llm-stub", daemon=True).start()
+        return server
+
+
+def _parse_server_timing(header: str) -> dict:
+    timings = {}
+    for item in (header or "").split(","):
+        match = re.match(r"\s*([\w-]+);dur=([\d.]+)", item)
+        if match:
+            timings[match.group(1)] = float(match.group(2)) / 1000
+    return timings
+
+
+def _request_audio(trace: dict) -> tuple:
+    """Returns: tuple (nama file, byte audio) dalam format upload aslinya."""
+    audio = read_audio(trace)
+    ext = os.path.splitext(trace["audio"])[1]
+    # Klien asli mengirim WAV: ubah FLAC arsip kembali ke WAV agar jalur decode sama
+    if ext == ".flac" and trace["audio_format"] == ".wav" and soundfile is not None:
+        frames, rate = soundfile.read(io.BytesIO(audio), dtype="int16", always_2d=True)
+        buf = io.BytesIO()
+        soundfile.write(buf, frames, rate, format="WAV", subtype="PCM_16")
+        return "audio.wav", buf.getvalue()
+    return f"audio{ext}", audio
+
+
+async def _send(client: httpx.AsyncClient, url: str, run_id: str, trace: dict, scheduled: float) -> dict:
+    filename, audio = await asyncio.to_thread(_request_audio, trace)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    result = {
+        "id": trace["id"],
+        "offset": round(scheduled, 4),
+        "lag": round(max(0.0, started - scheduled), 4),
+        "audio_seconds": trace.get("audio_seconds"),
+        "recorded_latency": trace["latency"],
+    }
+    data = {"session_id": f"replay-{run_id}-{trace['session']}"}
+    for field in ("language", "stt_profile"):
+        if trace.get(field):
+            data[field] = trace[field]
+    try:
+        response = await client.post(f"{url}/voice-chat", files={"file": (filename, audio)}, data=data)
+        result["status"] = response.status_code
+        result["timings"] = _parse_server_timing(response.headers.get("Server-Timing"))
+        if response.status_code != 200:
+            result["error"] = response.text[:500]
+    except httpx.HTTPError as e:
+        result["status"] = 0
+        result["timings"] = {}
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["latency"] = round(loop.time() - started, 4)
+    return result
+
+
+async def replay(traces: list, url: str = REPLAY_URL, speed: float = REPLAY_SPEED) -> dict:
+    """
+    Kirim ulang trace ke service dengan jeda antar kedatangan asli dibagi speed.
+    Request tidak menunggu request sebelumnya (open loop), seperti trafik asli.
+    """
+    run_id = uuid.uuid4().hex[:8]
+    loop = asyncio.get_running_loop()
+    t0 = traces[0]["arrived_at"]
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=64)
+    async with httpx.AsyncClient(timeout=REPLAY_TIMEOUT, limits=limits) as client:
+        start = loop.time()
+        tasks = []
+        for trace in traces:
+            offset = (trace["arrived_at"] - t0) / speed
+            delay = start + offset - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(_send(client, url, run_id, trace, start + offset)))
+        results = await asyncio.gather(*tasks)
+    for result in results:
+        result["offset"] = round(result["offset"] - start, 4)
+    return {
+        "run": run_id,
+        "url": url,
+        "speed": speed,
+        "started_at": time.time(),
+        "results": results,
+    }
+
+
+def load_run(path: str) -> dict:
+    """Hasil replay (JSON), atau arsip trace sebagai hasil 'recorded'."""
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    traces = read_traces([path])
+    return {
+        "run": "recorded",
+        "speed": 1.0,
+        "results": [
+            {"id": t["id"], "status": t["status"], "latency": t["latency"], "timings": t["timings"]}
+            for t in traces
+        ],
+    }
+
+
+def summarize(run: dict) -> dict:
+    """Ringkasan distribusi latensi total dan per tahap (request yang berhasil saja)."""
+    ok = [r for r in run["results"] if r["status"] == 200]
+    series = {"latency": [r["latency"] for r in ok]}
+    for stage in STAGES:
+        series[stage] = [r["timings"][stage] for r in ok if stage in r["timings"]]
+    summary = {"requests": len(run["results"]), "errors": len(run["results"]) - len(ok)}
+    for name, values in series.items():
+        values = sorted(values)
+        summary[name] = {
+            "count": len(values),
+            "mean": sum(values) / len(values) if values else 0.0,
+            "p50": _percentile(values, 0.50),
+            "p90": _percentile(values, 0.90),
+            "p99": _percentile(values, 0.99),
+            "max": values[-1] if values else 0.0,
+        }
+    return summary
+
+
+def compare(paths: list) -> list:
+    """Cetak tabel p50/p90/p99 tiap hasil beserta selisihnya terhadap hasil pertama."""
+    runs = [(path, load_run(path)) for path in paths]
+    summaries = [summarize(run) for _, run in runs]
+    baseline = summaries[0]
+    for (path, run), summary in zip(runs, summaries):
+        print(f"\n{path} (run {run['run']}, speed {run.get('speed', 1.0)}x, "
+              f"{summary['requests']} request, {summary['errors']} gagal)")
+        for name in ("latency",) + STAGES:
+            stats = summary[name]
+            if not stats["count"]:
+                continue
+            cells = []
+            for q in ("p50", "p90", "p99"):
+                cell = f"{q} {stats[q]:8.3f}s"
+                base = baseline[name][q]
+                if summary is not baseline and base:
+                    cell += f" ({(stats[q] - base) / base * 100:+6.1f}%)"
+                cells.append(cell)
+            print(f"  {name:8} " + "  ".join(cells))
+    return summaries
+
+
+def main(argv: list):
+    if len(argv) < 2 or argv[0] not in ("run", "stub", "compare"):
+        print(USAGE)
+        return 2
+    command, paths = argv[0], argv[1:]
+    if command == "compare":
+        compare(paths)
+        return 0
+
+    traces = read_traces(paths)
+    if not traces:
+        print("[ERROR] Tidak ada trace di arsip")
+        return 1
+    stub = ReplyStub(traces)
+    if command == "stub":
+        server = stub.serve()
+        print(f"Stub LLM di http://127.0.0.1:{REPLAY_STUB_PORT} ({len(traces)} trace), Ctrl+C untuk berhenti")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+
+    server = stub.serve() if REPLAY_STUB_PORT else None
+    if server is not None:
+        print(f"Stub LLM di http://127.0.0.1:{REPLAY_STUB_PORT}; jalankan service dengan "
+              f"GEMINI_BASE_URL=http://127.0.0.1:{REPLAY_STUB_PORT} GEMINI_API_KEY=replay LLM_CONTEXT_CACHE=0")
+    span = traces[-1]["arrived_at"] - traces[0]["arrived_at"]
+    print(f"Replay {len(traces)} trace ({span / REPLAY_SPEED:.1f} detik pada {REPLAY_SPEED}x) ke {REPLAY_URL}")
+    try:
+        run = asyncio.run(replay(traces, REPLAY_URL, REPLAY_SPEED))
+    finally:
+        if server is not None:
+            server.shutdown()
+    output = REPLAY_OUTPUT or f"replay-{run['run']}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(run, f, indent=2)
+    print(f"Hasil disimpan di {output}")
+    compare([paths[0], output] if len(paths) == 1 else [output])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
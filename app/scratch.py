@@ -0,0 +1,178 @@
+import os
+import glob
+import time
+import shutil
+import tempfile
+import threading
+from starlette.background import BackgroundTask
+
+from app import metrics
+from app.process_lock import ProcessLock, is_locked
+
+# Semua file sementara milik API ditaruh di bawah satu direktori scratch,
+# satu subdirektori per request, supaya mudah dibersihkan
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "voice_chat_scratch"))
+
+# Batas umur dan total ukuran scratch sebelum janitor menghapus isinya
+SCRATCH_MAX_AGE = float(os.getenv("SCRATCH_MAX_AGE", "3600"))
+SCRATCH_MAX_BYTES = int(os.getenv("SCRATCH_MAX_BYTES", str(1024 * 1024 * 1024)))
+SCRATCH_JANITOR_INTERVAL = float(os.getenv("SCRATCH_JANITOR_INTERVAL", "60"))
+
+# Umur minimum sebelum direktori request boleh dihapus janitor, apa pun
+# alasannya; minimal sepanjang request terlama yang masih wajar berjalan
+SCRATCH_MIN_AGE = float(os.getenv("SCRATCH_MIN_AGE", "600"))
+
+# Lock file di dalam direktori request yang dipegang selama request berjalan,
+# sehingga janitor di worker uvicorn mana pun tahu direktori itu masih dipakai
+IN_USE_MARKER = ".in_use"
+
+# Pola file lama yang dulu ditinggalkan langsung di direktori temp sistem
+LEGACY_PATTERNS = ("received_audio_*", "tts_*.wav")
+
+# Direktori request milik proses ini -> ProcessLock pada IN_USE_MARKER-nya
+_active_dirs = {}
+_active_lock = threading.Lock()
+
+
+def _path_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def create_request_dir(prefix: str = "req_") -> str:
+    """
+    Buat direktori scratch khusus untuk satu request.
+    Returns:
+        str: Path direktori yang harus dihapus dengan remove_request_dir
+    """
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    path = tempfile.mkdtemp(prefix=prefix, dir=SCRATCH_DIR)
+    marker = ProcessLock(os.path.join(path, IN_USE_MARKER))
+    marker.acquire(blocking=False)
+    with _active_lock:
+        _active_dirs[path] = marker
+    return path
+
+
+def remove_request_dir(path: str, reason: str = "request"):
+    """Hapus direktori scratch sebuah request dan catat byte yang dibebaskan."""
+    with _active_lock:
+        marker = _active_dirs.pop(path, None)
+    if marker is not None:
+        marker.release()
+    _remove(path, reason)
+
+
+def cleanup_task(path: str) -> BackgroundTask:
+    """BackgroundTask untuk menghapus direktori request setelah respons terkirim."""
+    return BackgroundTask(remove_request_dir, path)
+
+
+def _remove(path: str, reason: str):
+    size = _path_size(path)
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        print(f"[WARNING] Gagal menghapus scratch {path}: {e}")
+        return
+    metrics.inc("scratch_bytes_reclaimed", size, reason=reason)
+    metrics.inc("scratch_entries_removed", reason=reason)
+
+
+def _in_use(path: str) -> bool:
+    """Apakah direktori request masih dipegang request di proses mana pun."""
+    return os.path.isdir(path) and is_locked(os.path.join(path, IN_USE_MARKER))
+
+
+def sweep():
+    """
+    Satu putaran janitor: hapus entri yang lebih tua dari SCRATCH_MAX_AGE,
+    lalu hapus yang paling lama sampai total ukuran di bawah SCRATCH_MAX_BYTES.
+    Direktori yang masih dipakai request (di worker mana pun) atau lebih muda
+    dari SCRATCH_MIN_AGE tidak pernah dihapus.
+    """
+    now = time.time()
+    with _active_lock:
+        active = set(_active_dirs)
+
+    # File lama di direktori temp sistem hanya dibersihkan berdasarkan umur
+    tmp_dir = tempfile.gettempdir()
+    for pattern in LEGACY_PATTERNS:
+        for path in glob.glob(os.path.join(tmp_dir, pattern)):
+            try:
+                if now - os.path.getmtime(path) > SCRATCH_MAX_AGE:
+                    _remove(path, "legacy")
+            except OSError:
+                continue
+
+    entries = []
+    if os.path.isdir(SCRATCH_DIR):
+        entries = [os.path.join(SCRATCH_DIR, name) for name in os.listdir(SCRATCH_DIR)]
+
+    remaining = []
+    in_use = 0
+    for path in entries:
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        busy = path in active or _in_use(path)
+        in_use += busy
+        if busy or now - mtime < SCRATCH_MIN_AGE:
+            # Tetap dihitung ke total ukuran, tetapi tidak boleh dihapus
+            remaining.append((mtime, path, _path_size(path), False))
+        elif now - mtime > SCRATCH_MAX_AGE:
+            _remove(path, "age")
+        else:
+            remaining.append((mtime, path, _path_size(path), True))
+
+    total = sum(size for _, _, size, _ in remaining)
+    for _, path, size, evictable in sorted(remaining):
+        if total <= SCRATCH_MAX_BYTES:
+            break
+        if evictable:
+            _remove(path, "size")
+            total -= size
+
+    metrics.set_gauge("scratch_bytes", total)
+    metrics.set_gauge("scratch_active_dirs", in_use)
+
+
+class Janitor:
+    """Thread background yang menjalankan sweep() secara berkala."""
+
+    def __init__(self, interval: float = SCRATCH_JANITOR_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="scratch-janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                sweep()
+            except Exception as e:
+                print(f"[ERROR] Scratch janitor gagal: {e}")
+            self._stop.wait(self.interval)
+
+
+janitor = Janitor()
@@ -0,0 +1,153 @@
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# File SQLite yang dipakai bersama oleh semua worker uvicorn
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", os.path.join(BASE_DIR, "sessions.db"))
+
+# Batas waktu menunggu lock sesi, dan umur lock sebelum dianggap basi
+# (misalnya worker yang memegang lock mati di tengah request)
+SESSION_LOCK_TIMEOUT = float(os.getenv("SESSION_LOCK_TIMEOUT", "120"))
+SESSION_LOCK_TTL = float(os.getenv("SESSION_LOCK_TTL", "300"))
+
+DEFAULT_SESSION_ID = "default"
+
+_local = threading.local()
+
+# Lease lock sesi di proses ini: session_id -> (owner, expires_at). Memakai TTL
+# yang sama dengan baris session_locks, dan entri dihapus saat dilepas
+_process_leases = {}
+_process_leases_changed = threading.Condition()
+
+
+def _connect() -> sqlite3.Connection:
+    """Satu koneksi per thread; SQLite dalam mode WAL aman dipakai lintas proses."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(SESSION_DB_PATH, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " history TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_locks ("
+            " session_id TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        _local.conn = conn
+    return conn
+
+
+def load_history(session_id: str):
+    """
+    Ambil riwayat chat (JSON) untuk sebuah sesi.
+    Args:
+        session_id (str): ID sesi percakapan
+    Returns:
+        str | None: JSON riwayat chat, atau None jika sesi belum ada
+    """
+    row = _connect().execute(
+        "SELECT history FROM sessions WHERE session_id = ?", (session_id,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def save_history(session_id: str, history_json: str):
+    """Simpan (upsert) riwayat chat untuk sebuah sesi."""
+    _connect().execute(
+        "INSERT INTO sessions (session_id, history, updated_at) VALUES (?, ?, ?)"
+        " ON CONFLICT(session_id) DO UPDATE SET"
+        " history = excluded.history, updated_at = excluded.updated_at",
+        (session_id, history_json, time.time()),
+    )
+
+
+def _acquire_process_lease(session_id: str, owner: str, timeout: float) -> bool:
+    """Antre lease sesi di proses ini; lease yang kedaluwarsa dianggap bebas."""
+    deadline = time.monotonic() + timeout
+    with _process_leases_changed:
+        while True:
+            lease = _process_leases.get(session_id)
+            if lease is None or lease[1] < time.time():
+                _process_leases[session_id] = (owner, time.time() + SESSION_LOCK_TTL)
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # Bangun saat lease dilepas, kedaluwarsa, atau batas tunggu habis
+            _process_leases_changed.wait(max(0.01, min(remaining, lease[1] - time.time())))
+
+
+def _release_process_lease(session_id: str, owner: str):
+    with _process_leases_changed:
+        lease = _process_leases.get(session_id)
+        if lease is not None and lease[0] == owner:
+            del _process_leases[session_id]
+            _process_leases_changed.notify_all()
+
+
+def acquire_session_lock(session_id: str, timeout: float = SESSION_LOCK_TIMEOUT) -> str:
+    """
+    Ambil lock eksklusif per sesi yang berlaku lintas worker.
+    Request di worker yang sama antre di lease proses, sedangkan antar worker
+    memakai baris di tabel session_locks. Keduanya ber-TTL (SESSION_LOCK_TTL)
+    agar lock yang tidak pernah dilepas (worker mati, pemegang hilang) tidak
+    menggantung selamanya.
+    Returns:
+        str: Token pemilik yang wajib diberikan ke release_session_lock
+    """
+    owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+    if not _acquire_process_lease(session_id, owner, timeout):
+        raise TimeoutError(f"Sesi {session_id} sedang dipakai request lain")
+
+    conn = _connect()
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            now = time.time()
+            cur = conn.execute(
+                "INSERT INTO session_locks (session_id, owner, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(session_id) DO UPDATE SET"
+                " owner = excluded.owner, expires_at = excluded.expires_at"
+                " WHERE session_locks.expires_at < ?",
+                (session_id, owner, now + SESSION_LOCK_TTL, now),
+            )
+            if cur.rowcount == 1:
+                return owner
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Sesi {session_id} sedang dipakai worker lain")
+            time.sleep(0.05)
+    except BaseException:
+        _release_process_lease(session_id, owner)
+        raise
+
+
+def release_session_lock(session_id: str, owner: str):
+    """Lepas lock sesi; boleh dipanggil dari thread yang berbeda dengan acquire."""
+    try:
+        _connect().execute(
+            "DELETE FROM session_locks WHERE session_id = ? AND owner = ?",
+            (session_id, owner),
+        )
+    finally:
+        _release_process_lease(session_id, owner)
+
+
+@contextmanager
+def session_lock(session_id: str, timeout: float = SESSION_LOCK_TIMEOUT):
+    """Context manager di atas acquire_session_lock/release_session_lock."""
+    owner = acquire_session_lock(session_id, timeout)
+    try:
+        yield
+    finally:
+        release_session_lock(session_id, owner)
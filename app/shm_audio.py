@@ -0,0 +1,161 @@
+import os
+import threading
+from collections import deque
+from typing import NamedTuple
+from multiprocessing import shared_memory
+import numpy as np
+
+# Ukuran ring buffer shared memory per pemilik (proses API atau engine worker)
+SHM_RING_BYTES = int(os.getenv("SHM_RING_BYTES", str(64 * 1024 * 1024)))
+
+# Alokasi di ring disejajarkan ke cache line
+ALIGNMENT = 64
+
+
+class AudioRef(NamedTuple):
+    """Pesan kontrol kecil yang menunjuk audio di shared memory (yang dikirim lewat queue)."""
+    segment: str
+    offset: int
+    nbytes: int
+    sample_rate: int
+    channels: int
+    dtype: str = "<i2"
+
+
+class SharedRing:
+    """
+    Allocator ring buffer di atas satu segmen shared memory.
+
+    Hanya proses pemilik yang mengalokasikan dan membebaskan blok; proses lain
+    hanya membaca/menulis lewat AudioRef. Blok dibebaskan secara eksplisit
+    (release), dan ruang di ring dipakai ulang begitu blok tertua bebas. Audio
+    yang tidak muat di ring mendapat segmen sendiri yang di-unlink saat release.
+    """
+
+    def __init__(self, size: int = SHM_RING_BYTES):
+        self.size = size
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.name = self.shm.name
+        self._lock = threading.Lock()
+        self._blocks = deque()  # [offset, size, freed] urut alokasi
+        self._live = {}         # offset -> blok
+        self._head = 0          # posisi tulis berikutnya
+        self._overflow = {}     # nama segmen -> SharedMemory untuk audio besar
+
+    def _alloc(self, nbytes: int):
+        size = max(ALIGNMENT, (nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT)
+        with self._lock:
+            if not self._blocks:
+                self._head = 0
+            tail = self._blocks[0][0] if self._blocks else 0
+            if self._head >= tail:
+                # Ruang bebas: [head, akhir ring), lalu [0, tail)
+                if self._head + size <= self.size:
+                    offset = self._head
+                elif size < tail:
+                    offset = 0
+                else:
+                    return None
+            else:
+                # Ring sudah berputar: ruang bebas hanya [head, tail)
+                if self._head + size < tail:
+                    offset = self._head
+                else:
+                    return None
+            block = [offset, size, False]
+            self._blocks.append(block)
+            self._live[offset] = block
+            self._head = offset + size
+            return offset
+
+    def put(self, data: np.ndarray, sample_rate: int, channels: int) -> AudioRef:
+        """Salin audio ke shared memory sekali; kembalikan referensinya."""
+        data = np.ascontiguousarray(data)
+        offset = self._alloc(data.nbytes)
+        if offset is None:
+            segment = shared_memory.SharedMemory(create=True, size=max(1, data.nbytes))
+            with self._lock:
+                self._overflow[segment.name] = segment
+            name, offset = segment.name, 0
+            buf = segment.buf
+        else:
+            name, buf = self.name, self.shm.buf
+        np.frombuffer(buf, dtype=data.dtype, count=data.size, offset=offset)[:] = data.reshape(-1)
+        return AudioRef(name, offset, data.nbytes, sample_rate, channels, data.dtype.str)
+
+    def release(self, ref: AudioRef):
+        """Bebaskan blok milik ref. Aman dipanggil dua kali."""
+        with self._lock:
+            if ref.segment != self.name:
+                segment = self._overflow.pop(ref.segment, None)
+                if segment is not None:
+                    segment.close()
+                    segment.unlink()
+                return
+            block = self._live.pop(ref.offset, None)
+            if block is None:
+                return
+            block[2] = True
+            while self._blocks and self._blocks[0][2]:
+                self._blocks.popleft()
+
+    @property
+    def used_bytes(self) -> int:
+        with self._lock:
+            return sum(block[1] for block in self._blocks if not block[2])
+
+    def close(self):
+        """Lepas dan unlink semua segmen milik ring ini."""
+        with self._lock:
+            for segment in self._overflow.values():
+                segment.close()
+                segment.unlink()
+            self._overflow.clear()
+            self._blocks.clear()
+            self._live.clear()
+        self.shm.close()
+        self.shm.unlink()
+
+
+_attached = {}
+_attached_lock = threading.Lock()
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    with _attached_lock:
+        segment = _attached.get(name)
+        if segment is None:
+            # Engine worker di-spawn dari proses API dan memakai resource
+            # tracker yang sama, sehingga segmen yang bocor (misalnya karena
+            # worker mati) tetap di-unlink saat semua proses selesai
+            segment = shared_memory.SharedMemory(name=name)
+            _attached[name] = segment
+        return segment
+
+
+def view(ref: AudioRef) -> np.ndarray:
+    """View numpy (tanpa salinan) ke audio yang ditunjuk ref."""
+    dtype = np.dtype(ref.dtype)
+    segment = _attach(ref.segment)
+    return np.frombuffer(segment.buf, dtype=dtype, count=ref.nbytes // dtype.itemsize, offset=ref.offset)
+
+
+def detach(name: str):
+    """Lepas attachment ke segmen overflow yang sudah selesai dipakai."""
+    with _attached_lock:
+        segment = _attached.pop(name, None)
+        if segment is None:
+            return
+        try:
+            segment.close()
+        except BufferError:
+            # Masih ada view numpy yang hidup; dilepas lagi di detach_all
+            _attached[name] = segment
+
+
+def detach_all():
+    with _attached_lock:
+        segments = list(_attached.values())
+        _attached.clear()
+    for segment in segments:
+        segment.close()
@@ -0,0 +1,110 @@
+import os
+import asyncio
+
+from app import metrics
+from app.cancellation import CancelToken
+
+# Batas waktu tunggu satu pemanggil (detik, 0 = tanpa batas). Pemanggil yang
+# habis waktunya keluar sendiri; kerja bersama tetap jalan selama masih ada
+# pemanggil lain yang menunggu
+SINGLEFLIGHT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_TIMEOUT", "0"))
+
+
+class _Flight:
+    def __init__(self, key, task, token):
+        self.key = key
+        self.task = task
+        self.token = token
+        self.refs = 0
+
+
+class Lease:
+    """
+    Hasil kerja bersama yang sedang dipakai satu pemanggil. release() wajib
+    dipanggil setelah selesai; hasil baru dibersihkan (callback release milik
+    SingleFlight) setelah semua pemanggil melepasnya.
+    """
+
+    def __init__(self, group, flight, value):
+        self.value = value
+        self._group = group
+        self._flight = flight
+
+    def release(self):
+        if self._flight is not None:
+            flight, self._flight = self._flight, None
+            self._group._leave(flight)
+
+
+class SingleFlight:
+    """
+    Menggabungkan kerja identik yang sedang berjalan bersamaan: pemanggil
+    pertama untuk sebuah key menjalankan fn, pemanggil berikutnya ikut
+    menunggu hasil yang sama. Key dilepas begitu kerja selesai, sehingga ini
+    bukan cache; kegagalan (exception) diteruskan ke semua penunggu dan
+    pemanggil berikutnya mencoba lagi.
+
+    Kerja dibatalkan (token dan task) hanya jika semua pemanggil sudah pergi,
+    baik karena dibatalkan maupun karena timeout.
+    """
+
+    def __init__(self, name: str, release=None):
+        self.name = name
+        self._release = release
+        self._flights = {}
+
+    async def acquire(self, key, fn, timeout: float = None) -> Lease:
+        """
+        Args:
+            key: Identitas kerja (hashable); None = tidak digabung
+            fn (callable): async fn(cancel_token) yang menghasilkan nilai
+            timeout (float): Batas tunggu pemanggil ini (default SINGLEFLIGHT_TIMEOUT)
+        Returns:
+            Lease: Hasil fn; panggil release() setelah selesai dipakai
+        Raises:
+            asyncio.TimeoutError: Jika hasil belum ada setelah timeout
+        """
+        if timeout is None:
+            timeout = SINGLEFLIGHT_TIMEOUT or None
+
+        flight = self._flights.get(key) if key is not None else None
+        if flight is None:
+            token = CancelToken()
+            flight = _Flight(key, asyncio.ensure_future(fn(token)), token)
+            if key is not None:
+                self._flights[key] = flight
+                flight.task.add_done_callback(lambda _: self._forget(flight))
+        else:
+            metrics.inc("singleflight_shared", stage=self.name)
+        flight.refs += 1
+        metrics.set_gauge("singleflight_in_flight", len(self._flights), stage=self.name)
+
+        try:
+            value = await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("singleflight_timeout", stage=self.name)
+            self._leave(flight)
+            raise
+        except BaseException:
+            self._leave(flight)
+            raise
+        return Lease(self, flight, value)
+
+    def _forget(self, flight: _Flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+        metrics.set_gauge("singleflight_in_flight", len(self._flights), stage=self.name)
+
+    def _leave(self, flight: _Flight):
+        flight.refs -= 1
+        if flight.refs > 0:
+            return
+        task = flight.task
+        if not task.done():
+            # Tidak ada lagi yang menunggu: hentikan engine-nya
+            metrics.inc("singleflight_abandoned", stage=self.name)
+            self._forget(flight)
+            flight.token.cancel("abandoned")
+            task.cancel()
+        elif self._release is not None and not task.cancelled() and task.exception() is None:
+            self._release(task.result())
@@ -0,0 +1,173 @@
+import os
+import time
+import heapq
+import asyncio
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager
+
+from app import metrics
+from app.autotune import tuned_instances, tuned_cpusets
+from app.adaptive_limit import GradientLimit
+
+# Jumlah slot awal (request yang boleh berjalan bersamaan) per tahap, per worker.
+# Tanpa env var, STT/TTS memakai jumlah instance hasil auto-tuning (app/autotune.py)
+STAGE_LIMITS = {
+    "stt": int(os.getenv("STT_MAX_CONCURRENCY") or tuned_instances("stt", 2)),
+    "llm": int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+    "tts": int(os.getenv("TTS_MAX_CONCURRENCY") or tuned_instances("tts", 2)),
+}
+
+# Limit adaptif (app/adaptive_limit.py): limit tiap tahap bergerak di antara 1
+# dan plafonnya mengikuti latensi yang teramati. ADAPTIVE_LIMITS=0 = limit tetap
+ADAPTIVE_LIMITS = os.getenv("ADAPTIVE_LIMITS", "1") == "1"
+
+
+def stage_ceiling(stage: str) -> int:
+    """
+    Plafon limit adaptif sebuah tahap; engine worker disiapkan sebanyak ini.
+    Untuk STT/TTS yang sudah di-tuning, plafon tidak melebihi jumlah core set
+    agar dua slot yang berjalan bersamaan tidak di-pin ke core yang sama.
+    """
+    limit = STAGE_LIMITS[stage]
+    if stage == "llm":
+        return int(os.getenv("LLM_CONCURRENCY_CEILING") or max(64, limit))
+    ceiling = int(os.getenv(f"{stage.upper()}_CONCURRENCY_CEILING") or 2 * limit)
+    cpusets = tuned_cpusets(stage)
+    if cpusets:
+        ceiling = min(ceiling, max(cpusets, limit))
+    return ceiling
+
+
+# Plafon limit adaptif per tahap (lihat stage_ceiling)
+STAGE_CEILINGS = {stage: stage_ceiling(stage) for stage in STAGE_LIMITS}
+
+# Target latensi per satuan kerja (0 = acuan dari latensi jangka panjang):
+# STT detik per detik audio, TTS detik per 100 karakter, LLM detik per request
+STAGE_LATENCY_TARGETS = {
+    "stt": float(os.getenv("STT_LATENCY_TARGET", "0")),
+    "llm": float(os.getenv("LLM_LATENCY_TARGET", "0")),
+    "tts": float(os.getenv("TTS_LATENCY_TARGET", "0")),
+}
+
+# Slot yang sedang dipegang task ini; ikut terbawa ke threadpool sehingga
+# engine tahu core set mana yang menjadi miliknya
+current_slot = contextvars.ContextVar("current_slot", default=None)
+
+
+class StageSlots:
+    """
+    Pool slot bernomor untuk satu tahap pipeline. Slot dilepas oleh context
+    manager, termasuk saat request dibatalkan di tengah jalan.
+
+    Jumlah slot yang boleh dipakai bersamaan (limit) diatur GradientLimit dari
+    latensi request yang selesai; nomor slot selalu yang terkecil yang bebas,
+    sehingga saat limit turun slot bernomor besar yang menganggur lebih dulu.
+    """
+
+    def __init__(self, name: str, size: int, max_size: int = None, target: float = 0.0,
+                 adaptive: bool = ADAPTIVE_LIMITS):
+        self.name = name
+        self.size = size
+        self.max_size = max(size, max_size or size) if adaptive else size
+        self.limiter = GradientLimit(size, 1, self.max_size, target) if adaptive else None
+        self.in_flight = 0
+        self._free = list(range(self.max_size))
+        self._waiters = deque()
+        metrics.set_gauge("stage_limit", self.limit, stage=name)
+
+    @property
+    def limit(self) -> int:
+        return self.limiter.value if self.limiter is not None else self.size
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def _take(self) -> int:
+        self.in_flight += 1
+        metrics.set_gauge("stage_in_flight", self.in_flight, stage=self.name)
+        return heapq.heappop(self._free)
+
+    def _grant(self):
+        # Slot langsung dipesan untuk penunggu, agar request baru tidak menyalip
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(self._take())
+
+    def _release(self, slot_id: int):
+        heapq.heappush(self._free, slot_id)
+        self.in_flight -= 1
+        metrics.set_gauge("stage_in_flight", self.in_flight, stage=self.name)
+        self._grant()
+
+    async def _wait_slot(self) -> int:
+        if not self._waiters and self.in_flight < self.limit:
+            return self._take()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            # Slot sudah dipesan tepat sebelum pembatalan: kembalikan
+            if waiter.done() and not waiter.cancelled():
+                self._release(waiter.result())
+            raise
+
+    def _observe(self, latency: float):
+        if self.limiter is None:
+            return
+        before = self.limiter.value
+        after = self.limiter.update(latency, self.in_flight)
+        if after != before:
+            metrics.set_gauge("stage_limit", after, stage=self.name)
+            metrics.inc("stage_limit_changes", stage=self.name, direction="up" if after > before else "down")
+
+    @asynccontextmanager
+    async def acquire(self, cost: float = 1.0):
+        """
+        Args:
+            cost (float): Besar kerja request ini (mis. detik audio); latensi
+                dibagi cost sebelum masuk ke limiter
+        """
+        started = time.perf_counter()
+        slot_id = await self._wait_slot()
+        metrics.observe("stage_queue_wait_seconds", time.perf_counter() - started, stage=self.name)
+        token = current_slot.set(slot_id)
+        started = time.perf_counter()
+        try:
+            yield slot_id
+            # Hanya request yang berhasil dijadikan sampel; kegagalan cepat
+            # akan terlihat seperti latensi yang bagus
+            self._observe((time.perf_counter() - started) / max(cost, 1e-3))
+        finally:
+            current_slot.reset(token)
+            self._release(slot_id)
+
+    def snapshot(self) -> dict:
+        view = {
+            "limit": self.limit,
+            "adaptive": self.limiter is not None,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+        }
+        if self.limiter is not None:
+            view.update(self.limiter.snapshot())
+        return view
+
+
+pools = {
+    name: StageSlots(name, size, STAGE_CEILINGS[name], STAGE_LATENCY_TARGETS[name])
+    for name, size in STAGE_LIMITS.items()
+}
+
+
+def acquire(stage: str, cost: float = 1.0):
+    """Ambil slot untuk tahap "stt", "llm", atau "tts"; cost = besar kerjanya."""
+    return pools[stage].acquire(cost)
+
+
+def snapshot() -> dict:
+    """Limit, beban, dan keputusan limiter terakhir per tahap."""
+    return {name: pool.snapshot() for name, pool in pools.items()}
@@ -1,8 +1,20 @@
 import os
+import re
+import json
+import time
 import uuid
+import wave
+import struct
+import threading
 import tempfile
 import subprocess
 
+from app import metrics
+from app.transcript_cache import transcript_cache, audio_fingerprint
+from app.cancellation import kill_on_cancel
+from app.autotune import engine_settings, pin_process
+from app.stage_pool import current_slot
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # path ke folder utilitas STT
@@ -14,43 +26,263 @@ WHISPER_BINARY = os.path.join(WHISPER_DIR, "build", "bin", "Release", "whisper-c
 # Path ke file model Whisper
 WHISPER_MODEL_PATH = os.path.join(WHISPER_DIR, "models", "ggml-large-v3-turbo.bin")
 
-def transcribe_speech_to_text(file_bytes: bytes, file_ext: str = ".wav") -> str:
+# Bahasa transkripsi default (Indonesia); bisa diganti per request, "auto" = deteksi otomatis
+WHISPER_LANGUAGE = "id"
+LANGUAGE_PATTERN = re.compile(r"^(auto|[a-z]{2,3})$")
+
+# Profil decoding whisper-cli: trade-off latensi vs kualitas per request.
+# "fast": greedy, tanpa timestamp, konteks audio dikurangi (segmen tidak
+# di-stream sehingga LLM spekulatif tidak jalan); "accurate" = default whisper-cli
+STT_PROFILES = {
+    "fast": ["-bs", "1", "-bo", "1", "-nt", "-ac", "768"],
+    "balanced": ["-bs", "2", "-bo", "2"],
+    "accurate": ["-bs", "5", "-bo", "5"],
+}
+STT_DEFAULT_PROFILE = os.getenv("STT_DEFAULT_PROFILE", "accurate")
+
+# Profil default per tenant (header X-Tenant-ID), misalnya {"callcenter": "fast"}
+STT_TENANT_PROFILES = json.loads(os.getenv("STT_TENANT_PROFILES", "{}") or "{}")
+
+# Format baris segmen yang dicetak whisper-cli ke stdout:
+# [00:00:00.000 --> 00:00:02.480]   teks segmen
+SEGMENT_PATTERN = re.compile(
+    r"^\[(\d+):(\d+):(\d+(?:\.\d+)?) --> (\d+):(\d+):(\d+(?:\.\d+)?)\]\s*(.*)$"
+)
+
+# Cache transkrip untuk audio yang identik (misalnya upload yang di-retry)
+STT_CACHE_ENABLED = os.getenv("STT_CACHE_ENABLED", "1") == "1"
+
+def resolve_stt_options(language: str = None, profile: str = None, tenant: str = None):
+    """
+    Tentukan bahasa dan profil decoding untuk satu request: nilai dari request,
+    lalu profil tenant, lalu default.
+    Returns:
+        tuple: (bahasa, nama profil)
+    Raises:
+        ValueError: Jika bahasa atau profil tidak dikenal
+    """
+    language = (language or WHISPER_LANGUAGE).strip().lower()
+    if not LANGUAGE_PATTERN.match(language):
+        raise ValueError(f"Bahasa tidak valid: {language}")
+    profile = profile or STT_TENANT_PROFILES.get(tenant or "") or STT_DEFAULT_PROFILE
+    if profile not in STT_PROFILES:
+        raise ValueError(f"Profil STT tidak dikenal: {profile} (pilihan: {', '.join(STT_PROFILES)})")
+    return language, profile
+
+def transcribe_speech_to_text(file_bytes: bytes, file_ext: str = ".wav", work_dir: str = None,
+                              on_segment=None, cancel_token=None, language: str = None,
+                              profile: str = None) -> str:
     """
     Transkrip file audio menggunakan whisper.cpp CLI
     Args:
         file_bytes (bytes): Isi file audio
         file_ext (str): Ekstensi file, default ".wav"
+        work_dir (str): Direktori induk untuk file kerja whisper (misalnya
+            direktori scratch request); default direktori temp sistem
+        on_segment (callable): Opsional, dipanggil on_segment(start, end, text)
+            untuk setiap segmen begitu whisper mencetaknya (dari thread pemanggil)
+        cancel_token (CancelToken): Opsional; proses whisper dimatikan saat dibatalkan
+        language (str): Kode bahasa (default WHISPER_LANGUAGE); melewati deteksi bahasa
+        profile (str): Nama profil di STT_PROFILES (default STT_DEFAULT_PROFILE)
     Returns:
         str: Teks hasil transkripsi
     """
-    with tempfile.TemporaryDirectory() as tmpdir:
+    language, profile = resolve_stt_options(language, profile)
+    fingerprint = audio_fingerprint(file_bytes, file_ext) if STT_CACHE_ENABLED else None
+    return _cached_transcription(
+        fingerprint,
+        language,
+        profile,
+        lambda: _transcribe_with_whisper(file_bytes, file_ext, work_dir, on_segment, cancel_token,
+                                         language, profile),
+    )
+
+def transcribe_audio_file(audio_path: str, fingerprint: str = None, work_dir: str = None,
+                          on_segment=None, cancel_token=None, language: str = None,
+                          profile: str = None) -> str:
+    """
+    Transkrip file audio yang sudah ada di disk, tanpa menyalin isinya lagi.
+    Args:
+        audio_path (str): Path file audio
+        fingerprint (str): Hash audio untuk transcript cache (None = tanpa cache)
+        work_dir, on_segment, cancel_token, language, profile: Sama seperti
+            transcribe_speech_to_text
+    Returns:
+        str: Teks hasil transkripsi
+    """
+    language, profile = resolve_stt_options(language, profile)
+    return _cached_transcription(
+        fingerprint,
+        language,
+        profile,
+        lambda: _run_whisper(audio_path, work_dir, on_segment, cancel_token, language, profile),
+    )
+
+def _cached_transcription(fingerprint, language: str, profile: str, transcribe) -> str:
+    if not STT_CACHE_ENABLED or fingerprint is None:
+        return transcribe()
+
+    # Audio yang byte PCM-nya identik tidak perlu di-decode whisper lagi
+    cache_key = transcript_cache.make_key(fingerprint, WHISPER_MODEL_PATH, language, profile)
+    cached = transcript_cache.get(cache_key)
+    if cached is not None:
+        log_file = os.path.join(tempfile.gettempdir(), "voice_chat_log.txt")
+        with open(log_file, "a", encoding="utf-8") as log:
+            log.write(f"STT result (cache): {cached}\n")
+        return cached
+
+    transcription = transcribe()
+    if not transcription.startswith("[ERROR]"):
+        transcript_cache.put(cache_key, transcription)
+    return transcription
+
+def parse_segment(line: str):
+    """
+    Parse satu baris segmen whisper-cli.
+    Returns:
+        tuple | None: (start_detik, end_detik, teks), atau None jika bukan baris segmen
+    """
+    match = SEGMENT_PATTERN.match(line.strip())
+    if not match:
+        return None
+    h1, m1, s1, h2, m2, s2, text = match.groups()
+    start = int(h1) * 3600 + int(m1) * 60 + float(s1)
+    end = int(h2) * 3600 + int(m2) * 60 + float(s2)
+    return start, end, text.strip()
+
+def _audio_seconds(audio_path: str):
+    """Durasi file WAV dalam detik (None untuk format lain), untuk real-time factor."""
+    try:
+        with wave.open(audio_path, "rb") as wav:
+            return wav.getnframes() / float(wav.getframerate())
+    except (wave.Error, EOFError, OSError, ZeroDivisionError):
+        return None
+
+def _transcribe_with_whisper(file_bytes: bytes, file_ext: str, work_dir: str = None,
+                             on_segment=None, cancel_token=None, language: str = WHISPER_LANGUAGE,
+                             profile: str = STT_DEFAULT_PROFILE) -> str:
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmpdir:
         audio_path = os.path.join(tmpdir, f"{uuid.uuid4()}{file_ext}")
-        result_path = os.path.join(tmpdir, "transcription.txt")
 
         # simpan audio ke file temporer
         with open(audio_path, "wb") as f:
             f.write(file_bytes)
 
+        return _run_whisper(audio_path, tmpdir, on_segment, cancel_token, language, profile)
+
+def _wav_header(nbytes: int, sample_rate: int, channels: int) -> bytes:
+    """Header WAV PCM 16-bit untuk data sepanjang nbytes (audio yang di-pipe ke stdin)."""
+    block_align = channels * 2
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + nbytes, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, 16,
+        b"data", nbytes,
+    )
+
+def _pipe_pcm(stdin, pcm, sample_rate: int, channels: int):
+    # Ditulis dari thread sendiri: whisper baru membaca stdout setelah seluruh
+    # input terbaca, jadi penulisan di thread pembaca stdout bisa deadlock
+    try:
+        data = memoryview(pcm).cast("B")
+        stdin.write(_wav_header(len(data), sample_rate, channels))
+        stdin.write(data)
+    except (BrokenPipeError, OSError):
+        pass  # proses sudah mati (dibatalkan atau gagal); returncode yang melapor
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+def _log_tail(path: str, lines: int = 20) -> str:
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return "".join(f.readlines()[-lines:])
+    except OSError:
+        return ""
+
+def _run_whisper(audio_path: str, work_dir: str = None, on_segment=None, cancel_token=None,
+                 language: str = WHISPER_LANGUAGE, profile: str = STT_DEFAULT_PROFILE,
+                 threads: int = None, cpus=None, pcm=None, sample_rate: int = 16000,
+                 channels: int = 1) -> str:
+    """
+    Jalankan whisper-cli untuk satu audio. Jika pcm (int16) diberikan, audio
+    dikirim lewat stdin (-f -) tanpa ditulis ke disk; audio_path hanya untuk log.
+    """
+    # Thread dan core set dari auto-tuning untuk slot STT yang sedang dipegang
+    if threads is None and cpus is None:
+        threads, cpus = engine_settings("stt", current_slot.get())
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmpdir:
+        result_path = os.path.join(tmpdir, "transcription.txt")
+
         # jalankan whisper.cpp dengan subprocess
-        # Penting: tambahkan parameter -l id untuk bahasa Indonesia
+        # Penting: bahasa selalu diberikan (-l) agar whisper tidak mendeteksi ulang
         cmd = [
             WHISPER_BINARY,
             "-m", WHISPER_MODEL_PATH,
-            "-f", audio_path,
-            "-l", "id",  # Menentukan bahasa Indonesia
+            "-f", "-" if pcm is not None else audio_path,
+            "-l", language,
             "-otxt",
             "-of", os.path.join(tmpdir, "transcription")
-        ]
+        ] + STT_PROFILES[profile]
+        if threads:
+            cmd += ["-t", str(threads)]
 
+        # Log per pemanggilan: potongan paralel, request bersamaan, dan probe
+        # health tidak saling menimpa atau menyisipkan output whisper
+        log_file = os.path.join(tmpdir, "whisper.log")
         try:
-            # Save the input audio file path to the log file
-            log_file = os.path.join(tempfile.gettempdir(), "voice_chat_log.txt")
             with open(log_file, "w", encoding="utf-8") as log:
                 log.write(f"Processing audio file: {audio_path}\n")
-                log.write(f"Language setting: Indonesian (-l id)\n")
-                subprocess.run(cmd, check=True, stdout=log, stderr=subprocess.STDOUT)
+                log.write(f"Language setting: -l {language}, profile: {profile}\n")
+                log.flush()
+
+                # stdout dibaca per baris agar segmen bisa diteruskan ke pemanggil
+                # saat itu juga, tidak menunggu proses whisper selesai
+                started = time.perf_counter()
+                process = subprocess.Popen(
+                    cmd,
+                    stdin=subprocess.PIPE if pcm is not None else None,
+                    stdout=subprocess.PIPE,
+                    stderr=log,
+                    text=True,
+                    encoding="utf-8",
+                    errors="replace",
+                )
+                pin_process(process, cpus)
+                kill_on_cancel(process, cancel_token)
+                if pcm is not None:
+                    threading.Thread(
+                        target=_pipe_pcm,
+                        args=(process.stdin.buffer, pcm, sample_rate, channels),
+                        name="whisper-stdin",
+                        daemon=True,
+                    ).start()
+                for line in process.stdout:
+                    log.write(line)
+                    log.flush()
+                    if on_segment is not None:
+                        segment = parse_segment(line)
+                        if segment is not None:
+                            on_segment(*segment)
+                returncode = process.wait()
+                if cancel_token is not None and cancel_token.cancelled:
+                    return "[ERROR] Whisper dibatalkan"
+                if returncode != 0:
+                    raise subprocess.CalledProcessError(returncode, cmd)
         except subprocess.CalledProcessError as e:
+            print(f"[ERROR] Whisper failed: {e}\n{_log_tail(log_file)}")
             return f"[ERROR] Whisper failed: {e}"
+
+        # Real-time factor (waktu decode / durasi audio) per profil
+        if pcm is not None:
+            seconds = len(pcm) / float(channels * sample_rate)
+        else:
+            seconds = _audio_seconds(audio_path)
+        if seconds:
+            metrics.observe("stt_real_time_factor", (time.perf_counter() - started) / seconds, profile=profile)
         
         # baca hasil transkripsi
         try:
@@ -0,0 +1,180 @@
+import io
+import os
+import json
+import glob
+import time
+import uuid
+import wave
+import queue
+import random
+import hashlib
+import zipfile
+import threading
+
+try:
+    import soundfile
+except ImportError:  # tanpa libsndfile, audio trace disimpan sebagai WAV
+    soundfile = None
+
+from app import metrics
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Perekam trafik (opt-in): sebagian request /voice-chat disimpan beserta audio,
+# transkrip, balasan LLM, dan durasi per tahap untuk diputar ulang (app/replay.py)
+TRAFFIC_RECORD = os.getenv("TRAFFIC_RECORD", "0") == "1"
+TRAFFIC_SAMPLE_RATE = float(os.getenv("TRAFFIC_SAMPLE_RATE", "0.1"))
+
+# Direktori arsip trace; satu arsip zip per proses, diganti setelah sekian trace
+TRAFFIC_DIR = os.getenv("TRAFFIC_DIR", os.path.join(BASE_DIR, "traffic"))
+TRAFFIC_ARCHIVE_MAX_TRACES = int(os.getenv("TRAFFIC_ARCHIVE_MAX_TRACES", "500"))
+
+# Trace yang belum ditulis; jika penuh (disk lambat) trace baru dibuang
+TRAFFIC_QUEUE_SIZE = int(os.getenv("TRAFFIC_QUEUE_SIZE", "64"))
+
+
+def _encode_audio(upload) -> tuple:
+    """
+    Returns:
+        tuple: (byte audio, ekstensi) - PCM sebagai FLAC (WAV tanpa soundfile),
+        format lain apa adanya
+    """
+    if upload.pcm is None:
+        return upload.raw, upload.file_ext
+    frames = upload.pcm.reshape(-1, upload.channels)
+    buf = io.BytesIO()
+    if soundfile is not None:
+        soundfile.write(buf, frames, upload.sample_rate, format="FLAC", subtype="PCM_16")
+        return buf.getvalue(), ".flac"
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(upload.channels)
+        wav.setsampwidth(2)
+        wav.setframerate(upload.sample_rate)
+        wav.writeframes(memoryview(upload.pcm).cast("B"))
+    return buf.getvalue(), ".wav"
+
+
+class TrafficRecorder:
+    """
+    Menulis trace request terpilih ke arsip zip di thread background, sehingga
+    request tidak pernah menunggu disk. Setiap trace = satu entri JSON
+    (metadata, transkrip, balasan, timing) dan satu entri audio.
+    """
+
+    def __init__(self, enabled: bool = TRAFFIC_RECORD, sample_rate: float = TRAFFIC_SAMPLE_RATE,
+                 directory: str = TRAFFIC_DIR):
+        self.enabled = enabled and sample_rate > 0
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self._queue = queue.Queue(maxsize=TRAFFIC_QUEUE_SIZE)
+        self._thread = None
+        self._archive = None
+        self._archive_count = 0
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._loop, name="traffic-recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+        self._thread = None
+
+    def sample(self) -> bool:
+        """Apakah request baru ini direkam."""
+        return self.enabled and random.random() < self.sample_rate
+
+    def record(self, upload, arrived_at: float, latency: float, status: int, session_id: str,
+               language: str, stt_profile: str, transcript: str = None, reply: str = None,
+               timings: dict = None, error: str = None):
+        """Antrekan satu trace; tidak pernah blocking."""
+        trace = {
+            "id": uuid.uuid4().hex,
+            "endpoint": "/voice-chat",
+            "arrived_at": round(arrived_at, 4),
+            # Sesi hanya perlu dikelompokkan saat replay, tidak perlu ID aslinya
+            "session": hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:12],
+            "language": language,
+            "stt_profile": stt_profile,
+            "audio_format": upload.file_ext,
+            "audio_seconds": round(upload.duration, 3) if upload.duration is not None else None,
+            "transcript": transcript,
+            "reply": reply,
+            "timings": {stage: round(seconds, 4) for stage, seconds in (timings or {}).items()},
+            "latency": round(latency, 4),
+            "status": status,
+            "error": error,
+        }
+        try:
+            self._queue.put_nowait((trace, upload))
+        except queue.Full:
+            metrics.inc("traffic_dropped")
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            trace, upload = item
+            try:
+                self._write(trace, upload)
+                metrics.inc("traffic_recorded")
+            except Exception as e:
+                print(f"[ERROR] Gagal menulis trace trafik: {e}")
+                metrics.inc("traffic_dropped")
+
+    def _write(self, trace: dict, upload):
+        if self._archive is None or self._archive_count >= TRAFFIC_ARCHIVE_MAX_TRACES:
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            self._archive = os.path.join(self.directory, f"traffic-{stamp}-{os.getpid()}.zip")
+            self._archive_count = 0
+        audio, ext = _encode_audio(upload)
+        trace["audio"] = f"{trace['id']}{ext}"
+        # Zip dibuka-tutup per trace agar arsip tetap valid jika proses mati
+        with zipfile.ZipFile(self._archive, "a", compression=zipfile.ZIP_DEFLATED) as archive:
+            # Audio FLAC sudah terkompresi
+            archive.writestr(trace["audio"], audio, compress_type=zipfile.ZIP_STORED)
+            archive.writestr(f"{trace['id']}.json", json.dumps(trace, ensure_ascii=False))
+        self._archive_count += 1
+
+
+def archive_paths(paths: list) -> list:
+    """Arsip dari daftar path (file zip atau direktori berisi arsip)."""
+    archives = []
+    for path in paths:
+        if os.path.isdir(path):
+            archives.extend(sorted(glob.glob(os.path.join(path, "traffic-*.zip"))))
+        else:
+            archives.append(path)
+    return archives
+
+
+def read_traces(paths: list) -> list:
+    """
+    Baca semua trace dari arsip, urut menurut waktu kedatangan.
+    Returns:
+        list: dict trace; "archive" menunjuk arsip asalnya (lihat read_audio)
+    """
+    traces = []
+    for path in archive_paths(paths):
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                if name.endswith(".json"):
+                    trace = json.loads(archive.read(name))
+                    trace["archive"] = path
+                    traces.append(trace)
+    traces.sort(key=lambda trace: trace["arrived_at"])
+    return traces
+
+
+def read_audio(trace: dict) -> bytes:
+    with zipfile.ZipFile(trace["archive"]) as archive:
+        return archive.read(trace["audio"])
+
+
+traffic_recorder = TrafficRecorder()
@@ -0,0 +1,153 @@
+import io
+import os
+import time
+import wave
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+from app import metrics
+
+# Batas cache di memori (jumlah entri dan total karakter transkrip)
+TRANSCRIPT_CACHE_MAX_ENTRIES = int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", "1024"))
+TRANSCRIPT_CACHE_MAX_CHARS = int(os.getenv("TRANSCRIPT_CACHE_MAX_CHARS", str(4 * 1024 * 1024)))
+
+# File SQLite untuk persistensi opsional; kosongkan untuk cache memori saja
+TRANSCRIPT_CACHE_DB = os.getenv("TRANSCRIPT_CACHE_DB", "")
+
+
+def audio_fingerprint(file_bytes: bytes, file_ext: str = ".wav") -> str:
+    """
+    Hash konten audio. Untuk WAV yang di-hash adalah PCM hasil decode beserta
+    formatnya, sehingga file yang sama dengan header/metadata berbeda tetap
+    menghasilkan kunci yang sama. Format lain di-hash apa adanya.
+    """
+    if file_ext.lower() == ".wav":
+        try:
+            with wave.open(io.BytesIO(file_bytes), "rb") as wav:
+                return pcm_fingerprint(
+                    wav.readframes(wav.getnframes()),
+                    wav.getnchannels(),
+                    wav.getsampwidth(),
+                    wav.getframerate(),
+                )
+        except (wave.Error, EOFError):
+            pass
+    digest = hashlib.sha256()
+    digest.update(b"raw:")
+    digest.update(file_bytes)
+    return digest.hexdigest()
+
+
+def pcm_fingerprint(pcm, channels: int, sample_width: int, sample_rate: int) -> str:
+    """Hash PCM mentah (bytes atau buffer numpy) beserta formatnya."""
+    digest = hashlib.sha256()
+    digest.update(f"pcm:{channels}:{sample_width}:{sample_rate}:".encode())
+    digest.update(pcm)
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    """
+    Cache LRU transkrip dengan kunci (hash audio, model, bahasa), opsional
+    dipersistenkan ke SQLite agar tetap berlaku setelah restart.
+    """
+
+    def __init__(self, max_entries=TRANSCRIPT_CACHE_MAX_ENTRIES,
+                 max_chars=TRANSCRIPT_CACHE_MAX_CHARS, db_path=TRANSCRIPT_CACHE_DB):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(fingerprint: str, model: str, language: str, profile: str = "accurate") -> str:
+        return f"{fingerprint}:{os.path.basename(model)}:{language}:{profile}"
+
+    def _db(self):
+        if not self.db_path:
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS transcripts ("
+                " key TEXT PRIMARY KEY, text TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+        if text is not None:
+            self._record(True, "memory")
+            return text
+
+        conn = self._db()
+        if conn is not None:
+            try:
+                row = conn.execute("SELECT text FROM transcripts WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f"[WARNING] Gagal membaca transcript cache: {e}")
+                row = None
+            if row:
+                self._put_memory(key, row[0])
+                self._record(True, "disk")
+                return row[0]
+
+        self._record(False, None)
+        return None
+
+    def put(self, key: str, text: str):
+        self._put_memory(key, text)
+        conn = self._db()
+        if conn is not None:
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO transcripts (key, text, created_at) VALUES (?, ?, ?)",
+                    (key, text, time.time()),
+                )
+            except sqlite3.Error as e:
+                print(f"[WARNING] Gagal menyimpan transcript cache: {e}")
+
+    def _put_memory(self, key: str, text: str):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._chars -= len(old)
+            self._entries[key] = text
+            self._chars += len(text)
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._chars > self.max_chars
+            ):
+                _, evicted = self._entries.popitem(last=False)
+                self._chars -= len(evicted)
+                metrics.inc("stt_cache_evictions")
+            metrics.set_gauge("stt_cache_entries", len(self._entries))
+
+    def _record(self, hit: bool, tier):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            total = self.hits + self.misses
+            hit_rate = self.hits / total
+        if hit:
+            metrics.inc("stt_cache_hits", tier=tier)
+        else:
+            metrics.inc("stt_cache_misses")
+        metrics.set_gauge("stt_cache_hit_rate", round(hit_rate, 4))
+
+
+transcript_cache = TranscriptCache()
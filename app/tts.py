@@ -1,7 +1,13 @@
 import os
+import re
 import uuid
 import tempfile
 import subprocess
+import numpy as np
+
+from app.cancellation import kill_on_cancel
+from app.autotune import engine_settings, pin_process
+from app.stage_pool import current_slot
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -17,26 +23,109 @@ COQUI_CONFIG_PATH = os.path.join(COQUI_DIR, "config.json")
 # Nama speaker yang digunakan
 COQUI_SPEAKER = "wibowo"
 
-def transcribe_text_to_speech(text: str) -> str:
+# Balasan dipecah per kalimat dan disintesis paralel. Potongan yang lebih
+# pendek dari TTS_MIN_SEGMENT_CHARS digabung ke tetangganya; kalimat yang lebih
+# panjang dari TTS_MAX_SEGMENT_CHARS dipecah lagi di batas frasa (koma, titik koma)
+TTS_MIN_SEGMENT_CHARS = int(os.getenv("TTS_MIN_SEGMENT_CHARS", "20"))
+TTS_MAX_SEGMENT_CHARS = int(os.getenv("TTS_MAX_SEGMENT_CHARS", "200"))
+
+# Jeda hening antar kalimat dan panjang fade di tiap sambungan (milidetik)
+TTS_SENTENCE_GAP_MS = int(os.getenv("TTS_SENTENCE_GAP_MS", "120"))
+TTS_CROSSFADE_MS = int(os.getenv("TTS_CROSSFADE_MS", "15"))
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+")
+PHRASE_BOUNDARY = re.compile(r"(?<=[,;:])\s+")
+
+def transcribe_text_to_speech(text: str, output_dir: str = None, cancel_token=None) -> str:
     """
     Fungsi untuk mengonversi teks menjadi suara menggunakan TTS engine yang ditentukan.
     Args:
         text (str): Teks yang akan diubah menjadi suara.
+        output_dir (str): Direktori output (misalnya direktori scratch request);
+            default direktori temp sistem, dan pemanggil wajib menghapus filenya.
+        cancel_token (CancelToken): Opsional; proses TTS dimatikan saat dibatalkan
     Returns:
         str: Path ke file audio hasil konversi.
     """
-    path = _tts_with_coqui(text)
-    
+    path = _tts_with_coqui(text, output_dir, cancel_token)
+    log_output_path(path)
+    return path
+
+def log_output_path(path: str):
     # Tambahkan log untuk Gradio
     log_file = os.path.join(tempfile.gettempdir(), "voice_chat_log.txt")
     with open(log_file, "a", encoding="utf-8") as log:
         log.write(f"\nTTS output path: {path}\n")
-    
-    return path
+
+def _merge_short(pieces: list) -> list:
+    merged = []
+    for piece in pieces:
+        if merged and (len(merged[-1]) < TTS_MIN_SEGMENT_CHARS or len(piece) < TTS_MIN_SEGMENT_CHARS):
+            merged[-1] = f"{merged[-1]} {piece}"
+        else:
+            merged.append(piece)
+    return merged
+
+def split_sentences(text: str) -> list:
+    """
+    Pecah teks balasan menjadi potongan untuk sintesis paralel: per kalimat,
+    lalu kalimat yang terlalu panjang dipecah di batas frasa.
+    """
+    segments = []
+    for sentence in _merge_short([s for s in SENTENCE_BOUNDARY.split(text.strip()) if s]):
+        if len(sentence) > TTS_MAX_SEGMENT_CHARS:
+            segments.extend(_merge_short([p for p in PHRASE_BOUNDARY.split(sentence) if p]))
+        else:
+            segments.append(sentence)
+    return segments or [text]
+
+def stitch_arrays(waves: list, rate: int, gap_ms: int = TTS_SENTENCE_GAP_MS,
+                  fade_ms: int = TTS_CROSSFADE_MS) -> np.ndarray:
+    """
+    Gabungkan audio per potongan (int16 atau float) menjadi satu array int16.
+    Setiap sambungan diberi fade pendek agar tidak ada klik; dengan gap_ms=0
+    potongan di-crossfade (saling tumpang tindih), selain itu dipisah hening.
+    """
+    waves = [
+        data.astype(np.float32) / np.iinfo(data.dtype).max if data.dtype.kind == "i"
+        else data.astype(np.float32)
+        for data in waves
+    ]
+
+    fade = min(int(rate * fade_ms / 1000), *(len(w) // 2 for w in waves))
+    gap = int(rate * gap_ms / 1000)
+    ramp = np.linspace(0.0, 1.0, fade, dtype=np.float32)
+    for i, data in enumerate(waves):
+        if fade and i > 0:
+            data[:fade] *= ramp
+        if fade and i < len(waves) - 1:
+            data[-fade:] *= ramp[::-1]
+
+    if gap > 0:
+        silence = np.zeros(gap, dtype=np.float32)
+        pieces = [waves[0]]
+        for data in waves[1:]:
+            pieces += [silence, data]
+        out = np.concatenate(pieces)
+    else:
+        overlap = fade
+        total = sum(len(w) for w in waves) - overlap * (len(waves) - 1)
+        out = np.zeros(total, dtype=np.float32)
+        offset = 0
+        for data in waves:
+            out[offset:offset + len(data)] += data
+            offset += len(data) - overlap
+
+    return (np.clip(out, -1.0, 1.0) * 32767).astype(np.int16)
 
 # === ENGINE 1: Coqui TTS ===
-def _tts_with_coqui(text: str) -> str:
-    tmp_dir = tempfile.gettempdir()
+def _tts_with_coqui(text: str, output_dir: str = None, cancel_token=None,
+                    threads: int = None, cpus=None) -> str:
+    # Thread dan core set dari auto-tuning untuk slot TTS yang sedang dipegang
+    if threads is None and cpus is None:
+        threads, cpus = engine_settings("tts", current_slot.get())
+
+    tmp_dir = output_dir or tempfile.gettempdir()
     output_path = os.path.join(tmp_dir, f"tts_{uuid.uuid4()}.wav")
     
     # Log untuk Gradio
@@ -57,7 +146,18 @@ def _tts_with_coqui(text: str) -> str:
     try:
         # Gunakan file log untuk mencatat output TTS
         with open(log_file, "a", encoding="utf-8") as log:
-            subprocess.run(cmd, check=True, stdout=log, stderr=subprocess.STDOUT)
+            env = None
+            if threads:
+                # Coqui (PyTorch) memakai OpenMP/MKL; batasi thread agar tidak oversubscribe
+                env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+            process = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, env=env)
+            pin_process(process, cpus)
+            kill_on_cancel(process, cancel_token)
+            returncode = process.wait()
+        if cancel_token is not None and cancel_token.cancelled:
+            return "[ERROR] TTS dibatalkan"
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd)
     except subprocess.CalledProcessError as e:
         print(f"[ERROR] TTS subprocess failed: {e}")
         return "[ERROR] Failed to synthesize speech"
@@ -1,11 +1,16 @@
+import io
 import os
+import math
+import struct
 import tempfile
-import requests
+import httpx
+import numpy as np
 import gradio as gr
 import scipy.io.wavfile
+from scipy.signal import resample_poly
 from datetime import datetime
-import json
-import time
+from urllib.parse import unquote
+import uuid
 
 # Define color scheme
 PRIMARY_COLOR = "#FF5722"  # Orange
@@ -13,269 +18,209 @@ SECONDARY_COLOR = "#2196F3"  # Blue
 BG_COLOR = "#121212"  # Dark background
 TEXT_COLOR = "#FFFFFF"  # White text
 
-# Global chat history
-chat_history_list = []
+# Alamat backend FastAPI dan batas waktu request
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "5"))
+API_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "120"))
+
+# Satu client HTTP bersama untuk semua sesi: koneksi keep-alive dipakai ulang
+# antar giliran, dengan deadline untuk connect/read/write/ambil koneksi dari pool
+http_client = httpx.Client(
+    base_url=API_URL,
+    timeout=httpx.Timeout(
+        connect=API_CONNECT_TIMEOUT,
+        read=API_READ_TIMEOUT,
+        write=30.0,
+        pool=API_CONNECT_TIMEOUT,
+    ),
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+)
+
+# Durasi potongan audio yang dikirim ke player saat streaming (detik)
+STREAM_CHUNK_SECONDS = float(os.getenv("STREAM_CHUNK_SECONDS", "0.5"))
+
+# Audio mikrofon di-downmix ke mono dan di-resample ke 16 kHz (format whisper)
+# sebelum diunggah, lalu dikodekan sebagai FLAC (lossless) atau WAV
+UPLOAD_SAMPLE_RATE = 16000
+UPLOAD_FORMAT = os.getenv("UPLOAD_FORMAT", "flac").lower()
+
+try:
+    import soundfile
+except ImportError:  # tanpa soundfile upload tetap WAV 16 kHz mono
+    soundfile = None
+
+# Jumlah pesan terakhir yang dikirim ke komponen chat. Riwayat lengkap tetap
+# ada di state sesi; pesan lama bisa dimuat lewat tombol "Show older messages"
+CHAT_WINDOW = int(os.getenv("CHAT_WINDOW", "50"))
+
+def new_session():
+    """State percakapan per sesi browser (tidak lagi dibagi ke semua pengguna)"""
+    return {"id": uuid.uuid4().hex, "messages": [], "window": CHAT_WINDOW}
+
+def make_message(role, content, timestamp):
+    """Pesan dalam format gr.Chatbot(type="messages") dengan waktu kirim"""
+    return {"role": role, "content": f"{content}\n\n<sub>{timestamp}</sub>"}
+
+def visible_messages(session):
+    """Hanya jendela pesan terakhir yang dirender di browser"""
+    return session["messages"][-session["window"]:]
+
+def append_turn(session, user_content, assistant_content):
+    """Tambahkan satu giliran ke riwayat sesi dan kembalikan jendela yang terlihat"""
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    new_messages = [
+        make_message("user", user_content, timestamp),
+        make_message("assistant", assistant_content, timestamp),
+    ]
+    session["messages"].extend(new_messages)
+
+    # Catat hanya pesan baru ke log, bukan seluruh riwayat setiap giliran
+    log_file = os.path.join(tempfile.gettempdir(), "voice_chat_log.txt")
+    with open(log_file, "a", encoding="utf-8") as log:
+        log.write(f"\nChat messages ({session['id']}): {new_messages}\n")
 
-# Helper function to transcribe audio with whisper API
-def transcribe_audio(audio_path):
-    """Try to transcribe audio using local whisper or other method"""
-    try:
-        # Use a local Speech-to-Text service or API if available
-        # This is a placeholder - implement your preferred method
-        
-        # Option 1: Send to our FastAPI endpoint
-        try:
-            with open(audio_path, "rb") as f:
-                files = {"file": ("voice.wav", f, "audio/wav")}
-                response = requests.post("http://localhost:8000/voice-chat", files=files, timeout=10)
-                
-                # Get the latest terminal output which should contain the transcription
-                terminal_output = get_terminal_output()
-                transcript = extract_transcription(terminal_output)
-                
-                if transcript:
-                    return transcript
-        except Exception as e:
-            print(f"Error using FastAPI for transcription: {str(e)}")
-            pass
-        
-        # If we get here, no transcription is available
-        return "Voice message (no transcription available)"
-    except Exception as e:
-        print(f"Transcription error: {str(e)}")
-        return "Voice message (transcription failed)"
-
-# Function to extract transcription from terminal output
-def extract_transcription(terminal_output):
-    """Extract the transcription text from terminal output"""
-    if not terminal_output:
-        return None
-    
-    # Look for "STT result:" in the output
-    lines = terminal_output.split('\n')
-    for line in lines:
-        if line.strip().startswith("STT result:"):
-            parts = line.split(":", 1)
-            if len(parts) > 1:
-                return parts[1].strip()
-    
-    return None
+    return visible_messages(session)
 
-def voice_chat(audio):
+def iter_wav_chunks(byte_iter):
+    """
+    Parse WAV yang datang bertahap dan hasilkan potongan PCM siap diputar.
+    Hanya byte yang belum diputar yang disimpan.
+    Args:
+        byte_iter: Iterator potongan byte dari respons HTTP
+    Yields:
+        tuple: (sample_rate, numpy array) per STREAM_CHUNK_SECONDS audio
+    """
+    pending = bytearray()
+    fmt = None
+    in_data = False
+
+    for chunk in byte_iter:
+        pending.extend(chunk)
+
+        # Lewati header RIFF dan chunk non-audio sampai ketemu chunk "data"
+        while not in_data:
+            if fmt is None and len(pending) >= 12:
+                if pending[:4] != b"RIFF" or pending[8:12] != b"WAVE":
+                    raise ValueError("Respons audio bukan file WAV")
+                del pending[:12]
+                fmt = {}
+            if len(pending) < 8:
+                break
+            chunk_id, chunk_size = pending[:4], struct.unpack("<I", pending[4:8])[0]
+            if chunk_id == b"data":
+                del pending[:8]
+                in_data = True
+                break
+            if len(pending) < 8 + chunk_size:
+                break
+            if chunk_id == b"fmt ":
+                audio_format, channels, sample_rate = struct.unpack("<HHI", pending[8:16])
+                bits = struct.unpack("<H", pending[22:24])[0]
+                fmt.update(format=audio_format, channels=channels, rate=sample_rate, bits=bits)
+            del pending[:8 + chunk_size + (chunk_size & 1)]
+
+        if not in_data:
+            continue
+
+        dtype = np.float32 if fmt["format"] == 3 else np.int16
+        frame_bytes = fmt["channels"] * (fmt["bits"] // 8)
+        step = int(fmt["rate"] * STREAM_CHUNK_SECONDS) * frame_bytes
+        while len(pending) >= step:
+            yield fmt["rate"], _pcm_frames(bytes(pending[:step]), dtype, fmt["channels"])
+            del pending[:step]
+
+    if in_data and pending:
+        frame_bytes = fmt["channels"] * (fmt["bits"] // 8)
+        usable = len(pending) - len(pending) % frame_bytes
+        if usable:
+            dtype = np.float32 if fmt["format"] == 3 else np.int16
+            yield fmt["rate"], _pcm_frames(bytes(pending[:usable]), dtype, fmt["channels"])
+
+def _pcm_frames(raw, dtype, channels):
+    frames = np.frombuffer(raw, dtype=dtype)
+    return frames.reshape(-1, channels) if channels > 1 else frames
+
+def prepare_upload(sr, audio_data):
+    """
+    Downmix dan resample audio mikrofon ke 16 kHz mono int16, lalu kodekan.
+    Returns:
+        tuple: (nama file, byte audio, MIME type) untuk field "file"
+    """
+    samples = np.asarray(audio_data)
+    if samples.dtype.kind == "f":
+        samples = samples.astype(np.float32)
+    elif samples.dtype == np.uint8:
+        samples = (samples.astype(np.float32) - 128) / 128
+    else:
+        samples = samples.astype(np.float32) / np.iinfo(samples.dtype).max
+    if samples.ndim > 1:
+        samples = samples.mean(axis=1)
+    if sr != UPLOAD_SAMPLE_RATE:
+        g = math.gcd(sr, UPLOAD_SAMPLE_RATE)
+        samples = resample_poly(samples, UPLOAD_SAMPLE_RATE // g, sr // g)
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+    buffer = io.BytesIO()
+    if UPLOAD_FORMAT == "flac" and soundfile is not None:
+        soundfile.write(buffer, pcm, UPLOAD_SAMPLE_RATE, format="FLAC", subtype="PCM_16")
+        return "voice.flac", buffer.getvalue(), "audio/flac"
+    scipy.io.wavfile.write(buffer, UPLOAD_SAMPLE_RATE, pcm)
+    return "voice.wav", buffer.getvalue(), "audio/wav"
+
+def voice_chat(audio, session):
     if audio is None:
-        return None, "No audio input detected. Please record audio first.", render_chat([])
+        yield None, "No audio input detected. Please record audio first.", visible_messages(session), session
+        return
     
     sr, audio_data = audio
-    
-    # Save as .wav
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmpfile:
-        scipy.io.wavfile.write(tmpfile.name, sr, audio_data)
-        audio_path = tmpfile.name
 
     try:
-        # First attempt to get terminal output before sending to voice-chat
-        # in case we need it for debugging
-        current_terminal_output = get_terminal_output()
-        
-        # Tambahkan parameter language=id pada request API
-        with open(audio_path, "rb") as f:
-            files = {"file": ("voice.wav", f, "audio/wav")}
-            data = {"language": "id"}  # Menambahkan parameter bahasa Indonesia
-            response = requests.post("http://localhost:8000/voice-chat", files=files, data=data)
-        
-        # Wait a moment for logs to be updated
-        time.sleep(1.0)
-        
-        # Get updated terminal output after API call
-        terminal_output = get_terminal_output()
-        
-        # Extract both transcription and LLM response
-        transcription = extract_transcription(terminal_output)
-        llm_response_text = extract_llm_response(terminal_output)
-        
-        # Default values if extraction fails
-        if not transcription:
-            transcription = "Pesan suara (transkrip tidak tersedia)"
-        
-        if not llm_response_text:
-            llm_response_text = "Respons suara (tidak ada teks tersedia)"
-
-        # Create timestamps
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        
-        if response.status_code == 200:
-            # Save audio response from chatbot
-            output_audio_path = os.path.join(tempfile.gettempdir(), "tts_output.wav")
-            
-            # Write response content to file
-            with open(output_audio_path, "wb") as f:
-                f.write(response.content)
-            
-            # Create messages with actual transcription and response text
-            user_message = {"role": "user", "time": timestamp, "content": transcription}
-            assistant_message = {"role": "assistant", "time": timestamp, "content": llm_response_text}
-            
-            # Add to history
-            chat_history_list.append(user_message)
-            chat_history_list.append(assistant_message)
+        # Audio dinormalisasi di sisi klien sehingga upload 3-6x lebih kecil
+        # dan backend bisa langsung memakainya tanpa resampling lagi
+        files = {"file": prepare_upload(sr, audio_data)}
+        data = {"language": "id", "session_id": session["id"]}
+        with http_client.stream("POST", "/voice-chat", files=files, data=data) as response:
+            # Transkrip dan teks balasan dikirim backend lewat header
+            transcription = unquote(response.headers.get("X-Transcript", ""))
+            llm_response_text = unquote(response.headers.get("X-Reply", ""))
             
-            # Write the complete chat history to the log file for debugging
-            log_file = os.path.join(tempfile.gettempdir(), "voice_chat_log.txt")
-            with open(log_file, "a", encoding="utf-8") as log:
-                log.write(f"\nChat history: {chat_history_list}\n")
-            
-            # Render HTML for chat history
-            chat_html = render_chat([])
-            
-            # Return audio path, status message, and chat HTML
-            return output_audio_path, "✅ Response received successfully", chat_html
-        else:
-            try:
-                error_message = response.json().get("error", "Unknown error")
-            except:
-                error_message = f"Error: {response.status_code} - {response.text[:100]}"
+            # Default values if the headers are missing
+            if not transcription:
+                transcription = "Pesan suara (transkrip tidak tersedia)"
             
-            # Add error message to history
-            user_message = {"role": "user", "time": timestamp, "content": transcription}
-            error_message = {"role": "assistant", "time": timestamp, "content": f"❌ Error: {error_message}"}
-            chat_history_list.append(user_message)
-            chat_history_list.append(error_message)
-            
-            chat_html = render_chat([])
-            return None, f"❌ Server error: {error_message}", chat_html
-    except Exception as e:
-        # Add error message to history
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        user_message = {"role": "user", "time": timestamp, "content": transcription if 'transcription' in locals() else "Pesan suara dikirim (error koneksi)"}
-        error_message = {"role": "assistant", "time": timestamp, "content": f"❌ Error: {str(e)}"}
-        chat_history_list.append(user_message)
-        chat_history_list.append(error_message)
-        
-        chat_html = render_chat([])
-        return None, f"❌ Error connecting to server: {str(e)}", chat_html
-    finally:
-        # Clean up the temporary file
-        if os.path.exists(audio_path):
-            os.unlink(audio_path)
-
-# Function to extract LLM response from terminal output
-def extract_llm_response(terminal_output):
-    """Extract the LLM response text from terminal output"""
-    if not terminal_output:
-        return None
-    
-    # Look for "LLM Response:" or "LLM response:" in the output
-    lines = terminal_output.split('\n')
-    for line in lines:
-        if line.strip().startswith("LLM Response:") or line.strip().startswith("LLM response:"):
-            parts = line.split(":", 1)
-            if len(parts) > 1:
-                return parts[1].strip()
-    
-    return None
+            if not llm_response_text:
+                llm_response_text = "Respons suara (tidak ada teks tersedia)"
+
+            if response.status_code != 200:
+                response.read()
+                try:
+                    error_message = response.json().get("error", "Unknown error")
+                except:
+                    error_message = f"Error: {response.status_code} - {response.text[:100]}"
+                
+                messages = append_turn(session, transcription, f"❌ Error: {error_message}")
+                yield None, f"❌ Server error: {error_message}", messages, session
+                return
 
-# Mock function to represent how you might capture terminal output
-def get_terminal_output():
-    """Get terminal output from a file or other source"""
-    log_file = os.path.join(tempfile.gettempdir(), "voice_chat_log.txt")
-    
-    if os.path.exists(log_file):
-        try:
-            with open(log_file, "r", encoding="utf-8") as f:
-                return f.read()
-        except:
-            pass
-    
-    return ""
+            # Tampilkan teks dulu, lalu putar audio sambil potongannya datang
+            messages = append_turn(session, transcription, llm_response_text)
+            for sample_rate, pcm in iter_wav_chunks(response.iter_bytes()):
+                yield (sample_rate, pcm), "🔊 Playing response...", messages, session
 
-# Chat message display
-def render_chat(messages=None):
-    """
-    Renders chat history as HTML with modern bubble design
-    """
-    if not chat_history_list:
-        return """
-        <div class="empty-chat">
-            <div class="empty-chat-icon">
-                <svg class="wave-icon" viewBox="0 0 24 24" width="100" height="100">
-                    <path d="M12,1A11,11,0,1,0,23,12,11,11,0,0,0,12,1Zm0,20a9,9,0,1,1,9-9A9,9,0,0,1,12,21Z" opacity="0.25"></path>
-                    <path d="M12,6a1,1,0,0,0-1,1v8a1,1,0,0,0,2,0V7A1,1,0,0,0,12,6Z"></path>
-                    <path d="M12,17a1,1,0,1,0,1,1A1,1,0,0,0,12,17Z"></path>
-                </svg>
-            </div>
-            <p>No messages yet. Start a voice conversation!</p>
-        </div>
-        """
-    
-    try:
-        # Generate HTML for all messages in history
-        html = "<div class='chat-container'>"
-        
-        for msg in chat_history_list:
-            # Check if msg is a dictionary with the expected keys
-            if not isinstance(msg, dict) or not all(k in msg for k in ["role", "time", "content"]):
-                continue
-                
-            role = msg["role"]
-            time = msg["time"]
-            content = msg["content"]
-            
-            if role == "user":
-                html += f"""
-                <div class='chat-message user-message'>
-                    <div class='message-content'>
-                        <div class='message-header'>
-                            <span class='user-avatar'>
-                                <svg viewBox="0 0 24 24" width="24" height="24">
-                                    <circle cx="12" cy="7" r="5" fill="#FF5722"></circle>
-                                    <path d="M21,24V17c0-3.87-3.13-7-7-7H10c-3.87,0-7,3.13-7,7v7" fill="#FF5722"></path>
-                                </svg>
-                            </span>
-                            <span class='message-sender'>You</span>
-                            <span class='message-time'>{time}</span>
-                        </div>
-                        <div class='message-text'>{content}</div>
-                    </div>
-                </div>
-                """
-            else:
-                html += f"""
-                <div class='chat-message assistant-message'>
-                    <div class='message-content'>
-                        <div class='message-header'>
-                            <span class='assistant-avatar'>
-                                <svg viewBox="0 0 24 24" width="24" height="24">
-                                    <circle cx="12" cy="12" r="10" fill="#2196F3"></circle>
-                                    <path d="M8,12 L11,15 L16,9" stroke="white" stroke-width="2" fill="none"></path>
-                                </svg>
-                            </span>
-                            <span class='message-sender'>Assistant</span>
-                            <span class='message-time'>{time}</span>
-                        </div>
-                        <div class='message-text'>{content}</div>
-                    </div>
-                </div>
-                """
-        
-        html += "</div>"
-        return html
+        yield gr.skip(), "✅ Response received successfully", messages, session
     except Exception as e:
-        return f"""
-        <div class="error-message">
-            <svg viewBox="0 0 24 24" width="24" height="24">
-                <circle cx="12" cy="12" r="10" fill="#f44336"></circle>
-                <path d="M12,6 L12,14" stroke="white" stroke-width="2"></path>
-                <circle cx="12" cy="18" r="1" fill="white"></circle>
-            </svg>
-            Error displaying chat: {str(e)}
-        </div>
-        """
+        user_content = transcription if 'transcription' in locals() else "Pesan suara dikirim (error koneksi)"
+        messages = append_turn(session, user_content, f"❌ Error: {str(e)}")
+        yield None, f"❌ Error connecting to server: {str(e)}", messages, session
+
+def show_older(session):
+    """Perluas jendela pesan yang terlihat dengan CHAT_WINDOW pesan lagi"""
+    session["window"] = min(len(session["messages"]), session["window"]) + CHAT_WINDOW
+    return visible_messages(session), session
 
 def clear_history():
-    """Clear chat history and reset UI"""
-    global chat_history_list
-    chat_history_list = []
-    return None, "Cleared. Ready for new message.", render_chat([])
+    """Clear chat history and reset UI (sesi baru juga berarti riwayat baru di server)"""
+    return None, "Cleared. Ready for new message.", [], new_session()
 
 # Custom CSS for styling with animations
 custom_css = """
@@ -470,35 +415,18 @@ body {
     }
 }
 
-/* Chat container */
-.chat-container {
-    display: flex;
-    flex-direction: column;
-    gap: 15px;
-    max-height: 500px;
-    overflow-y: auto;
-    padding-right: 10px;
-    scrollbar-width: thin;
-    scrollbar-color: #FF5722 #1E1E1E;
-}
-
-.chat-container::-webkit-scrollbar {
-    width: 6px;
-}
-
-.chat-container::-webkit-scrollbar-track {
-    background: #1E1E1E;
+/* Chat history (gr.Chatbot) */
+#chat-history .message.user {
+    background-color: #FF5722;
+    border-radius: 18px 18px 0 18px;
 }
 
-.chat-container::-webkit-scrollbar-thumb {
-    background-color: #FF5722;
-    border-radius: 20px;
+#chat-history .message.bot {
+    background-color: #2196F3;
+    border-radius: 18px 18px 18px 0;
 }
 
-/* Message bubbles */
-.chat-message {
-    display: flex;
-    margin-bottom: 15px;
+#chat-history .message-row {
     animation: fadeIn 0.3s ease-in-out;
 }
 
@@ -513,88 +441,6 @@ body {
     }
 }
 
-.user-message {
-    justify-content: flex-end;
-}
-
-.assistant-message {
-    justify-content: flex-start;
-}
-
-.message-content {
-    max-width: 80%;
-    border-radius: 18px;
-    padding: 12px 16px;
-    box-shadow: 0 2px 10px rgba(0, 0, 0, 0.1);
-}
-
-.user-message .message-content {
-    background-color: #FF5722;
-    border-radius: 18px 18px 0 18px;
-}
-
-.assistant-message .message-content {
-    background-color: #2196F3;
-    border-radius: 18px 18px 18px 0;
-}
-
-.message-header {
-    display: flex;
-    align-items: center;
-    margin-bottom: 6px;
-}
-
-.user-avatar, .assistant-avatar {
-    display: inline-flex;
-    align-items: center;
-    justify-content: center;
-    width: 24px;
-    height: 24px;
-    margin-right: 8px;
-}
-
-.message-sender {
-    font-weight: 600;
-    margin-right: 8px;
-}
-
-.message-time {
-    font-size: 12px;
-    opacity: 0.7;
-    margin-left: auto;
-}
-
-.message-text {
-    line-height: 1.4;
-}
-
-/* Empty chat state */
-.empty-chat {
-    display: flex;
-    flex-direction: column;
-    align-items: center;
-    justify-content: center;
-    padding: 40px 0;
-    color: rgba(255, 255, 255, 0.6);
-    text-align: center;
-}
-
-.empty-chat-icon {
-    margin-bottom: 20px;
-    opacity: 0.6;
-}
-
-/* Error message */
-.error-message {
-    background-color: rgba(244, 67, 54, 0.1);
-    border-left: 3px solid #f44336;
-    padding: 10px 15px;
-    border-radius: 5px;
-    display: flex;
-    align-items: center;
-    gap: 10px;
-}
-
 /* Response animation */
 .response-animation {
     display: flex;
@@ -634,15 +480,15 @@ body {
     .main-header {
         padding: 15px;
     }
-    
-    .message-content {
-        max-width: 90%;
-    }
 }
 """
 
+# Gradio menyalin setiap file audio output ke cache-nya sendiri; hapus salinan
+# yang lebih tua dari GRADIO_CACHE_MAX_AGE detik agar disk tidak terus bertambah
+GRADIO_CACHE_MAX_AGE = int(os.getenv("GRADIO_CACHE_MAX_AGE", "3600"))
+
 # Gradio UI
-with gr.Blocks(css=custom_css) as demo:
+with gr.Blocks(css=custom_css, delete_cache=(GRADIO_CACHE_MAX_AGE, GRADIO_CACHE_MAX_AGE)) as demo:
     # Header with animated icon
     with gr.Row(elem_classes="main-header"):
         gr.HTML("""
@@ -702,8 +548,10 @@ with gr.Blocks(css=custom_css) as demo:
             """)
             
             audio_output = gr.Audio(
-                type="filepath", 
+                type="numpy",
                 label="Assistant Reply",
+                streaming=True,
+                autoplay=True,
                 show_download_button=True
             )
             message_output = gr.HTML("""
@@ -727,7 +575,7 @@ with gr.Blocks(css=custom_css) as demo:
             """)
     
     # Chat history in a modern messaging format
-    with gr.Row(elem_classes="panel"):
+    with gr.Column(elem_classes="panel"):
         gr.HTML("""
         <h3>
             <span class="mic-icon">
@@ -741,19 +589,35 @@ with gr.Blocks(css=custom_css) as demo:
         </h3>
         """)
         
-        chat_history = gr.HTML(render_chat([]))
+        chat_history = gr.Chatbot(
+            type="messages",
+            elem_id="chat-history",
+            show_label=False,
+            height=500,
+            placeholder="No messages yet. Start a voice conversation!",
+        )
+        show_older_btn = gr.Button("⬆️ Show older messages", variant="secondary", size="sm")
+    
+    # State percakapan per sesi browser
+    session_state = gr.State(new_session)
     
     # Event handlers
     submit_btn.click(
         fn=voice_chat,
-        inputs=audio_input,
-        outputs=[audio_output, message_output, chat_history]
+        inputs=[audio_input, session_state],
+        outputs=[audio_output, message_output, chat_history, session_state]
     )
     
     clear_btn.click(
         fn=clear_history,
         inputs=None,
-        outputs=[audio_output, message_output, chat_history]
+        outputs=[audio_output, message_output, chat_history, session_state]
+    )
+    
+    show_older_btn.click(
+        fn=show_older,
+        inputs=session_state,
+        outputs=[chat_history, session_state]
     )
     
     # Update recording status with animated indicator
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Database dan file kerja test dipisah dari milik aplikasi; harus diset
+# sebelum modul app diimpor karena konfigurasi dibaca saat import
+_tmp = tempfile.mkdtemp(prefix="voice_chat_tests_")
+os.environ.setdefault("SESSION_DB_PATH", os.path.join(_tmp, "sessions.db"))
+os.environ.setdefault("JOBS_DB_PATH", os.path.join(_tmp, "jobs.db"))
+os.environ.setdefault("JOBS_DIR", os.path.join(_tmp, "jobs"))
+os.environ.setdefault("JOB_CONCURRENCY", "0")
+os.environ.setdefault("SCRATCH_DIR", os.path.join(_tmp, "scratch"))
+os.environ.setdefault("PROFILE_DIR", os.path.join(_tmp, "profiles"))
+os.environ.setdefault("PROFILE_SYNC_INTERVAL", "0.1")
@@ -0,0 +1,24 @@
+import pytest
+
+from app.adaptive_limit import GradientLimit
+
+
+@pytest.mark.parametrize("initial", [2, 4, 16])
+def test_persistent_latency_inflation_drives_limit_to_min(initial):
+    limit = GradientLimit(initial, min_limit=1, max_limit=32)
+    for _ in range(20):
+        limit.update(1.0, in_flight=0)
+    start = limit.value
+    seen = []
+    # Latensi 10x acuan dengan antrean penuh: limit tidak boleh naik sedikit pun
+    for _ in range(60):
+        seen.append(limit.update(10.0, in_flight=8))
+    assert max(seen) <= start
+    assert limit.value == 1
+
+
+def test_limit_grows_while_latency_stays_at_baseline():
+    limit = GradientLimit(2, min_limit=1, max_limit=32)
+    for _ in range(30):
+        limit.update(1.0, in_flight=limit.value)
+    assert limit.value > 2
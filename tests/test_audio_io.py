@@ -0,0 +1,46 @@
+import io
+import wave
+import struct
+import asyncio
+
+import numpy as np
+import pytest
+
+from app.audio_io import read_upload, UploadRejected
+
+
+class FakeUpload:
+    def __init__(self, data: bytes, filename: str = "audio.wav"):
+        self.filename = filename
+        self._buf = io.BytesIO(data)
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._buf.read(size)
+
+
+def _wav_header(rate: int, channels: int, data_size: int = 0) -> bytes:
+    block_align = channels * 2
+    return (
+        b"RIFF" + struct.pack("<I", 36 + data_size) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, rate, (rate * block_align) & 0xFFFFFFFF, block_align, 16)
+        + b"data" + struct.pack("<I", data_size)
+    )
+
+
+@pytest.mark.parametrize("rate, channels", [(2 ** 31, 1), (200000, 1), (4000, 1), (16000, 8), (16000, 0)])
+def test_out_of_range_wav_header_is_rejected(rate, channels):
+    with pytest.raises(UploadRejected) as excinfo:
+        asyncio.run(read_upload(FakeUpload(_wav_header(rate, channels))))
+    assert excinfo.value.status_code == 415
+
+
+def test_buffer_is_capped_by_max_bytes():
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(np.zeros(1600, dtype=np.int16).tobytes())
+    audio = asyncio.run(read_upload(FakeUpload(buf.getvalue()), max_bytes=64 * 1024))
+    assert audio.pcm.base is not None and audio.pcm.base.nbytes <= 64 * 1024
+    assert len(audio.pcm) == 1600
@@ -0,0 +1,39 @@
+from app import autotune
+from app.process_lock import ProcessLock
+
+
+def test_startup_tuning_runs_in_one_process_and_others_reload(monkeypatch, tmp_path):
+    lock_path = str(tmp_path / "engine_tuning.json.lock")
+    tuned = {"stt": {"threads": 4, "instances": 1, "cpusets": [[0, 1, 2, 3]]}}
+    calls = {"run": 0, "load": 0}
+    results = []
+
+    def fake_load():
+        calls["load"] += 1
+        return results[-1] if results else None
+
+    def fake_run(stages=autotune.STAGES):
+        calls["run"] += 1
+
+    monkeypatch.setattr(autotune, "AUTOTUNE_ON_STARTUP", True)
+    monkeypatch.setattr(autotune, "AUTOTUNE_LOCK_PATH", lock_path)
+    monkeypatch.setattr(autotune, "_tuning", None)
+    monkeypatch.setattr(autotune, "load_tuning", fake_load)
+    monkeypatch.setattr(autotune, "run_autotune", fake_run)
+
+    # Worker lain sedang tuning: proses ini hanya menunggu lalu memuat hasilnya
+    owner = ProcessLock(lock_path)
+    assert owner.acquire(blocking=False)
+    waiter = autotune.start_background_autotune()
+    waiter.join(0.3)
+    assert waiter.is_alive() and calls["run"] == 0
+    results.append(tuned)
+    owner.release()
+    waiter.join(5)
+    assert not waiter.is_alive()
+    assert calls == {"run": 0, "load": 1}
+
+    # Tanpa hasil dari proses lain, pemegang lock yang melakukan tuning
+    results.clear()
+    autotune.start_background_autotune().join(5)
+    assert calls["run"] == 1
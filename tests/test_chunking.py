@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from app import chunking
+from app.chunking import merge_transcripts, plan_windows
+
+SAMPLE_RATE = 16000
+
+
+@pytest.mark.parametrize("texts, expected", [
+    (["kami pergi ke pasar pagi", "ke pasar pagi ini juga"], "kami pergi ke pasar pagi ini juga"),
+    # Kata terakhir kiri dan pertama kanan terpotong di tepi potongan
+    (["kami pergi ke pasar pa", "gi ke pasar pagi ini"], "kami pergi ke pasar pagi ini"),
+    (["Halo, apa kabar?", "kabar baik saja"], "Halo, apa kabar? baik saja"),
+    (["satu dua tiga", "empat lima enam"], "satu dua tiga empat lima enam"),
+    # Satu kata yang sama di tengah bukan bukti overlap
+    (["saya bilang ya lalu pergi", "pulang ya nanti"], "saya bilang ya lalu pergi pulang ya nanti"),
+])
+def test_merge_drops_overlap_once(texts, expected):
+    assert merge_transcripts(texts) == expected
+
+
+@pytest.mark.parametrize("texts, expected", [
+    (["ya ya ya ya", "ya ya tidak"], "ya ya ya ya tidak"),
+    (["dia bilang ya ya ya ya", "ya ya tidak mau"], "dia bilang ya ya ya ya tidak mau"),
+    (["oke oke oke", "oke oke oke lalu"], "oke oke oke lalu"),
+])
+def test_merge_keeps_repeated_words(texts, expected):
+    assert merge_transcripts(texts) == expected
+
+
+def _noise(seconds: float, silences: list) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    pcm = rng.integers(-8000, 8000, int(seconds * SAMPLE_RATE), dtype=np.int16)
+    for start, end in silences:
+        pcm[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)] = 0
+    return pcm
+
+
+def test_short_audio_is_not_split():
+    pcm = _noise(30, [])
+    assert plan_windows(pcm, SAMPLE_RATE, 1, workers=4) == [(0, len(pcm))]
+    pcm = _noise(120, [])
+    assert plan_windows(pcm, SAMPLE_RATE, 1, workers=1) == [(0, len(pcm))]
+
+
+def test_cuts_land_in_silence_with_overlap(monkeypatch):
+    monkeypatch.setattr(chunking, "STT_CHUNK_OVERLAP_SECONDS", 1.0)
+    # Target potong 45 detik; hening terdekat 3 detik kemudian
+    pcm = _noise(90, [(47.8, 48.4)])
+    windows = plan_windows(pcm, SAMPLE_RATE, 1, workers=2)
+    assert len(windows) == 2
+    (first_start, first_end), (second_start, second_end) = windows
+    overlap = SAMPLE_RATE
+    cut = first_end - overlap
+    assert 47.8 * SAMPLE_RATE <= cut <= 48.4 * SAMPLE_RATE
+    assert second_start == cut - overlap
+    assert first_start == 0 and second_end == len(pcm)
+
+
+def test_stereo_cuts_use_frame_positions():
+    mono = _noise(90, [(44.0, 44.5)])
+    stereo = np.repeat(mono, 2)
+    windows = plan_windows(stereo, SAMPLE_RATE, 2, workers=2)
+    assert windows == plan_windows(mono, SAMPLE_RATE, 1, workers=2)
+    assert windows[-1][1] == len(mono)
@@ -0,0 +1,49 @@
+import asyncio
+
+from app import health, stage_pool
+from app.stage_pool import StageSlots
+
+
+def test_only_one_process_runs_probes(tmp_path):
+    calls = []
+
+    def probe():
+        calls.append(1)
+        return True, "ok"
+
+    paths = {"lock_path": str(tmp_path / "probe.lock"), "results_path": str(tmp_path / "probe.json")}
+    # Lock file per proses: dua monitor di sini berperilaku seperti dua worker
+    owner = health.HealthMonitor({"stt_binary": probe}, **paths)
+    follower = health.HealthMonitor({"stt_binary": probe}, **paths)
+    try:
+        owner.tick()
+        follower.tick()
+        assert len(calls) == 1
+        assert follower.snapshot()["components"]["stt_binary"]["status"] == "ok"
+    finally:
+        owner.stop()
+        follower.stop()
+
+
+def test_model_probe_waits_for_stage_slot(monkeypatch, tmp_path):
+    monkeypatch.setitem(stage_pool.pools, "stt", StageSlots("stt", 1, adaptive=False))
+    slots = []
+
+    def probe():
+        slots.append(stage_pool.current_slot.get())
+        return True, "ok"
+
+    monitor = health.HealthMonitor({"stt_transcribe": probe}, lock_path=str(tmp_path / "probe.lock"),
+                                   results_path=str(tmp_path / "probe.json"))
+
+    async def scenario():
+        monitor._event_loop = asyncio.get_running_loop()
+        async with stage_pool.acquire("stt"):
+            probing = asyncio.get_running_loop().run_in_executor(None, monitor.run_once)
+            await asyncio.sleep(0.2)
+            # Slot satu-satunya sedang dipakai trafik: probe harus menunggu
+            assert slots == []
+        await probing
+        assert slots == [0]
+
+    asyncio.run(scenario())
@@ -0,0 +1,28 @@
+import io
+import wave
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from app.main import app
+
+
+def _wav(seconds: float) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(np.zeros(int(seconds * 16000), dtype=np.int16).tobytes())
+    return buf.getvalue()
+
+
+def test_jobs_accept_recordings_longer_than_sync_limit():
+    client = TestClient(app)
+    # 1000 detik = 32 MB: melewati batas durasi dan ukuran body endpoint sinkron
+    audio = _wav(1000)
+    response = client.post("/stt", files={"file": ("long.wav", audio, "audio/wav")})
+    assert response.status_code == 413
+
+    response = client.post("/jobs", files={"file": ("long.wav", audio, "audio/wav")})
+    assert response.status_code == 202, response.text
@@ -0,0 +1,161 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+from google.genai import types
+from google.genai import errors as genai_errors
+
+from app import llm
+from app.llm_cache import ContextCache
+
+
+class FakeCaches:
+    """Stub API cached content Gemini."""
+
+    def __init__(self, ttl: int = 3600):
+        self.ttl = ttl
+        self.created = []
+        self.updated = []
+        self.deleted = []
+
+    def _cached(self, name):
+        expire = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.ttl)
+        return SimpleNamespace(name=name, expire_time=expire)
+
+    async def create(self, model, config):
+        name = f"cachedContents/{len(self.created)}"
+        self.created.append((name, config))
+        return self._cached(name)
+
+    async def update(self, name, config):
+        self.updated.append(name)
+        return self._cached(name)
+
+    async def delete(self, name):
+        self.deleted.append(name)
+
+
+class FakeChat:
+    def __init__(self, client, config, history):
+        self.client = client
+        self.config = config
+        self.history = list(history)
+
+    async def send_message(self, prompt):
+        if self.config.cached_content in self.client.rejected:
+            raise genai_errors.ClientError(404, {"error": {"code": 404, "message": "gone"}})
+        self.history += [_content("user", prompt), _content("model", "jawaban")]
+        return SimpleNamespace(text=" jawaban ", usage_metadata=None)
+
+    def get_history(self):
+        return self.history
+
+
+class FakeClient:
+    def __init__(self):
+        self.rejected = set()
+        self.chats_created = []
+        self.aio = SimpleNamespace(caches=FakeCaches(), chats=SimpleNamespace(create=self._create_chat))
+
+    def _create_chat(self, model, config, history):
+        chat = FakeChat(self, config, history)
+        self.chats_created.append(chat)
+        return chat
+
+
+def _content(role, text):
+    return types.Content(role=role, parts=[types.Part(text=text)])
+
+
+def _history(turns: int) -> list:
+    history = []
+    for i in range(turns):
+        history += [_content("user", f"pertanyaan {i} " * 50), _content("model", f"jawaban {i} " * 50)]
+    return history
+
+
+def _cache(client, **kwargs):
+    kwargs.setdefault("min_tokens", 100)
+    return ContextCache(client, "model", "prompt sistem", enabled=True, **kwargs)
+
+
+def test_creates_then_reuses_handle():
+    client = FakeClient()
+    cache = _cache(client)
+    history = _history(12)
+
+    config, recent, prefix = asyncio.run(cache.resolve_async("a", history))
+    assert config.cached_content == "cachedContents/0"
+    assert prefix == history[:16] and recent == history[16:]
+
+    config, _, _ = asyncio.run(cache.resolve_async("a", history))
+    assert config.cached_content == "cachedContents/0"
+    assert len(client.aio.caches.created) == 1
+
+
+def test_refreshes_handle_near_ttl():
+    client = FakeClient()
+    cache = _cache(client, refresh_margin=300)
+    history = _history(12)
+    asyncio.run(cache.resolve_async("a", history))
+    for entry in cache._entries.values():
+        entry["expires_at"] -= 3500
+
+    config, _, _ = asyncio.run(cache.resolve_async("a", history))
+    assert client.aio.caches.updated == ["cachedContents/0"]
+    assert config.cached_content == "cachedContents/0"
+    assert len(client.aio.caches.created) == 1
+
+
+def test_small_prefix_is_sent_without_cache():
+    client = FakeClient()
+    cache = _cache(client, min_tokens=10 ** 9)
+    history = _history(12)
+
+    config, recent, prefix = asyncio.run(cache.resolve_async("a", history))
+    assert config.cached_content is None and config.system_instruction == "prompt sistem"
+    assert recent == history and prefix == []
+    assert client.aio.caches.created == []
+
+
+def test_old_handle_deleted_only_when_no_session_uses_it():
+    client = FakeClient()
+    cache = _cache(client)
+
+    async def scenario():
+        # Dua sesi dengan prefix identik berbagi satu handle
+        await cache.resolve_async("a", _history(12))
+        await cache.resolve_async("b", _history(12))
+        assert len(client.aio.caches.created) == 1
+
+        # Batas prefix sesi a maju: handle lama masih dipakai b
+        await cache.resolve_async("a", _history(20))
+        await asyncio.gather(*cache._pending_deletes)
+        assert client.aio.caches.deleted == []
+
+        await cache.resolve_async("b", _history(20))
+        await asyncio.gather(*cache._pending_deletes)
+        assert client.aio.caches.deleted == ["cachedContents/0"]
+        assert not cache._pending_deletes
+
+    asyncio.run(scenario())
+
+
+def test_draft_falls_back_to_full_history_on_stale_handle(monkeypatch):
+    client = FakeClient()
+    cache = _cache(client)
+    history = _history(12)
+    monkeypatch.setattr(llm, "client", client)
+    monkeypatch.setattr(llm, "context_cache", cache)
+    monkeypatch.setattr(llm, "_load_history_contents", lambda session_id: list(history))
+
+    # Handle sudah dihapus di server: request kedua ditolak 4xx lalu diulang tanpa cache
+    asyncio.run(llm.draft_response_async("halo", "a"))
+    client.rejected.add("cachedContents/0")
+    reply, chat = asyncio.run(llm.draft_response_async("halo lagi", "a"))
+
+    assert reply == "jawaban"
+    retry = client.chats_created[-1]
+    assert retry.config.cached_content is None
+    assert chat.prefix == [] and chat.get_history()[:len(history)] == history
+    assert "a" not in cache._by_session
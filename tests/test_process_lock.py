@@ -0,0 +1,30 @@
+import multiprocessing
+
+from app.process_lock import ProcessLock, is_locked
+
+
+def _hold(path, ready, done):
+    lock = ProcessLock(path)
+    lock.acquire()
+    ready.set()
+    done.wait(10)
+
+
+def test_lock_is_exclusive_across_processes_and_freed_on_exit(tmp_path):
+    path = str(tmp_path / "owner.lock")
+    ctx = multiprocessing.get_context("spawn")
+    ready, done = ctx.Event(), ctx.Event()
+    holder = ctx.Process(target=_hold, args=(path, ready, done))
+    holder.start()
+    assert ready.wait(10)
+
+    assert is_locked(path)
+    assert not ProcessLock(path).acquire(blocking=False)
+
+    # Proses pemegang berhenti tanpa release: lock ikut lepas
+    done.set()
+    holder.join(10)
+    lock = ProcessLock(path)
+    assert lock.acquire(blocking=False)
+    lock.release()
+    assert not is_locked(path)
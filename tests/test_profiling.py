@@ -0,0 +1,109 @@
+import time
+import asyncio
+import threading
+import multiprocessing
+
+from fastapi.testclient import TestClient
+
+from app import profiling
+from app.main import app
+
+TOKEN = {"X-Admin-Token": "secret"}
+
+
+def _busy_worker_loop():
+    return sum(range(10000))
+
+
+def _spin(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+def _request_thread_work():
+    _spin(0.3)
+
+
+def _request_loop_work():
+    _spin(0.3)
+
+
+def _idle_pool_thread(done):
+    done.wait(10)
+
+
+def _unprofiled_thread_work(done):
+    while not done.is_set():
+        _spin(0.01)
+
+
+def _other_worker(ready, done):
+    # Worker uvicorn lain: hanya mengikuti file kontrol di PROFILE_DIR
+    profiling.controller.start()
+    ready.set()
+    while not done.is_set():
+        _busy_worker_loop()
+    profiling.controller.stop()
+
+
+def test_admin_endpoints_require_a_configured_token(monkeypatch):
+    client = TestClient(app)
+    monkeypatch.setattr(profiling, "PROFILING_ADMIN_TOKEN", "")
+    assert client.get("/admin/limits", headers=TOKEN).status_code == 503
+
+    monkeypatch.setattr(profiling, "PROFILING_ADMIN_TOKEN", "secret")
+    assert client.get("/admin/limits").status_code == 403
+    assert client.get("/admin/limits", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/limits", headers=TOKEN).status_code == 200
+
+
+def test_profiling_covers_every_worker(monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING_ADMIN_TOKEN", "secret")
+    client = TestClient(app)
+    ctx = multiprocessing.get_context("spawn")
+    ready, done = ctx.Event(), ctx.Event()
+    worker = ctx.Process(target=_other_worker, args=(ready, done))
+    worker.start()
+    try:
+        assert ready.wait(10)
+        response = client.post("/admin/profile/start", params={"seconds": 1}, headers=TOKEN)
+        assert response.status_code == 200
+        time.sleep(0.5)
+        assert client.post("/admin/profile/stop", headers=TOKEN).json()["samples"] > 0
+        collapsed = client.get("/admin/profile/collapsed", headers=TOKEN).text
+        assert "_busy_worker_loop" in collapsed
+
+        assert client.post("/admin/tracemalloc/start", headers=TOKEN).status_code == 200
+        snapshot = client.get("/admin/tracemalloc/snapshot", headers=TOKEN).text
+        assert f"# worker pid={worker.pid}" in snapshot
+        assert client.post("/admin/tracemalloc/stop", headers=TOKEN).status_code == 200
+    finally:
+        done.set()
+        worker.join(10)
+
+
+def test_request_profiling_samples_only_threads_of_profiled_requests(monkeypatch):
+    async def handler(scope, receive, send):
+        await asyncio.ensure_future(asyncio.sleep(0, _request_loop_work()))
+        await profiling.run_in_threadpool(_request_thread_work)
+
+    monkeypatch.setattr(profiling.sampler, "request_fraction", 1.0)
+    profiling.sampler.samples.clear()
+    done = threading.Event()
+    # Thread lain di proses yang sama: satu menganggur, satu sibuk di luar request
+    others = [threading.Thread(target=target, args=(done,))
+              for target in (_idle_pool_thread, _unprofiled_thread_work)]
+    for thread in others:
+        thread.start()
+    try:
+        asyncio.run(profiling.ProfilingMiddleware(handler)({"type": "http"}, None, None))
+    finally:
+        done.set()
+        for thread in others:
+            thread.join(10)
+
+    stacks = list(profiling.sampler.samples.elements())
+    assert any("_request_loop_work" in stack for stack in stacks)
+    assert any("_request_thread_work" in stack for stack in stacks)
+    assert not any("_idle_pool_thread" in stack or "_unprofiled_thread_work" in stack for stack in stacks)
@@ -0,0 +1,61 @@
+import os
+import time
+import multiprocessing
+
+from app import scratch
+
+
+def _hold_request_dir(ready, done):
+    # Worker lain (SCRATCH_DIR diwarisi lewat environment): memegang direktori
+    # request sampai request-nya selesai
+    path = scratch.create_request_dir()
+    ready.put(path)
+    done.wait(10)
+    scratch.remove_request_dir(path)
+
+
+def _age(path, seconds):
+    stamp = time.time() - seconds
+    os.utime(path, (stamp, stamp))
+
+
+def test_sweep_skips_dirs_in_use_by_another_worker(monkeypatch):
+    monkeypatch.setattr(scratch, "SCRATCH_MAX_AGE", 10)
+    monkeypatch.setattr(scratch, "SCRATCH_MIN_AGE", 5)
+    ctx = multiprocessing.get_context("spawn")
+    ready, done = ctx.Queue(), ctx.Event()
+    worker = ctx.Process(target=_hold_request_dir, args=(ready, done))
+    worker.start()
+    try:
+        busy = ready.get(timeout=10)
+        idle = scratch.create_request_dir()
+        scratch._active_dirs.pop(idle).release()  # ditinggalkan tanpa dihapus
+        for path in (busy, idle):
+            _age(path, 60)
+
+        scratch.sweep()
+
+        assert os.path.isdir(busy)
+        assert not os.path.exists(idle)
+    finally:
+        done.set()
+        worker.join(10)
+    assert not os.path.exists(busy)
+
+
+def test_sweep_never_evicts_young_dirs(monkeypatch):
+    monkeypatch.setattr(scratch, "SCRATCH_MAX_BYTES", 0)
+    monkeypatch.setattr(scratch, "SCRATCH_MIN_AGE", 600)
+    young = scratch.create_request_dir()
+    old = scratch.create_request_dir()
+    for path in (young, old):
+        scratch._active_dirs.pop(path).release()
+        with open(os.path.join(path, "audio.wav"), "wb") as f:
+            f.write(b"\0" * 1024)
+    _age(old, 1200)
+
+    scratch.sweep()
+
+    assert os.path.isdir(young)
+    assert not os.path.exists(old)
+    scratch.remove_request_dir(young)
@@ -0,0 +1,55 @@
+import asyncio
+
+from app import session_store
+from app.session_store import acquire_session_lock, release_session_lock
+from app.pipeline import SpeculativeDispatcher
+
+
+async def _cancel_while_waiting(session_id: str, dispatcher: SpeculativeDispatcher):
+    holder = acquire_session_lock(session_id)
+    waiting = asyncio.ensure_future(dispatcher._ensure_lock())
+    await asyncio.sleep(0.2)
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+    return holder
+
+
+def test_cancelled_lock_wait_does_not_leak_lock():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        first = SpeculativeDispatcher("cancel-wait", None, loop)
+        holder = await _cancel_while_waiting("cancel-wait", first)
+        await first.close()
+        await loop.run_in_executor(None, release_session_lock, "cancel-wait", holder)
+
+        # Giliran berikutnya untuk sesi yang sama tetap bisa mengambil lock
+        second = SpeculativeDispatcher("cancel-wait", None, loop)
+        await asyncio.wait_for(second._ensure_lock(), timeout=5)
+        await second.close()
+
+    asyncio.run(scenario())
+    assert "cancel-wait" not in session_store._process_leases
+
+
+def test_redraft_reuses_pending_lock_wait():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        dispatcher = SpeculativeDispatcher("redraft", None, loop)
+        holder = await _cancel_while_waiting("redraft", dispatcher)
+        await loop.run_in_executor(None, release_session_lock, "redraft", holder)
+
+        # Draf ulang (resolve) memakai hasil tunggu yang sama, tidak menunggu dirinya sendiri
+        await asyncio.wait_for(dispatcher._ensure_lock(), timeout=5)
+        assert dispatcher._lock_owner is not None
+        await dispatcher.close()
+
+    asyncio.run(scenario())
+    assert "redraft" not in session_store._process_leases
+
+
+def test_unreleased_lock_expires_with_ttl(monkeypatch):
+    monkeypatch.setattr(session_store, "SESSION_LOCK_TTL", 0.3)
+    acquire_session_lock("expired")
+    owner = acquire_session_lock("expired", timeout=5)
+    release_session_lock("expired", owner)
+    assert "expired" not in session_store._process_leases
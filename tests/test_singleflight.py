@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_identical_keys_share_one_result():
+    released = []
+    group = SingleFlight("test", release=released.append)
+    calls = []
+
+    async def work(token):
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "hasil"
+
+    async def scenario():
+        leases = await asyncio.gather(*(group.acquire("k", work) for _ in range(3)))
+        assert [lease.value for lease in leases] == ["hasil"] * 3
+        assert len(calls) == 1
+        # Hasil dibersihkan sekali, setelah pemakai terakhir melepasnya
+        for lease in leases[:-1]:
+            lease.release()
+        assert released == []
+        leases[-1].release()
+        leases[-1].release()
+        assert released == ["hasil"]
+
+        # Key dilepas setelah selesai: bukan cache
+        await group.acquire("k", work)
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+
+def test_one_waiter_cancelling_keeps_shared_work_running():
+    group = SingleFlight("test")
+    tokens = []
+
+    async def work(token):
+        tokens.append(token)
+        await asyncio.sleep(0.1)
+        return "hasil"
+
+    async def scenario():
+        first = asyncio.ensure_future(group.acquire("k", work))
+        second = asyncio.ensure_future(group.acquire("k", work))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        lease = await second
+        assert lease.value == "hasil"
+        assert first.cancelled() and not tokens[0].cancelled
+        lease.release()
+
+    asyncio.run(scenario())
+
+
+def test_all_waiters_abandoning_cancels_shared_work():
+    group = SingleFlight("test")
+    state = {}
+
+    async def work(token):
+        state["token"] = token
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    async def scenario():
+        waiters = [asyncio.ensure_future(group.acquire("k", work)) for _ in range(2)]
+        await asyncio.sleep(0.02)
+        waiters[0].cancel()
+        # Pemanggil kedua keluar karena timeout
+        with pytest.raises(asyncio.TimeoutError):
+            await group.acquire("k", work, timeout=0.05)
+        waiters[1].cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert state.get("cancelled") and state["token"].cancelled
+        assert group._flights == {}
+
+    asyncio.run(scenario())
+
+
+def test_error_releases_the_flight_and_next_caller_retries():
+    released = []
+    group = SingleFlight("test", release=released.append)
+    attempts = []
+
+    async def failing(token):
+        attempts.append(1)
+        await asyncio.sleep(0.02)
+        raise OSError("engine gagal")
+
+    async def scenario():
+        results = await asyncio.gather(*(group.acquire("k", failing) for _ in range(2)),
+                                       return_exceptions=True)
+        assert all(isinstance(r, OSError) for r in results)
+        assert len(attempts) == 1
+        assert group._flights == {}
+        assert released == []
+
+        async def working(token):
+            return "hasil"
+
+        lease = await group.acquire("k", working)
+        assert lease.value == "hasil"
+        lease.release()
+        assert released == ["hasil"]
+
+    asyncio.run(scenario())
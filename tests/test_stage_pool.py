@@ -0,0 +1,46 @@
+import asyncio
+
+from app import autotune, stage_pool
+from app.stage_pool import StageSlots, stage_ceiling
+
+
+def test_tuned_ceiling_never_shares_a_cpuset(monkeypatch):
+    cpusets = [[0, 1], [2, 3], [4, 5]]
+    monkeypatch.setattr(autotune, "_tuning", {
+        "stt": {"threads": 2, "instances": 2, "cpusets": cpusets},
+    })
+    monkeypatch.setitem(stage_pool.STAGE_LIMITS, "stt", 2)
+    monkeypatch.delenv("STT_CONCURRENCY_CEILING", raising=False)
+    ceiling = stage_ceiling("stt")
+    assert ceiling == len(cpusets)
+
+    pool = StageSlots("stt", 2, ceiling, adaptive=True)
+    # Limit didorong ke plafon; semua slot yang berjalan bersamaan harus beda core set
+    pool.limiter.limit = float(ceiling)
+
+    async def scenario():
+        held = []
+        release = asyncio.Event()
+
+        async def worker():
+            async with pool.acquire():
+                held.append(autotune.engine_settings("stt", stage_pool.current_slot.get())[1])
+                await release.wait()
+
+        tasks = [asyncio.ensure_future(worker()) for _ in range(ceiling + 2)]
+        await asyncio.sleep(0.05)
+        snapshot = list(held)
+        release.set()
+        await asyncio.gather(*tasks)
+        return snapshot
+
+    concurrent = asyncio.run(scenario())
+    assert len(concurrent) == ceiling
+    assert len({tuple(cpus) for cpus in concurrent}) == len(concurrent)
+
+
+def test_untuned_ceiling_defaults_to_twice_the_limit(monkeypatch):
+    monkeypatch.setattr(autotune, "_tuning", None)
+    monkeypatch.setitem(stage_pool.STAGE_LIMITS, "tts", 2)
+    monkeypatch.delenv("TTS_CONCURRENCY_CEILING", raising=False)
+    assert stage_ceiling("tts") == 4
@@ -0,0 +1,35 @@
+import time
+import asyncio
+
+from app import pipeline
+
+
+class FakeAudio:
+    def __init__(self):
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+
+def test_cancelled_synthesis_releases_worker_audio(monkeypatch):
+    produced = []
+
+    def synthesize(segment, token):
+        time.sleep(0.3)
+        produced.append(FakeAudio())
+        return produced[-1]
+
+    monkeypatch.setattr(pipeline.engine_workers, "available", lambda stage: True)
+    monkeypatch.setattr(pipeline.engine_workers, "synthesize", synthesize)
+
+    async def scenario():
+        task = asyncio.ensure_future(pipeline._synthesize_segment("Halo dunia."))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        # Thread sintesis masih berjalan setelah pembatalan
+        await asyncio.sleep(0.5)
+
+    asyncio.run(scenario())
+    assert len(produced) == 1 and produced[0].released
@@ -0,0 +1,85 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app import pipeline
+from app.pipeline import StageError
+from app.tts import _merge_short, split_sentences, stitch_arrays
+
+
+def test_merge_short_joins_pieces_below_minimum():
+    assert _merge_short(["Ya.", "Saya mengerti maksud Anda sekarang."]) == [
+        "Ya. Saya mengerti maksud Anda sekarang."
+    ]
+    long_a, long_b = "Kalimat pertama cukup panjang.", "Kalimat kedua juga cukup panjang."
+    assert _merge_short([long_a, long_b]) == [long_a, long_b]
+    assert _merge_short([]) == []
+
+
+def test_split_sentences_per_sentence_then_phrase():
+    text = "Hari ini cuacanya cerah sekali. Suhu udara sekitar tiga puluh derajat! Oke?"
+    assert split_sentences(text) == [
+        "Hari ini cuacanya cerah sekali.",
+        "Suhu udara sekitar tiga puluh derajat! Oke?",
+    ]
+
+    phrase = "bagian kalimat yang cukup panjang sekali"
+    long_sentence = ", ".join([phrase] * 8) + "."
+    segments = split_sentences(long_sentence)
+    assert len(segments) == 8
+    assert all(len(segment) <= 200 for segment in segments)
+    assert " ".join(segments) == long_sentence
+
+
+def test_split_sentences_never_empty():
+    assert split_sentences("") == [""]
+    assert split_sentences("Halo") == ["Halo"]
+
+
+def test_stitch_arrays_with_gap_and_crossfade():
+    rate = 1000
+    a = np.full(100, 16000, dtype=np.int16)
+    b = np.full(100, 16000, dtype=np.int16)
+
+    out = stitch_arrays([a, b], rate, gap_ms=50, fade_ms=10)
+    assert out.dtype == np.int16 and len(out) == 250
+    assert np.all(out[100:150] == 0)
+    # Fade keluar di ujung a dan fade masuk di awal b, tanpa lompatan
+    assert out[99] == 0 and out[150] == 0 and out[50] == 16000
+
+    out = stitch_arrays([a, b], rate, gap_ms=0, fade_ms=10)
+    assert len(out) == 190
+    assert np.all(np.abs(out[85:105].astype(int) - 16000) <= 1700)
+
+
+def test_stitch_arrays_accepts_float_input():
+    out = stitch_arrays([np.full(50, 2.0, dtype=np.float32), np.zeros(50, dtype=np.float32)], 1000)
+    assert out.max() == 32767
+
+
+def test_segment_failure_raises_stage_error_and_cancels_siblings(monkeypatch):
+    cancelled = []
+
+    async def synthesize(segment):
+        if segment.startswith("Gagal"):
+            raise OSError("disk penuh")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(segment)
+            raise
+        return SimpleNamespace(value="unused", release=lambda: None)
+
+    monkeypatch.setattr(pipeline, "_synthesize_segment", synthesize)
+    text = "Kalimat pertama yang lambat sekali. Gagal disintesis karena disk penuh."
+
+    async def scenario():
+        with pytest.raises(StageError) as excinfo:
+            await asyncio.wait_for(pipeline.synthesize_reply(text, "/tmp"), 2)
+        assert excinfo.value.stage == "tts"
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert cancelled == ["Kalimat pertama yang lambat sekali."]